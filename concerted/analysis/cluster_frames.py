@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Cluster relaxation / equilibration frames by active-site RMSD and write one
+representative structure per cluster as seeds for the FEP replicas.
+
+run_replica.sh starts replica000-015 of a mutant from the same relaxed
+structure, differing only in the random seed. Seeding them from distinct
+conformations of the relaxation covers more of the active site for the same
+number of replicas.
+
+Per mutant, frames are subsampled evenly over all matching DCD files (at
+most --max-frames), the active-site heavy atoms (rmsd_rmsf.py "active"
+selection) are centred and the full pairwise RMSD matrix is computed in
+blocks: the covariance matrices of a block of frame pairs come from one
+einsum, and the optimal-superposition RMSD follows from their singular
+values (Kabsch), without rotating any coordinates. The matrix is clustered
+with k-medoids (k-medoids++ start, alternating assignment / medoid update,
+best of several starts).
+
+Outputs per mutant in the output directory:
+
+    <mutant>/seed_00.pdb ...     medoid frames (full system, topology atom order)
+    clusters.csv                 mutant, cluster, size, fraction, trajectory,
+                                 frame, mean_rmsd, seed
+    replica_seeds.csv            mutant, replica, seed
+
+Replicas are shared out over the clusters in proportion to their size
+(every cluster gets at least one while there are replicas left), so
+replica_seeds.csv can be fed to q_genfeps.py --pdb one replica at a time.
+
+Usage:
+    python cluster_frames.py results_root [--pdb "{mutant_dir}/*.pdb"]
+                             [--pattern "relax_01*.dcd"] [-k 4] [--replicas 16] [-o seeds]
+"""
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+from dcd_reader import DCDFile
+from pdb_arrays import read_pdb, write_pdb
+from rmsd_rmsf import find_trajectories, selection_mask
+
+PATTERNS = ("relax_*.dcd",)
+N_CLUSTERS = 4
+N_REPLICAS = 16
+MAX_FRAMES = 300
+N_STARTS = 10
+PAIR_BLOCK = 50           # rows of the RMSD matrix per einsum
+
+
+def subsample(dcd_files, max_frames=MAX_FRAMES):
+    """(file index, frame index) pairs spread evenly over all frames."""
+    counts = [DCDFile(dcd).n_frames for dcd in dcd_files]
+    total = sum(counts)
+    if not total:
+        return np.zeros((0, 2), dtype=np.int64)
+    picks = np.unique(np.linspace(0, total - 1, min(max_frames, total)).round().astype(np.int64))
+    offsets = np.cumsum([0] + counts)
+    files = np.searchsorted(offsets, picks, side='right') - 1
+    return np.column_stack([files, picks - offsets[files]])
+
+
+def read_frames(dcd_files, picks, atoms=None):
+    """Coordinates (frames, atoms, 3) of the picked frames, one memmap per file."""
+    frames = []
+    for f, dcd in enumerate(dcd_files):
+        wanted = picks[picks[:, 0] == f, 1]
+        if len(wanted):
+            traj = DCDFile(dcd)
+            frames.extend(traj.read(i, i + 1, atoms)[0] for i in wanted)
+    return np.array(frames, dtype=np.float64)
+
+
+def pairwise_rmsd(frames, block=PAIR_BLOCK):
+    """Optimal-superposition RMSD between all frames (F, N, 3) -> (F, F)."""
+    centred = frames - frames.mean(axis=1, keepdims=True)
+    n_frames, n_atoms = centred.shape[:2]
+    norms = (centred ** 2).sum(axis=(1, 2))
+    rmsd = np.zeros((n_frames, n_frames))
+    for start in range(0, n_frames, block):
+        rows = centred[start:start + block]
+        h = np.einsum('ank,bnl->abkl', rows, centred)
+        s = np.linalg.svd(h, compute_uv=False)
+        # A reflection would be better than any rotation; use the proper rotation
+        s[..., -1] *= np.sign(np.linalg.det(h))
+        msd = (norms[start:start + block, None] + norms[None] - 2.0 * s.sum(axis=-1)) / n_atoms
+        rmsd[start:start + block] = np.sqrt(np.maximum(msd, 0.0))
+    np.fill_diagonal(rmsd, 0.0)
+    return (rmsd + rmsd.T) / 2
+
+
+def kmedoids(distances, k=N_CLUSTERS, n_starts=N_STARTS, seed=0, max_iter=100):
+    """(medoid indices, labels, cost) of the best of n_starts k-medoids runs."""
+    n = len(distances)
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    best = None
+    for _ in range(n_starts):
+        # k-medoids++: each new medoid is drawn with probability ~ squared distance
+        medoids = [int(rng.integers(n))]
+        for _ in range(k - 1):
+            weight = distances[:, medoids].min(axis=1) ** 2
+            if weight.sum() == 0:
+                break
+            medoids.append(int(rng.choice(n, p=weight / weight.sum())))
+        medoids = np.array(medoids)
+
+        for _ in range(max_iter):
+            labels = np.argmin(distances[:, medoids], axis=1)
+            updated = medoids.copy()
+            for c in range(len(medoids)):
+                members = np.flatnonzero(labels == c)
+                within = distances[np.ix_(members, members)].sum(axis=1)
+                updated[c] = members[np.argmin(within)]
+            if np.array_equal(updated, medoids):
+                break
+            medoids = updated
+        labels = np.argmin(distances[:, medoids], axis=1)
+        cost = distances[np.arange(n), medoids[labels]].sum()
+        if best is None or cost < best[2]:
+            best = (medoids, labels, cost)
+    return best
+
+
+def share_replicas(sizes, n_replicas=N_REPLICAS):
+    """Replicas per cluster: at least one each, the rest by largest remainder."""
+    sizes = np.asarray(sizes, dtype=np.float64)
+    order = np.argsort(-sizes, kind='stable')
+    counts = np.zeros(len(sizes), dtype=np.int64)
+    counts[order[:min(n_replicas, len(sizes))]] = 1
+    left = n_replicas - counts.sum()
+    if left > 0:
+        share = sizes / sizes.sum() * left
+        counts += np.floor(share).astype(np.int64)
+        remainder = share - np.floor(share)
+        counts[np.argsort(-remainder, kind='stable')[:n_replicas - counts.sum()]] += 1
+    return counts
+
+
+def cluster_mutant(mutant, dcd_files, pdb_file, out_dir, k=N_CLUSTERS, n_replicas=N_REPLICAS,
+                   max_frames=MAX_FRAMES):
+    """Cluster one mutant's frames and write its seed structures; returns CSV rows."""
+    atoms = read_pdb(pdb_file)
+    n_total = len(atoms["name"])
+    for dcd in dcd_files:
+        n_dcd = DCDFile(dcd).n_atoms
+        if n_dcd != n_total:
+            raise ValueError(f"{dcd}: {n_dcd} atoms, {pdb_file} has {n_total}")
+    active = np.flatnonzero(selection_mask(atoms, "active"))
+    picks = subsample(dcd_files, max_frames)
+    if len(picks) == 0:
+        return mutant, [], []
+
+    distances = pairwise_rmsd(read_frames(dcd_files, picks, active))
+    medoids, labels, _ = kmedoids(distances, k)
+    sizes = np.bincount(labels, minlength=len(medoids))
+    os.makedirs(os.path.join(out_dir, mutant), exist_ok=True)
+
+    cluster_rows = []
+    seeds = []
+    for c, medoid in enumerate(medoids):
+        file_index, frame = picks[medoid]
+        seed = os.path.join(out_dir, mutant, f"seed_{c:02d}.pdb")
+        write_pdb(atoms, seed, xyz=read_frames(dcd_files, picks[medoid:medoid + 1])[0])
+        members = labels == c
+        cluster_rows.append([mutant, c, int(sizes[c]), round(sizes[c] / len(labels), 3),
+                             os.path.basename(dcd_files[file_index]), int(frame),
+                             round(float(distances[medoid, members].mean()), 3), seed])
+        seeds.append(seed)
+
+    replica_rows = []
+    replica = 0
+    for c, count in enumerate(share_replicas(sizes, n_replicas)):
+        for _ in range(count):
+            replica_rows.append([mutant, f"replica{replica:03d}", seeds[c]])
+            replica += 1
+    return mutant, cluster_rows, replica_rows
+
+
+def _cluster_mutant(args):
+    return cluster_mutant(*args)
+
+
+def find_tasks(root, patterns, pdb_pattern, out_dir, k, n_replicas, max_frames):
+    return [(mutant, dcds, pdb, out_dir, k, n_replicas, max_frames)
+            for mutant, dcds, pdb in find_trajectories(root, patterns, pdb_pattern)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Active-site RMSD clustering of frames into "
+                                                 "replica seeds")
+    parser.add_argument("root", help="directory with one sub-directory per mutant")
+    parser.add_argument("--pdb", default="{mutant_dir}/*.pdb",
+                        help="glob for the topology structure ({mutant_dir}, {mutant})")
+    parser.add_argument("--pattern", action="append",
+                        help="DCD file pattern (default: relax_*.dcd)")
+    parser.add_argument("-k", "--clusters", type=int, default=N_CLUSTERS)
+    parser.add_argument("--replicas", type=int, default=N_REPLICAS,
+                        help="replicas to share out over the clusters")
+    parser.add_argument("--max-frames", type=int, default=MAX_FRAMES,
+                        help="frames in the pairwise RMSD matrix")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default="seeds")
+    args = parser.parse_args()
+
+    tasks = find_tasks(args.root, args.pattern or PATTERNS, args.pdb, args.output,
+                       args.clusters, args.replicas, args.max_frames)
+    if not tasks:
+        print(f"No trajectories found under {args.root}")
+        sys.exit(1)
+    os.makedirs(args.output, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(_cluster_mutant, tasks))
+
+    with open(os.path.join(args.output, "clusters.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["mutant", "cluster", "size", "fraction", "trajectory", "frame",
+                         "mean_rmsd", "seed"])
+        for _, rows, _ in results:
+            writer.writerows(rows)
+    with open(os.path.join(args.output, "replica_seeds.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["mutant", "replica", "seed"])
+        for _, _, rows in results:
+            writer.writerows(rows)
+
+    for mutant, rows, replicas in results:
+        sizes = " ".join(f"{row[2]}" for row in rows)
+        print(f"{mutant:12s} {len(rows)} clusters (sizes {sizes}), {len(replicas)} replicas")
+    print(f"\nSeeds written to {args.output}/")
+
+
+if __name__ == "__main__":
+    main()
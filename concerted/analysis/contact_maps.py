@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Sparse residue-residue contact maps for many structures and trajectory frames.
+
+Two residues are in contact when their closest heavy atoms are within the
+cutoff (default 4.5 Å). Atom pairs come from a cell-list search: atoms are
+binned into cubic cells of the cutoff size and only the 13 forward
+neighbour cells plus the own cell are compared, all cells at once with
+NumPy. Each map is a scipy.sparse CSR matrix (upper triangle, value = the
+minimum distance), so nothing is ever N_res x N_res dense.
+
+ContactFrequency accumulates binary contacts over frames and structures
+(contact frequency = count / n_maps). contact_features() turns a set of
+maps or frequencies into a sparse (structures x residue pairs) matrix over
+the pairs that differ between structures; that is the structural feature
+table the clustering in yield_2.py (KMeans / linkage) reads from
+contact_features.npz.
+
+Rows are labelled with the experimental variant name derived from the
+structure name (LMRR_WT2_TRP95A -> W96A, see variant_name), or from a
+--labels CSV for names the rule does not cover.
+
+Usage:
+    python contact_maps.py [pdb_or_dir ...] [--cutoff 4.5] [--dcd "traj/{name}/*.dcd"]
+                           [--labels variants.csv] [-o contact_maps]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+from pdb_arrays import heavy_mask, list_pdb_files, read_pdb, residue_index
+
+DEFAULT_MUTANTS = os.path.join(HERE, "..", "prep_structures", "mutations")
+
+CONTACT_CUTOFF = 4.5      # Å, minimum heavy-atom distance
+MIN_SEPARATION = 2        # skip i, i+1 (always in contact through the peptide bond)
+SKIP_RESIDUES = ("HOH", "WAT")
+
+THREE_TO_ONE = {"ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C", "GLN": "Q",
+                "GLU": "E", "GLY": "G", "HIS": "H", "HID": "H", "HIE": "H", "HIP": "H",
+                "ILE": "I", "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F", "PRO": "P",
+                "SER": "S", "THR": "T", "TRP": "W", "TYR": "Y", "VAL": "V"}
+# LMRR_WT2 lacks Val15 of the LmrR sequence, so from residue 15 on the
+# experimental number is one higher (ASN14 is N14A, ILE15 is I16A)
+NUMBERING_GAP = 15
+
+# Forward half of the 26 neighbour cells; with the own cell every pair is seen once
+HALF_SHELL = np.array([(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+                       if (dx, dy, dz) > (0, 0, 0)])
+
+
+def cell_list_pairs(xyz, cutoff):
+    """All atom pairs (i < j by cell order) closer than cutoff: (i, j, distance)."""
+    cells = np.floor((xyz - xyz.min(axis=0)) / cutoff).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    cell_id = cells[:, 0] + dims[0] * (cells[:, 1] + dims[1] * cells[:, 2])
+    order = np.argsort(cell_id, kind='stable')
+    n_cells = int(np.prod(dims))
+    starts = np.searchsorted(cell_id[order], np.arange(n_cells + 1))
+    counts = np.diff(starts)
+
+    pairs_i, pairs_j = [], []
+    for offset in np.vstack([(0, 0, 0), HALF_SHELL]):
+        neighbour = cells + offset
+        valid = np.all((neighbour >= 0) & (neighbour < dims), axis=1)
+        atoms_i = np.flatnonzero(valid)
+        nb = neighbour[valid]
+        nb_id = nb[:, 0] + dims[0] * (nb[:, 1] + dims[1] * nb[:, 2])
+        n = counts[nb_id]
+        i = np.repeat(atoms_i, n)
+        # Position of each candidate inside its neighbour cell
+        within = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        j = order[np.repeat(starts[nb_id], n) + within]
+        if not offset.any():
+            keep = j > i
+            i, j = i[keep], j[keep]
+        pairs_i.append(i)
+        pairs_j.append(j)
+
+    i, j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+    d = np.linalg.norm(xyz[i] - xyz[j], axis=1)
+    close = d < cutoff
+    return i[close], j[close], d[close]
+
+
+def select_atoms(atoms):
+    """(heavy atom indices, their residue index, number of residues)."""
+    res = residue_index(atoms)
+    keep = np.flatnonzero(heavy_mask(atoms) & ~np.isin(atoms["resname"], SKIP_RESIDUES))
+    n_res = int(res[keep].max()) + 1 if len(keep) else 0
+    return keep, res[keep], n_res
+
+
+def contact_map(xyz, res, n_res, cutoff=CONTACT_CUTOFF, min_separation=MIN_SEPARATION):
+    """Upper-triangular CSR matrix of minimum heavy-atom distances below cutoff."""
+    i, j, d = cell_list_pairs(xyz, cutoff)
+    ri, rj = res[i], res[j]
+    ri, rj = np.minimum(ri, rj), np.maximum(ri, rj)
+    keep = (rj - ri) >= min_separation
+    ri, rj, d = ri[keep], rj[keep], d[keep]
+
+    # Minimum distance per residue pair
+    pair = ri * n_res + rj
+    order = np.lexsort((d, pair))
+    pair, d = pair[order], d[order]
+    first = np.r_[True, pair[1:] != pair[:-1]][:len(pair)]
+    pair, d = pair[first], d[first]
+    return sparse.csr_matrix((d, (pair // n_res, pair % n_res)), shape=(n_res, n_res))
+
+
+class ContactFrequency:
+    """Running contact counts over frames and/or structures of equal residue count."""
+
+    def __init__(self, n_res):
+        self.n_res = n_res
+        self.counts = sparse.csr_matrix((n_res, n_res), dtype=np.int64)
+        self.n_maps = 0
+
+    def add(self, matrix):
+        if matrix.shape != (self.n_res, self.n_res):
+            raise ValueError(f"contact map shape {matrix.shape} does not match "
+                             f"{(self.n_res, self.n_res)}")
+        binary = matrix.copy()
+        binary.data = np.ones_like(binary.data, dtype=np.int64)
+        self.counts = self.counts + binary
+        self.n_maps += 1
+
+    def merge(self, other):
+        self.counts = self.counts + other.counts
+        self.n_maps += other.n_maps
+
+    def frequency(self):
+        return self.counts.astype(np.float64) / max(self.n_maps, 1)
+
+
+def structure_contacts(filename, dcd_pattern=None, stride=10, cutoff=CONTACT_CUTOFF):
+    """
+    Contact frequency map of one structure: the static contacts, or the
+    frequencies over its trajectory frames when DCD files match.
+    """
+    atoms = read_pdb(filename)
+    keep, res, n_res = select_atoms(atoms)
+    accumulator = ContactFrequency(n_res)
+
+    dcds = []
+    if dcd_pattern:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        dcds = sorted(glob.glob(dcd_pattern.format(name=name)))
+    if not dcds:
+        accumulator.add(contact_map(atoms["xyz"][keep], res, n_res, cutoff))
+        return filename, accumulator
+
+    from dcd_reader import DCDFile
+    for dcd in dcds:
+        traj = DCDFile(dcd)
+        if traj.n_atoms != len(atoms["name"]):
+            raise ValueError(f"{dcd}: {traj.n_atoms} atoms, {filename} has {len(atoms['name'])}")
+        for _, xyz in traj.iter_chunks(200, atoms=keep, step=stride):
+            for frame in xyz.astype(np.float64):
+                accumulator.add(contact_map(frame, res, n_res, cutoff))
+    return filename, accumulator
+
+
+def _structure_contacts(args):
+    return structure_contacts(*args)
+
+
+def contact_features(matrices, labels):
+    """
+    Sparse (structures x residue pairs) feature matrix over all pairs that are
+    in contact in at least one structure but not identical in all of them.
+    Returns (csr matrix, row labels, column labels 'i-j' with 1-based residues).
+    """
+    n_res = max(m.shape[0] for m in matrices)
+    rows = []
+    for m in matrices:
+        coo = m.tocoo()
+        rows.append(sparse.csr_matrix((coo.data, (np.zeros_like(coo.row), coo.row * n_res + coo.col)),
+                                      shape=(1, n_res * n_res)))
+    features = sparse.vstack(rows).tocsc()
+
+    # Drop columns that carry no information (same value in every structure)
+    varies = features.max(axis=0).toarray().ravel() != features.min(axis=0).toarray().ravel()
+    columns = np.flatnonzero(varies)
+    features = features[:, columns].tocsr()
+    names = [f"{c // n_res + 1}-{c % n_res + 1}" for c in columns]
+    return features, list(labels), names
+
+
+def save_features(filename, features, row_labels, column_labels):
+    np.savez_compressed(filename, data=features.data, indices=features.indices,
+                        indptr=features.indptr, shape=features.shape,
+                        rows=np.array(row_labels), columns=np.array(column_labels))
+
+
+def load_features(filename):
+    """(csr matrix, row labels, column labels) written by save_features."""
+    data = np.load(filename)
+    matrix = sparse.csr_matrix((data["data"], data["indices"], data["indptr"]),
+                               shape=tuple(data["shape"]))
+    return matrix, data["rows"].tolist(), data["columns"].tolist()
+
+
+def variant_name(stem):
+    """
+    Experimental variant name of a mutant structure (LMRR_WT2_TRP95A -> W96A,
+    LMRR_WT2_ALA11L -> A11L); the stem itself if it does not end in one.
+    """
+    match = re.search(r"([A-Z]{3})(\d+)([A-Z])$", stem)
+    if not match or match.group(1) not in THREE_TO_ONE:
+        return stem
+    resseq = int(match.group(2))
+    return f"{THREE_TO_ONE[match.group(1)]}{resseq + (resseq >= NUMBERING_GAP)}{match.group(3)}"
+
+
+def read_labels(filename):
+    """Structure stem -> variant name mapping from a two-column CSV."""
+    with open(filename, 'r') as f:
+        return {row[0]: row[1] for row in csv.reader(f) if len(row) >= 2}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sparse residue contact maps")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_MUTANTS],
+                        help="PDB files or directories (default: prep_structures/mutations)")
+    parser.add_argument("--cutoff", type=float, default=CONTACT_CUTOFF)
+    parser.add_argument("--dcd", help="DCD glob per structure for frequencies ({name} = stem)")
+    parser.add_argument("--stride", type=int, default=10)
+    parser.add_argument("--labels", help="CSV structure_stem,variant overriding the derived "
+                                         "names (e.g. LMRR_WT2_TRP95A,W96A)")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default="contact_maps")
+    args = parser.parse_args()
+
+    filenames = [f for path in args.paths for f in list_pdb_files(path)]
+    os.makedirs(args.output, exist_ok=True)
+    tasks = [(f, args.dcd, args.stride, args.cutoff) for f in filenames]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(_structure_contacts, tasks))
+
+    mapping = read_labels(args.labels) if args.labels else {}
+    labels, matrices = [], []
+    total = None
+    for filename, accumulator in results:
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        frequency = accumulator.frequency()
+        sparse.save_npz(os.path.join(args.output, f"{stem}.npz"), frequency)
+        labels.append(mapping.get(stem, variant_name(stem)))
+        matrices.append(frequency)
+        if total is None:
+            total = ContactFrequency(accumulator.n_res)
+        if accumulator.n_res == total.n_res:
+            total.merge(accumulator)
+        print(f"{stem:32s} {accumulator.n_maps:6d} map(s) {frequency.nnz:7d} contacts")
+
+    sparse.save_npz(os.path.join(args.output, "library_frequency.npz"), total.frequency())
+    features, rows, columns = contact_features(matrices, labels)
+    feature_file = os.path.join(args.output, "contact_features.npz")
+    save_features(feature_file, features, rows, columns)
+    print(f"\n{features.shape[0]} structures x {features.shape[1]} varying residue pairs "
+          f"({features.nnz} non-zero) written to {feature_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped reader for the CHARMM-format DCD trajectories written by qdyn5.
+
+The frames are mapped with one structured NumPy dtype, so reading a block of
+frames is a slice of the memmap rather than a loop over Fortran records:
+
+    traj = DCDFile("fep_025_0.500.dcd")
+    traj.n_frames, traj.n_atoms
+    for start, xyz in traj.iter_chunks(500, atoms=selection):
+        ...                                  # xyz is (frames, atoms, 3) float32
+
+The frame count is taken from the file size (qdyn5 does not always update
+NSET in the header when a run is cut short). Trajectories with fixed atoms
+are not supported.
+"""
+
+import struct
+import sys
+
+import numpy as np
+
+
+class DCDFile:
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            head = f.read(4)
+            if len(head) < 4:
+                raise ValueError(f"{filename}: empty DCD file")
+            if struct.unpack('<i', head)[0] == 84:
+                self.endian = '<'
+            elif struct.unpack('>i', head)[0] == 84:
+                self.endian = '>'
+            else:
+                raise ValueError(f"{filename}: not a DCD file")
+            e = self.endian
+
+            magic = f.read(4)
+            if magic != b'CORD':
+                raise ValueError(f"{filename}: unexpected DCD magic {magic!r}")
+            icntrl = struct.unpack(f'{e}20i', f.read(80))
+            f.read(4)
+            self.istart, self.nsavc = icntrl[1], icntrl[2]
+            self.timestep = struct.unpack(f'{e}f', struct.pack(f'{e}i', icntrl[9]))[0]
+            if icntrl[8] != 0:
+                raise ValueError(f"{filename}: DCD files with fixed atoms are not supported")
+
+            size = struct.unpack(f'{e}i', f.read(4))[0]
+            block = f.read(size)
+            f.read(4)
+            n_titles = struct.unpack(f'{e}i', block[:4])[0]
+            self.titles = [block[4 + 80 * i:84 + 80 * i].decode('ascii', 'replace').strip()
+                           for i in range(n_titles)]
+
+            f.read(4)
+            self.n_atoms = struct.unpack(f'{e}i', f.read(4))[0]
+            f.read(4)
+            self.header_size = f.tell()
+
+            # A unit cell record (48 bytes of doubles) may precede every frame
+            marker = f.read(4)
+            self.has_cell = len(marker) == 4 and struct.unpack(f'{e}i', marker)[0] == 48
+
+        fields = []
+        if self.has_cell:
+            fields += [('cell_head', f'{e}i4'), ('cell', f'{e}f8', 6), ('cell_tail', f'{e}i4')]
+        for axis in 'xyz':
+            fields += [(f'{axis}_head', f'{e}i4'), (axis, f'{e}f4', self.n_atoms),
+                       (f'{axis}_tail', f'{e}i4')]
+        self.frame_dtype = np.dtype(fields)
+
+        file_size = np.memmap(filename, dtype='u1', mode='r').shape[0]
+        self.n_frames = (file_size - self.header_size) // self.frame_dtype.itemsize
+        self._frames = (np.memmap(filename, dtype=self.frame_dtype, mode='r',
+                                  offset=self.header_size, shape=(self.n_frames,))
+                        if self.n_frames else np.zeros(0, dtype=self.frame_dtype))
+
+    def __len__(self):
+        return self.n_frames
+
+    def read(self, start=0, stop=None, atoms=None):
+        """Coordinates of frames [start, stop) as a (frames, atoms, 3) array."""
+        block = self._frames[start:stop]
+        if atoms is None:
+            return np.stack([block['x'], block['y'], block['z']], axis=-1)
+        return np.stack([block['x'][:, atoms], block['y'][:, atoms], block['z'][:, atoms]],
+                        axis=-1)
+
+    def iter_chunks(self, chunk=500, atoms=None, start=0, stop=None, step=1):
+        """Yield (first frame index, xyz) for consecutive blocks of frames."""
+        stop = self.n_frames if stop is None else min(stop, self.n_frames)
+        for first in range(start, stop, chunk * step):
+            last = min(first + chunk * step, stop)
+            yield first, self.read(first, last, atoms)[::step]
+
+
+def write_dcd(filename, xyz, timestep=0.0, title="written by dcd_reader.py"):
+    """Write (frames, atoms, 3) coordinates as a little-endian DCD without unit cell."""
+    xyz = np.asarray(xyz, dtype='<f4')
+    n_frames, n_atoms = xyz.shape[:2]
+    icntrl = [0] * 20
+    icntrl[0], icntrl[1], icntrl[2] = n_frames, 1, 1
+    icntrl[19] = 24
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<i4s', 84, b'CORD'))
+        f.write(struct.pack('<9i', *icntrl[:9]))
+        f.write(struct.pack('<f', timestep))
+        f.write(struct.pack('<10i', *icntrl[10:]))
+        f.write(struct.pack('<i', 84))
+        f.write(struct.pack('<ii80si', 84, 1, title.ljust(80)[:80].encode('ascii'), 84))
+        f.write(struct.pack('<iii', 4, n_atoms, 4))
+        record = struct.pack('<i', 4 * n_atoms)
+        for frame in xyz:
+            for axis in range(3):
+                f.write(record)
+                f.write(frame[:, axis].tobytes())
+                f.write(record)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: dcd_reader.py trajectory.dcd [...]")
+        sys.exit(1)
+
+    for filename in sys.argv[1:]:
+        traj = DCDFile(filename)
+        print(f"{filename}: {traj.n_frames} frames, {traj.n_atoms} atoms"
+              f"{', unit cell' if traj.has_cell else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Trajectory-averaged distances between active-site residues and the reacting
+atoms, per mutant and per FEP window.
+
+mutant_CA_to_IMI_N2_distances.txt is one static snapshot. This script
+streams the qdyn5 DCD frames of the reactant-state (fep_000_1.000.dcd) and
+transition-state (fep_025_0.500.dcd) windows of every mutant instead, over
+all replicas, and accumulates for each (residue, reacting atom) pair
+
+    min   closest heavy-atom distance of the residue
+    CA    CA distance (comparable with the static file)
+
+as mean, standard deviation and a histogram (0-20 Å, 0.1 Å bins). The
+mean and standard deviation cover every frame; distances outside the
+histogram range are not binned but counted in the underflow (< 0 Å) and
+overflow (>= 20 Å) arrays of the .npz, so hist.sum(-1) + underflow +
+overflow is n_frames for every pair. Frames are read in chunks straight from the memory-mapped DCD and all distances of
+a chunk come from one broadcast, with the per-residue minimum taken by
+np.minimum.reduceat.
+
+Results are stored per window as <mutant>_<window>.npz and cached through
+prep_scripts/artifact_cache.py on the DCD/PDB contents and the settings, so
+re-running after new mutants finish only processes the new windows.
+
+Expected layout (as produced by copy_dcd.sh / copying_files.md):
+
+    results_root/<mutant>/replica000/fep_000_1.000.dcd ...
+    results_root/<mutant>/<any>.pdb      solvated structure, same atom order
+
+Usage:
+    python distance_profiles.py results_root [--pdb "{mutant_dir}/*.pdb"]
+                                [--window RS=000 --window TS=025] [-o profiles]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+sys.path.insert(0, os.path.join(HERE, "..", "prep_scripts"))
+import artifact_cache
+from dcd_reader import DCDFile
+from pdb_arrays import find_atom, heavy_mask, read_pdb, residue_index, residue_table
+
+# The 20 alanine-scan / mutant positions
+ACTIVE_SITE = (7, 9, 10, 11, 14, 15, 17, 18, 21, 87, 88, 91, 92, 94, 95, 96, 98, 99,
+               100, 103)
+REACTING_ATOMS = ("IMI:N2", "IMI:C10", "HO2:O3")
+WINDOWS = {"RS": "000", "TS": "025"}
+MEASURES = ("min", "CA")
+
+HIST_EDGES = np.arange(0.0, 20.0 + 1e-9, 0.1)
+CHUNK_FRAMES = 500
+PROFILE_VERSION = 2       # .npz layout, part of the cache key
+
+
+def build_selection(atoms, residues=ACTIVE_SITE, references=REACTING_ATOMS):
+    """
+    Atom indices needed for the kernel: heavy atoms of the active-site
+    residues (grouped by residue), followed by the reacting atoms.
+    """
+    res = residue_index(atoms)
+    table = residue_table(atoms)
+    # Q numbering: residue n is the n-th residue of the topology
+    wanted = np.array([r - 1 for r in residues if r - 1 < len(table["resseq"])])
+    mask = heavy_mask(atoms) & np.isin(res, wanted)
+    res_atoms = np.flatnonzero(mask)
+    res_atoms = res_atoms[np.argsort(res[res_atoms], kind='stable')]
+
+    group = res[res_atoms]
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    present = group[starts]
+    ca = np.array([np.flatnonzero((group == r) & (atoms["name"][res_atoms] == "CA"))[0]
+                   for r in present])
+
+    refs = []
+    for ref in references:
+        resname, name = ref.split(':')
+        index = find_atom(atoms, resname=resname, name=name)
+        if index is None:
+            raise ValueError(f"reacting atom {ref} not found")
+        refs.append(index)
+
+    labels = np.char.add(table["resname"][present], (present + 1).astype(str))
+    return {"atoms": np.r_[res_atoms, refs], "n_res_atoms": len(res_atoms),
+            "starts": starts, "ca": ca, "labels": labels}
+
+
+def accumulate(traj, selection, chunk=CHUNK_FRAMES, edges=HIST_EDGES):
+    """Stream one trajectory; returns (n_frames, sums, sumsq, hist, underflow, overflow)."""
+    n_res = len(selection["starts"])
+    n_ref = len(selection["atoms"]) - selection["n_res_atoms"]
+    shape = (n_res, n_ref, len(MEASURES))
+    sums, sumsq = np.zeros(shape), np.zeros(shape)
+    n_bins = len(edges) - 1
+    hist = np.zeros(shape + (n_bins,), dtype=np.int64)
+    underflow = np.zeros(shape, dtype=np.int64)
+    overflow = np.zeros(shape, dtype=np.int64)
+    n_frames = 0
+
+    split = selection["n_res_atoms"]
+    for _, xyz in traj.iter_chunks(chunk, atoms=selection["atoms"]):
+        res_xyz, ref_xyz = xyz[:, :split], xyz[:, split:]
+        # (frames, residue atoms, references)
+        d = np.linalg.norm(res_xyz[:, :, None, :] - ref_xyz[:, None, :, :], axis=-1)
+        values = np.stack([np.minimum.reduceat(d, selection["starts"], axis=1),
+                           d[:, selection["ca"]]], axis=-1).astype(np.float64)
+
+        sums += values.sum(axis=0)
+        sumsq += (values ** 2).sum(axis=0)
+        bins = np.searchsorted(edges, values, side='right') - 1
+        below, above = bins < 0, bins >= n_bins
+        underflow += below.sum(axis=0)
+        overflow += above.sum(axis=0)
+        inside = ~(below | above)
+        flat = np.arange(np.prod(shape)).reshape(shape) * n_bins + bins
+        hist += np.bincount(flat[inside], minlength=hist.size).reshape(hist.shape)
+        n_frames += len(xyz)
+    return n_frames, sums, sumsq, hist, underflow, overflow
+
+
+def profile_window(mutant, window, dcd_files, pdb_file, output, residues, references):
+    """Profile all replicas of one window, using the artefact cache if possible."""
+    key = artifact_cache.files_key(
+        "distance_profile", [pdb_file] + dcd_files,
+        extra=[",".join(map(str, residues)), ",".join(references),
+               f"{HIST_EDGES[0]}:{HIST_EDGES[-1]}:{len(HIST_EDGES)}", PROFILE_VERSION])
+    if artifact_cache.fetch(key, [output]):
+        return mutant, window, output, True
+
+    atoms = read_pdb(pdb_file)
+    selection = build_selection(atoms, residues, references)
+    total = None
+    for dcd in dcd_files:
+        traj = DCDFile(dcd)
+        if traj.n_atoms != len(atoms["name"]):
+            raise ValueError(f"{dcd}: {traj.n_atoms} atoms, {pdb_file} has {len(atoms['name'])}")
+        result = accumulate(traj, selection)
+        total = result if total is None else tuple(a + b for a, b in zip(total, result))
+
+    n_frames, sums, sumsq, hist, underflow, overflow = total
+    mean = sums / max(n_frames, 1)
+    std = np.sqrt(np.maximum(sumsq / max(n_frames, 1) - mean ** 2, 0.0))
+    np.savez_compressed(output, residues=selection["labels"], references=np.array(references),
+                        measures=np.array(MEASURES), n_frames=n_frames, n_replicas=len(dcd_files),
+                        mean=mean, std=std, hist=hist, underflow=underflow,
+                        overflow=overflow, edges=HIST_EDGES)
+    artifact_cache.put(key, [output])
+    return mutant, window, output, False
+
+
+def _profile_window(args):
+    return profile_window(*args)
+
+
+def find_windows(root, windows, pdb_pattern):
+    """
+    [(mutant, window, dcd files, structure)] of every window with DCD files
+    under root (also used by pocket_tracker.py).
+    """
+    found = []
+    for mutant_dir in sorted(d for d in glob.glob(os.path.join(root, "*")) if os.path.isdir(d)):
+        mutant = os.path.basename(mutant_dir)
+        pdbs = sorted(glob.glob(pdb_pattern.format(mutant_dir=mutant_dir, mutant=mutant)))
+        for window, index in windows.items():
+            dcds = sorted(glob.glob(os.path.join(mutant_dir, "**", f"fep_{index}_*.dcd"),
+                                    recursive=True))
+            if not dcds:
+                continue
+            if not pdbs:
+                print(f"{mutant}: no structure matching {pdb_pattern}, skipped")
+                break
+            found.append((mutant, window, dcds, pdbs[0]))
+    return found
+
+
+def find_tasks(root, windows, pdb_pattern, out_dir, residues, references):
+    return [(mutant, window, dcds, pdb, os.path.join(out_dir, f"{mutant}_{window}.npz"),
+             tuple(residues), tuple(references))
+            for mutant, window, dcds, pdb in find_windows(root, windows, pdb_pattern)]
+
+
+def write_summary(results, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["mutant", "window", "residue", "reference", "measure",
+                         "n_frames", "mean", "std"])
+        for mutant, window, output, _ in results:
+            data = np.load(output)
+            for r, residue in enumerate(data["residues"]):
+                for k, reference in enumerate(data["references"]):
+                    for m, measure in enumerate(data["measures"]):
+                        writer.writerow([mutant, window, residue, reference, measure,
+                                         int(data["n_frames"]), f"{data['mean'][r, k, m]:.3f}",
+                                         f"{data['std'][r, k, m]:.3f}"])
+
+
+def add_window_arguments(parser):
+    """Arguments shared by the per-window trajectory scripts."""
+    parser.add_argument("root", help="directory with one sub-directory per mutant")
+    parser.add_argument("--pdb", default="{mutant_dir}/*.pdb",
+                        help="glob for the solvated structure ({mutant_dir}, {mutant})")
+    parser.add_argument("--window", action="append",
+                        help="NAME=INDEX, e.g. RS=000 (default: RS=000 TS=025)")
+    parser.add_argument("--jobs", type=int, default=None)
+
+
+def parse_windows(values):
+    """{name: index} from NAME=INDEX arguments (default WINDOWS)."""
+    return dict(w.split('=') for w in values) if values else WINDOWS
+
+
+def run_windows(function, tasks, root, jobs=None):
+    """Run one function per window task in worker processes and report each."""
+    if not tasks:
+        print(f"No fep_*.dcd files found under {root}")
+        sys.exit(1)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(function, tasks))
+    for mutant, window, _, cached in results:
+        print(f"{mutant:12s} {window:4s} {'cached' if cached else 'done'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trajectory-averaged residue - reaction centre "
+                                                 "distance profiles")
+    add_window_arguments(parser)
+    parser.add_argument("--residues", type=int, nargs="+", default=list(ACTIVE_SITE))
+    parser.add_argument("--ref", action="append", help="reacting atom RESN:NAME")
+    parser.add_argument("-o", "--output", default="distance_profiles",
+                        help="directory for the per-window .npz files and summary.csv")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    tasks = find_tasks(args.root, parse_windows(args.window), args.pdb, args.output,
+                       args.residues, args.ref or REACTING_ATOMS)
+    results = run_windows(_profile_window, tasks, args.root, args.jobs)
+
+    summary = os.path.join(args.output, "summary.csv")
+    write_summary(results, summary)
+    print(f"\n{len(results)} windows, summary written to {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Active-site pocket volume and water count per frame, streamed over the FEP
+windows of every mutant.
+
+The pocket is found on a cubic grid (default 0.5 Å spacing, 24 Å edge)
+centred on the substrate complex (IMI / IND / HO2) of each frame:
+
+  1. protein atoms are painted onto the grid with precomputed spherical
+     masks, one integer-offset mask per van der Waals radius class stamped
+     around the nearest grid point, so all atoms of a class are painted
+     with a single broadcast;
+  2. an empty grid point is buried when protein is found on both sides of
+     it along at least MIN_BURIED of the x, y and z lines through it
+     (the POCKET / LIGSITE protein-solvent-protein criterion, done with
+     cumulative maxima along each axis);
+  3. the pocket is the connected buried region (scipy.ndimage.label) that
+     touches the substrate complex, painted the same way.
+
+Per frame this gives the pocket volume, the part of it not taken by the
+substrate complex (free volume) and the number of water oxygens inside the
+pocket. Results are stored per window as <mutant>_<window>_pocket.npz
+(cached through prep_scripts/artifact_cache.py like distance_profiles.py)
+and summarised in pocket_summary.csv for correlating with ΔG* and yields.
+
+Expected layout (windows are found by distance_profiles.find_windows):
+
+    results_root/<mutant>/replica000/fep_000_1.000.dcd ...
+    results_root/<mutant>/<any>.pdb      solvated structure, same atom order
+
+Usage:
+    python pocket_tracker.py results_root [--pdb "{mutant_dir}/*.pdb"]
+                             [--window RS=000 --window TS=025] [--spacing 0.5] [-o pockets]
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+from scipy import ndimage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+sys.path.insert(0, os.path.join(HERE, "..", "prep_scripts"))
+import artifact_cache
+from dcd_reader import DCDFile
+from distance_profiles import add_window_arguments, find_windows, parse_windows, run_windows
+from pdb_arrays import read_pdb
+
+SUBSTRATE_RESIDUES = ("IMI", "IND", "HO2", "PAF", "PRD", "UNL")
+WATER_RESIDUES = ("HOH", "WAT")
+
+SPACING = 0.5             # Å
+BOX_SIZE = 24.0           # Å, edge of the grid cube
+MIN_BURIED = 2            # axes with protein on both sides
+# Bondi van der Waals radii (Å)
+VDW_RADII = {"H": 1.10, "C": 1.70, "N": 1.55, "O": 1.52, "S": 1.80, "P": 1.80}
+DEFAULT_RADIUS = 1.80
+CHUNK_FRAMES = 200
+
+
+class PocketGrid:
+    """Grid geometry plus one precomputed sphere mask per radius class."""
+
+    def __init__(self, radii, spacing=SPACING, box_size=BOX_SIZE):
+        self.spacing = spacing
+        self.n = int(round(box_size / spacing))
+        self.classes, self.atom_class = np.unique(radii, return_inverse=True)
+        # Grid offsets within each radius of the grid point nearest to the atom
+        self.reach = int(np.ceil(self.classes.max() / spacing))
+        span = np.arange(-self.reach, self.reach + 1)
+        cube = np.stack(np.meshgrid(span, span, span, indexing='ij'), axis=-1).reshape(-1, 3)
+        self.masks = [cube[np.linalg.norm(cube * spacing, axis=1) <= r] for r in self.classes]
+
+    def origin(self, centre):
+        return centre - self.spacing * (self.n - 1) / 2
+
+    def paint(self, xyz, origin, atoms=None):
+        """
+        Boolean occupancy grid of the atoms (rows of xyz, same order as the
+        radii), optionally restricted to the given atom indices.
+        """
+        n = self.n
+        occupied = np.zeros(n ** 3, dtype=bool)
+        nearest = np.rint((xyz - origin) / self.spacing).astype(np.int64)
+        atoms = np.arange(len(xyz)) if atoms is None else atoms
+        # Atoms too far outside the box cannot paint any grid point
+        near = np.all((nearest[atoms] >= -self.reach) & (nearest[atoms] < n + self.reach), axis=1)
+        atoms = atoms[near]
+        for k, mask in enumerate(self.masks):
+            sel = atoms[self.atom_class[atoms] == k]
+            if not len(sel):
+                continue
+            cells = (nearest[sel, None, :] + mask[None]).reshape(-1, 3)
+            cells = cells[np.all((cells >= 0) & (cells < n), axis=1)]
+            occupied[(cells[:, 0] * n + cells[:, 1]) * n + cells[:, 2]] = True
+        return occupied.reshape(n, n, n)
+
+    def cells_of(self, xyz, origin):
+        """Grid cell of each coordinate, or -1 rows outside the box."""
+        cells = np.rint((xyz - origin) / self.spacing).astype(np.int64)
+        cells[~np.all((cells >= 0) & (cells < self.n), axis=1)] = -1
+        return cells
+
+
+def buried_mask(protein, min_buried=MIN_BURIED):
+    """Empty points with protein on both sides along >= min_buried axes."""
+    count = np.zeros(protein.shape, dtype=np.int8)
+    for axis in range(3):
+        before = np.maximum.accumulate(protein, axis=axis)
+        after = np.flip(np.maximum.accumulate(np.flip(protein, axis), axis=axis), axis)
+        count += before & after
+    return ~protein & (count >= min_buried)
+
+
+def pocket_frame(grid, xyz, n_protein, water_xyz, min_buried=MIN_BURIED):
+    """
+    (pocket volume, free volume, waters in pocket) for one frame; xyz holds
+    the protein atoms followed by the substrate atoms.
+    """
+    protein_atoms = np.arange(n_protein)
+    substrate_atoms = np.arange(n_protein, len(xyz))
+    origin = grid.origin(xyz[n_protein:].mean(axis=0))
+    buried = buried_mask(grid.paint(xyz, origin, protein_atoms), min_buried)
+    substrate = grid.paint(xyz, origin, substrate_atoms)
+
+    labels, _ = ndimage.label(buried)
+    ids = np.unique(labels[substrate])
+    ids = ids[ids > 0]
+    if not len(ids):
+        return 0.0, 0.0, 0
+    pocket = np.isin(labels, ids)
+
+    cell_volume = grid.spacing ** 3
+    volume = pocket.sum() * cell_volume
+    free_volume = (pocket & ~substrate).sum() * cell_volume
+
+    water = grid.cells_of(water_xyz, origin)
+    water = water[water[:, 0] >= 0]
+    n_waters = int(pocket[water[:, 0], water[:, 1], water[:, 2]].sum())
+    return volume, free_volume, n_waters
+
+
+def select_groups(atoms):
+    """Atom indices of protein, substrate and water oxygens."""
+    substrate = np.isin(atoms["resname"], SUBSTRATE_RESIDUES)
+    water = np.isin(atoms["resname"], WATER_RESIDUES)
+    if not substrate.any():
+        raise ValueError(f"no substrate residues ({', '.join(SUBSTRATE_RESIDUES)}) found")
+    return {"protein": np.flatnonzero(~substrate & ~water),
+            "substrate": np.flatnonzero(substrate),
+            "water": np.flatnonzero(water & (atoms["element"] == 'O'))}
+
+
+def track_window(mutant, window, dcd_files, pdb_file, output, spacing=SPACING,
+                 box_size=BOX_SIZE, min_buried=MIN_BURIED):
+    """Pocket time series of all replicas of one window (cached)."""
+    key = artifact_cache.files_key("pocket_tracker", [pdb_file] + dcd_files,
+                                   extra=[spacing, box_size, min_buried])
+    if artifact_cache.fetch(key, [output]):
+        return mutant, window, output, True
+
+    atoms = read_pdb(pdb_file)
+    groups = select_groups(atoms)
+    solute = np.concatenate([groups["protein"], groups["substrate"]])
+    order = np.concatenate([solute, groups["water"]])
+    n_protein, n_solute = len(groups["protein"]), len(solute)
+    radii = np.array([VDW_RADII.get(e, DEFAULT_RADIUS) for e in atoms["element"][solute]])
+    grid = PocketGrid(radii, spacing, box_size)
+
+    volume, free_volume, waters, replica = [], [], [], []
+    for r, dcd in enumerate(dcd_files):
+        traj = DCDFile(dcd)
+        if traj.n_atoms != len(atoms["name"]):
+            raise ValueError(f"{dcd}: {traj.n_atoms} atoms, {pdb_file} has {len(atoms['name'])}")
+        for _, xyz in traj.iter_chunks(CHUNK_FRAMES, atoms=order):
+            for frame in xyz.astype(np.float64):
+                result = pocket_frame(grid, frame[:n_solute], n_protein, frame[n_solute:],
+                                      min_buried)
+                volume.append(result[0])
+                free_volume.append(result[1])
+                waters.append(result[2])
+                replica.append(r)
+
+    np.savez_compressed(output, volume=np.array(volume), free_volume=np.array(free_volume),
+                        waters=np.array(waters), replica=np.array(replica),
+                        dcd_files=np.array([os.path.relpath(d, os.path.dirname(pdb_file))
+                                            for d in dcd_files]))
+    artifact_cache.put(key, [output])
+    return mutant, window, output, False
+
+
+def _track_window(args):
+    return track_window(*args)
+
+
+def find_tasks(root, windows, pdb_pattern, out_dir, spacing, box_size, min_buried):
+    return [(mutant, window, dcds, pdb, os.path.join(out_dir, f"{mutant}_{window}_pocket.npz"),
+             spacing, box_size, min_buried)
+            for mutant, window, dcds, pdb in find_windows(root, windows, pdb_pattern)]
+
+
+def write_summary(results, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["mutant", "window", "n_frames", "volume", "volume_std",
+                         "free_volume", "free_volume_std", "waters", "waters_std"])
+        for mutant, window, output, _ in results:
+            data = np.load(output)
+            row = [mutant, window, len(data["volume"])]
+            for field in ("volume", "free_volume", "waters"):
+                values = data[field].astype(np.float64)
+                row += [f"{values.mean():.2f}", f"{values.std():.2f}"] if len(values) else ["", ""]
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Active-site pocket volume and water count")
+    add_window_arguments(parser)
+    parser.add_argument("--spacing", type=float, default=SPACING, help="grid spacing in Å")
+    parser.add_argument("--box", type=float, default=BOX_SIZE, help="grid edge in Å")
+    parser.add_argument("--min-buried", type=int, default=MIN_BURIED, choices=(1, 2, 3),
+                        help="axes that must hit protein on both sides")
+    parser.add_argument("-o", "--output", default="pockets",
+                        help="directory for the per-window .npz files and pocket_summary.csv")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    tasks = find_tasks(args.root, parse_windows(args.window), args.pdb, args.output,
+                       args.spacing, args.box, args.min_buried)
+    results = run_windows(_track_window, tasks, args.root, args.jobs)
+
+    summary = os.path.join(args.output, "pocket_summary.csv")
+    write_summary(results, summary)
+    print(f"\n{len(results)} windows, summary written to {summary}")
+
+
+if __name__ == "__main__":
+    main()
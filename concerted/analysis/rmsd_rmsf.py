@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+RMSD and RMSF of qdyn5 trajectories against the starting structure, the WT
+or the crystal structure (structures/6i8n.pdb), for every relaxation and
+FEP window of every replica.
+
+Frames are superposed in batches: the 3x3 covariance matrices of a whole
+chunk of frames are built with one einsum and decomposed with one stacked
+np.linalg.svd (Kabsch, with the reflection fix), so there is no Python
+loop over frames. Chunks are read from the memory-mapped DCD
+(dcd_reader.py), so the trajectory is never loaded as a whole.
+
+The atoms used for the fit and for the RMSD/RMSF can differ:
+
+    ca        protein CA atoms
+    backbone  protein N, CA, C, O
+    heavy     protein heavy atoms
+    active    heavy atoms of the 20 scanned active-site residues
+
+Trajectory and reference atoms are paired by aligning the residue sequences
+(difflib) and then matching atom names, so a mutant can be compared with
+the WT and a Q topology (no chains, pAF folded into the IMI residue) with
+the crystal structure (chains A/B, HOX at position 15). Residues that do
+not pair up, such as the mutated one, are left out.
+
+Outputs in the output directory:
+
+    rmsd.csv      mutant, trajectory, n_frames, first, last, mean, max, flag
+    rmsf.csv      mutant, trajectory, resnum, resname, rmsf
+    rmsd.npz      per-frame RMSD of every trajectory (keys: mutant/trajectory)
+
+flag is set when the mean RMSD exceeds --max-rmsd, so relaxations that
+drifted can be caught before the FEP runs are submitted.
+
+Usage:
+    python rmsd_rmsf.py results_root [--pdb "{mutant_dir}/*.pdb"] [--ref ../structures/6i8n.pdb]
+                        [--pattern "relax_*.dcd" --pattern "fep_*.dcd"]
+                        [--fit ca] [--calc active] [--max-rmsd 2.0] [-o rmsd]
+"""
+
+import argparse
+import csv
+import difflib
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+from dcd_reader import DCDFile
+from pdb_arrays import BACKBONE, heavy_mask, read_pdb, residue_index, residue_table
+
+# The 20 alanine-scan / mutant positions (Q numbering)
+ACTIVE_SITE = (7, 9, 10, 11, 14, 15, 17, 18, 21, 87, 88, 91, 92, 94, 95, 96, 98, 99,
+               100, 103)
+PATTERNS = ("relax_*.dcd", "fep_*.dcd")
+SELECTIONS = ("ca", "backbone", "heavy", "active")
+# Residue names that are the same amino acid for sequence matching
+RESNAME_ALIASES = {"HID": "HIS", "HIE": "HIS", "HIP": "HIS", "CYX": "CYS", "ASH": "ASP",
+                   "GLH": "GLU", "LYN": "LYS"}
+MAX_RMSD = 2.0            # Å, mean RMSD above which a trajectory is flagged
+CHUNK_FRAMES = 500
+
+
+def kabsch(mobile, target):
+    """
+    Optimal rotations for a stack of frames: mobile (F, N, 3), target (N, 3).
+    Returns (rotations (F, 3, 3), mobile centroids (F, 1, 3), target centroid);
+    (x - mobile centroid) @ rotation + target centroid superposes a frame.
+    """
+    mobile_centre = mobile.mean(axis=1, keepdims=True)
+    target_centre = target.mean(axis=0)
+    h = np.einsum('fni,nj->fij', mobile - mobile_centre, target - target_centre)
+    u, _, vt = np.linalg.svd(h)
+    # Flip the last singular vector where the best orthogonal matrix is a reflection
+    d = np.sign(np.linalg.det(np.matmul(u, vt)))
+    u[:, :, -1] *= d[:, None]
+    return np.matmul(u, vt), mobile_centre, target_centre
+
+
+def superpose(frames, fit, reference_fit):
+    """Frames (F, M, 3) superposed on the reference using the fit atoms (column indices)."""
+    rotation, mobile_centre, target_centre = kabsch(frames[:, fit], reference_fit)
+    return np.matmul(frames - mobile_centre, rotation) + target_centre
+
+
+def protein_residues(atoms):
+    """Residue indices that are amino acids (have a CA atom)."""
+    res = residue_index(atoms)
+    altloc_ok = np.isin(atoms["altloc"], ("", "A"))
+    return np.unique(res[(atoms["name"] == "CA") & altloc_ok])
+
+
+def selection_mask(atoms, selection):
+    res = residue_index(atoms)
+    protein = np.isin(res, protein_residues(atoms)) & np.isin(atoms["altloc"], ("", "A"))
+    if selection == "ca":
+        return protein & (atoms["name"] == "CA")
+    if selection == "backbone":
+        return protein & np.isin(atoms["name"], BACKBONE)
+    if selection == "heavy":
+        return protein & heavy_mask(atoms)
+    if selection == "active":
+        return protein & heavy_mask(atoms) & np.isin(res, np.array(ACTIVE_SITE) - 1)
+    raise ValueError(f"unknown selection {selection!r} (choose from {', '.join(SELECTIONS)})")
+
+
+def residue_pairs(atoms, ref_atoms):
+    """{trajectory residue index: reference residue index} from a sequence alignment."""
+    res, ref_res = protein_residues(atoms), protein_residues(ref_atoms)
+    table, ref_table = residue_table(atoms), residue_table(ref_atoms)
+    seq = [RESNAME_ALIASES.get(n, n) for n in table["resname"][res]]
+    ref_seq = [RESNAME_ALIASES.get(n, n) for n in ref_table["resname"][ref_res]]
+    matcher = difflib.SequenceMatcher(None, seq, ref_seq, autojunk=False)
+    pairs = {}
+    for a, b, size in matcher.get_matching_blocks():
+        pairs.update(zip(res[a:a + size].tolist(), ref_res[b:b + size].tolist()))
+    return pairs
+
+
+def match_atoms(atoms, ref_atoms, selection):
+    """Paired (trajectory atom indices, reference atom indices) of a selection."""
+    pairs = residue_pairs(atoms, ref_atoms)
+    idx = np.flatnonzero(selection_mask(atoms, selection))
+    res = residue_index(atoms)[idx]
+    paired = np.isin(res, list(pairs))
+    idx, res = idx[paired], res[paired]
+    mapped = np.array([pairs[r] for r in res.tolist()], dtype=np.int64)
+    keys = np.char.add(np.char.add(mapped.astype(str), ':'), atoms["name"][idx])
+
+    ref_idx = np.flatnonzero(np.isin(ref_atoms["altloc"], ("", "A")))
+    ref_keys = np.char.add(np.char.add(residue_index(ref_atoms)[ref_idx].astype(str), ':'),
+                           ref_atoms["name"][ref_idx])
+    _, i, j = np.intersect1d(keys, ref_keys, return_indices=True)
+    order = np.argsort(idx[i])
+    return idx[i][order], ref_idx[j][order]
+
+
+def trajectory_rmsd(dcd, pdb_file, ref_file, fit="ca", calc="active", chunk=CHUNK_FRAMES):
+    """
+    (dcd, per-frame RMSD, per-residue RMSF rows) of one trajectory; RMSF is
+    taken about the mean superposed position of every calc atom.
+    """
+    atoms = read_pdb(pdb_file)
+    ref_atoms = atoms if ref_file is None else read_pdb(ref_file)
+    fit_idx, fit_ref = match_atoms(atoms, ref_atoms, fit)
+    calc_idx, calc_ref = match_atoms(atoms, ref_atoms, calc)
+    if len(fit_idx) < 3 or not len(calc_idx):
+        raise ValueError(f"{pdb_file}: too few atoms paired with {ref_file or pdb_file} "
+                         f"({len(fit_idx)} fit, {len(calc_idx)} calc)")
+
+    traj = DCDFile(dcd)
+    if traj.n_atoms != len(atoms["name"]):
+        raise ValueError(f"{dcd}: {traj.n_atoms} atoms, {pdb_file} has {len(atoms['name'])}")
+    # Read the union of both selections once per chunk
+    needed = np.union1d(fit_idx, calc_idx)
+    fit_cols, calc_cols = np.searchsorted(needed, fit_idx), np.searchsorted(needed, calc_idx)
+    reference_fit = ref_atoms["xyz"][fit_ref]
+    reference_calc = ref_atoms["xyz"][calc_ref]
+
+    rmsd = []
+    sums = np.zeros((len(calc_idx), 3))
+    sumsq = np.zeros(len(calc_idx))
+    for _, xyz in traj.iter_chunks(chunk, atoms=needed):
+        aligned = superpose(xyz.astype(np.float64), fit_cols, reference_fit)[:, calc_cols]
+        rmsd.append(np.sqrt(((aligned - reference_calc) ** 2).sum(axis=-1).mean(axis=1)))
+        sums += aligned.sum(axis=0)
+        sumsq += (aligned ** 2).sum(axis=(0, 2))
+    rmsd = np.concatenate(rmsd) if rmsd else np.zeros(0)
+
+    n = max(len(rmsd), 1)
+    atom_rmsf = np.sqrt(np.maximum(sumsq / n - (sums ** 2).sum(axis=1) / n ** 2, 0.0))
+    res = residue_index(atoms)[calc_idx]
+    residues, group = np.unique(res, return_inverse=True)
+    rmsf = np.bincount(group, atom_rmsf) / np.bincount(group)
+    table = residue_table(atoms)
+    rows = [(int(r) + 1, table["resname"][r], value) for r, value in zip(residues, rmsf)]
+    return dcd, rmsd, rows
+
+
+def _trajectory_rmsd(args):
+    return trajectory_rmsd(*args)
+
+
+def find_trajectories(root, patterns, pdb_pattern):
+    """
+    [(mutant, dcd files, structure)] for every mutant directory with DCD
+    files matching any of the patterns (also used by cluster_frames.py).
+    """
+    found = []
+    for mutant_dir in sorted(d for d in glob.glob(os.path.join(root, "*")) if os.path.isdir(d)):
+        mutant = os.path.basename(mutant_dir)
+        dcds = sorted({dcd for pattern in patterns
+                       for dcd in glob.glob(os.path.join(mutant_dir, "**", pattern),
+                                            recursive=True)})
+        if not dcds:
+            continue
+        pdbs = sorted(glob.glob(pdb_pattern.format(mutant_dir=mutant_dir, mutant=mutant)))
+        if not pdbs:
+            print(f"{mutant}: no structure matching {pdb_pattern}, skipped")
+            continue
+        found.append((mutant, dcds, pdbs[0]))
+    return found
+
+
+def find_tasks(root, patterns, pdb_pattern, ref_file, fit, calc):
+    """(mutant, task) pairs for every matching DCD below each mutant directory."""
+    return [(mutant, (dcd, pdb, ref_file, fit, calc))
+            for mutant, dcds, pdb in find_trajectories(root, patterns, pdb_pattern)
+            for dcd in dcds]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched Kabsch RMSD / RMSF of qdyn5 trajectories")
+    parser.add_argument("root", help="directory with one sub-directory per mutant")
+    parser.add_argument("--pdb", default="{mutant_dir}/*.pdb",
+                        help="glob for the topology structure ({mutant_dir}, {mutant})")
+    parser.add_argument("--ref", help="reference structure (default: each mutant's own PDB)")
+    parser.add_argument("--pattern", action="append",
+                        help="DCD file pattern (default: relax_*.dcd fep_*.dcd)")
+    parser.add_argument("--fit", choices=SELECTIONS, default="ca", help="atoms to superpose on")
+    parser.add_argument("--calc", choices=SELECTIONS, default="active",
+                        help="atoms for RMSD / RMSF")
+    parser.add_argument("--max-rmsd", type=float, default=MAX_RMSD,
+                        help="flag trajectories with a larger mean RMSD (Å)")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default="rmsd")
+    args = parser.parse_args()
+
+    tasks = find_tasks(args.root, args.pattern or PATTERNS, args.pdb, args.ref, args.fit,
+                       args.calc)
+    if not tasks:
+        print(f"No trajectories found under {args.root}")
+        sys.exit(1)
+    os.makedirs(args.output, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(_trajectory_rmsd, [task for _, task in tasks]))
+
+    per_frame = {}
+    with open(os.path.join(args.output, "rmsd.csv"), 'w', newline='') as f_rmsd, \
+            open(os.path.join(args.output, "rmsf.csv"), 'w', newline='') as f_rmsf:
+        rmsd_writer, rmsf_writer = csv.writer(f_rmsd), csv.writer(f_rmsf)
+        rmsd_writer.writerow(["mutant", "trajectory", "n_frames", "first", "last", "mean", "max",
+                              "flag"])
+        rmsf_writer.writerow(["mutant", "trajectory", "resnum", "resname", "rmsf"])
+        print(f"{'Mutant':12s} {'Trajectory':40s} {'frames':>7s} {'mean':>7s} {'max':>7s}")
+        for (mutant, _), (dcd, rmsd, rows) in zip(tasks, results):
+            name = os.path.relpath(dcd, os.path.join(args.root, mutant))
+            per_frame[f"{mutant}/{name}"] = rmsd
+            if not len(rmsd):
+                rmsd_writer.writerow([mutant, name, 0, "", "", "", "", "empty"])
+                continue
+            flag = "drift" if rmsd.mean() > args.max_rmsd else ""
+            rmsd_writer.writerow([mutant, name, len(rmsd), f"{rmsd[0]:.3f}", f"{rmsd[-1]:.3f}",
+                                  f"{rmsd.mean():.3f}", f"{rmsd.max():.3f}", flag])
+            for resnum, resname, value in rows:
+                rmsf_writer.writerow([mutant, name, resnum, resname, f"{value:.3f}"])
+            print(f"{mutant:12s} {name:40s} {len(rmsd):7d} {rmsd.mean():7.3f} {rmsd.max():7.3f}"
+                  f"{'  <-- ' + flag if flag else ''}")
+    np.savez_compressed(os.path.join(args.output, "rmsd.npz"), **per_frame)
+    print(f"\n{len(results)} trajectories, results written to {args.output}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score, mean_squared_error
+import os
 import re
 
 # =============================================================================
@@ -221,6 +222,37 @@ if len(df_cluster_numeric) > 3:
         print(f"    Cluster {cluster}: {len(variants)} variants, Avg ΔYield = {mean_yield:.2f}%")
         print(f"       {', '.join(variants[:5])}{'...' if len(variants) > 5 else ''}")
 
+# Structural clustering on residue contacts (contact_maps.py -> contact_features.npz)
+contact_file = os.path.join("contact_maps", "contact_features.npz")
+if os.path.exists(contact_file):
+    from contact_maps import load_features, variant_name
+    contacts, contact_variants, contact_pairs = load_features(contact_file)
+    # Files written with structure names as row labels
+    contact_variants = [variant_name(v) for v in contact_variants]
+    n_struct_clusters = min(3, contacts.shape[0])
+    if contacts.shape[1] > 0 and n_struct_clusters > 1:
+        struct_kmeans = KMeans(n_clusters=n_struct_clusters, random_state=42, n_init=10)
+        struct_clusters = struct_kmeans.fit_predict(contacts)
+        df_struct = pd.DataFrame({"Cluster": struct_clusters}, index=contact_variants)
+        df_struct = df_struct.join(df_wide[["Old", "New"]], how="left")
+        matched = df_struct[["Old", "New"]].notna().any(axis=1)
+
+        print(f"\n11b. Contact-map clustering ({contacts.shape[0]} structures, "
+              f"{contacts.shape[1]} varying residue pairs):")
+        if not matched.any():
+            print(f"    Warning: no structure in {contact_file} matches a variant name "
+                  f"(e.g. {contact_variants[0]}); no ΔYield per cluster")
+        for cluster in range(n_struct_clusters):
+            members = df_struct[df_struct["Cluster"] == cluster]
+            n_matched = int(matched[df_struct["Cluster"] == cluster].sum())
+            if n_matched:
+                mean_yield = members[["Old", "New"]].mean().mean()
+                print(f"    Cluster {cluster}: {len(members)} structures, "
+                      f"Avg ΔYield = {mean_yield:.2f}% ({n_matched} with yields)")
+            else:
+                print(f"    Cluster {cluster}: {len(members)} structures, no yield data")
+            print(f"       {', '.join(members.index[:5])}{'...' if len(members) > 5 else ''}")
+
 # =============================================================================
 # 7️⃣ BOOTSTRAP CONFIDENCE INTERVALS
 # =============================================================================
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Run sbatch job directories on the local machine.
+
+run_minim.sh and run_replica.sh submit one `sbatch run_qdyn_5.sh` per minim
+directory or replica. Without Slurm (workstation, CI) the same directories
+can be given to this runner, which packs the jobs onto the local cores:
+
+    python local_runner.py run /path/*/minim /path/*/replica0[0-1][0-9]
+    python local_runner.py status
+
+Each job is the job script run with bash inside its directory, as sbatch
+does. Its #SBATCH header supplies the resource hints:
+
+    --cpus-per-task   cores the job holds while it runs (default 1)
+    --mem             memory the job holds, e.g. 2G (default: none)
+    --time            wall-clock limit; the job is killed and marked TIMEOUT
+    --job-name, --output, --error   as in Slurm (%j is the job id, %x the name)
+
+A job starts when its cores and memory fit into what is free (--cores,
+default all; --mem, default the physical memory), in submission order with
+later jobs filling the gaps. A job that asks for more than the whole
+machine is rejected instead of waiting forever. SLURM_JOB_ID,
+SLURM_JOB_NAME, SLURM_CPUS_PER_TASK and SLURM_SUBMIT_DIR are set for the
+script.
+
+The queue (state, exit code, start and end time, log files of every job)
+is written to a JSON file (--queue, default local_queue.json) on every
+change, so `status` can be run from another shell while jobs are running.
+The runner exits non-zero if any job did not complete.
+
+Usage:
+    python local_runner.py run DIR [...] [--script run_qdyn_5.sh] [--cores N]
+                               [--mem 32G] [--queue local_queue.json]
+    python local_runner.py status [--queue local_queue.json]
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SCRIPT = "run_qdyn_5.sh"
+DEFAULT_QUEUE = "local_queue.json"
+POLL_INTERVAL = 0.2
+MEMORY_UNITS = {'K': 1 / 1024, 'M': 1, 'G': 1024, 'T': 1024 * 1024}
+FINISHED = ("COMPLETED", "FAILED", "TIMEOUT", "CANCELLED", "REJECTED")
+
+
+def parse_memory(text):
+    """Slurm memory size in MB ('2G', '500M', plain numbers are MB)."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([KMGT]?)B?", text.strip().upper())
+    if not match:
+        raise ValueError(f"bad memory size '{text}'")
+    return float(match.group(1)) * MEMORY_UNITS[match.group(2) or 'M']
+
+
+def parse_time(text):
+    """Slurm time limit in seconds ('MM', 'MM:SS', 'HH:MM:SS', 'D-HH[:MM[:SS]]')."""
+    days, _, rest = text.strip().rpartition('-')
+    parts = [int(p) for p in rest.split(':')]
+    if days:
+        parts += [0] * (3 - len(parts))
+        hours, minutes, seconds = parts
+    elif len(parts) == 3:
+        hours, minutes, seconds = parts
+    else:
+        hours, (minutes, seconds) = 0, (parts + [0])[:2]
+    return ((int(days or 0) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def sbatch_options(script):
+    """{option: value} of the #SBATCH lines of a job script."""
+    options = {}
+    with open(script, 'r') as f:
+        for line in f:
+            if not line.startswith("#SBATCH"):
+                continue
+            for option in line[len("#SBATCH"):].split('#')[0].split():
+                name, _, value = option.lstrip('-').partition('=')
+                options[name] = value
+    return options
+
+
+def physical_memory():
+    """Physical memory in MB."""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**20
+
+
+def make_job(job_id, directory, script):
+    """Queue entry of one job directory."""
+    directory = os.path.abspath(directory)
+    job = {"id": job_id, "dir": directory, "script": script, "state": "PENDING",
+           "exit_code": None, "start": None, "end": None, "reason": ""}
+    path = os.path.join(directory, script)
+    try:
+        options = sbatch_options(path)
+        job["name"] = options.get("job-name") or os.path.basename(directory)
+        job["cpus"] = int(options.get("cpus-per-task", 1))
+        job["mem"] = parse_memory(options["mem"]) if "mem" in options else 0.0
+        job["time"] = parse_time(options["time"]) if "time" in options else None
+    except (OSError, ValueError) as e:
+        job.update(name=os.path.basename(directory), cpus=1, mem=0.0, time=None,
+                   state="REJECTED", reason=str(e))
+        return job
+
+    def log(option, default):
+        name = options.get(option, default).replace("%j", str(job_id)).replace("%x", job["name"])
+        return os.path.join(directory, name)
+    job["stdout"] = log("output", "local-%j.out")
+    job["stderr"] = log("error", options.get("output", "local-%j.out"))
+    return job
+
+
+def write_queue(filename, jobs, resources):
+    """Replace the queue file in one step, so readers never see half of it."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(prefix=".queue_", dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({"resources": resources, "updated": time.time(), "jobs": jobs}, f, indent=1)
+    os.replace(tmp, filename)
+
+
+def start(job):
+    """Start a job script with bash in its directory; returns the Popen."""
+    env = dict(os.environ, SLURM_JOB_ID=str(job["id"]), SLURM_JOB_NAME=job["name"],
+               SLURM_CPUS_PER_TASK=str(job["cpus"]), SLURM_SUBMIT_DIR=job["dir"])
+    stdout = open(job["stdout"], 'w')
+    stderr = stdout if job["stderr"] == job["stdout"] else open(job["stderr"], 'w')
+    try:
+        return subprocess.Popen(["bash", job["script"]], cwd=job["dir"], env=env,
+                                stdout=stdout, stderr=stderr, start_new_session=True)
+    finally:
+        stdout.close()
+        stderr.close()
+
+
+def stop(process):
+    """Terminate a job with everything it started (it runs in its own session)."""
+    try:
+        os.killpg(process.pid, 15)
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, 9)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+def run_jobs(jobs, cores, memory, queue_file):
+    """Pack the jobs onto cores and memory until all have finished."""
+    resources = {"cores": cores, "mem": memory}
+    for job in jobs:
+        if job["state"] == "PENDING" and (job["cpus"] > cores or job["mem"] > memory):
+            job.update(state="REJECTED", reason=f"asks for {job['cpus']} cores and "
+                                                f"{job['mem']:.0f} MB, the limit is {cores} "
+                                                f"cores and {memory:.0f} MB")
+    running = {}
+    write_queue(queue_file, jobs, resources)
+    try:
+        while True:
+            free_cores = cores - sum(job["cpus"] for job in running.values())
+            free_mem = memory - sum(job["mem"] for job in running.values())
+            changed = False
+            for job in jobs:
+                if job["state"] == "PENDING" and job["cpus"] <= free_cores and \
+                        job["mem"] <= free_mem:
+                    try:
+                        process = start(job)
+                    except OSError as e:
+                        job.update(state="FAILED", reason=str(e), end=time.time())
+                    else:
+                        job.update(state="RUNNING", start=time.time())
+                        running[process] = job
+                        free_cores -= job["cpus"]
+                        free_mem -= job["mem"]
+                        print(f"{job['id']:5d} {job['name']:20s} started in {job['dir']}", flush=True)
+                    changed = True
+            if not running:
+                break
+
+            time.sleep(POLL_INTERVAL)
+            now = time.time()
+            for process, job in list(running.items()):
+                if job["time"] is not None and now - job["start"] > job["time"]:
+                    stop(process)
+                    job.update(state="TIMEOUT", reason="time limit reached")
+                elif process.poll() is None:
+                    continue
+                else:
+                    job["state"] = "COMPLETED" if process.returncode == 0 else "FAILED"
+                job.update(exit_code=process.returncode, end=now)
+                del running[process]
+                changed = True
+                print(f"{job['id']:5d} {job['name']:20s} {job['state']:9s} exit {job['exit_code']} "
+                      f"after {job['end'] - job['start']:.0f} s", flush=True)
+            if changed:
+                write_queue(queue_file, jobs, resources)
+    except KeyboardInterrupt:
+        for process, job in running.items():
+            stop(process)
+            job.update(state="CANCELLED", exit_code=process.returncode, end=time.time())
+        for job in jobs:
+            if job["state"] == "PENDING":
+                job.update(state="CANCELLED", reason="runner interrupted")
+    write_queue(queue_file, jobs, resources)
+    return jobs
+
+
+def print_status(queue_file):
+    with open(queue_file, 'r') as f:
+        queue = json.load(f)
+    jobs = queue["jobs"]
+    now = time.time()
+    print(f"{'ID':>5s} {'NAME':20s} {'STATE':9s} {'CPUS':>4s} {'MEM':>7s} {'TIME':>8s} "
+          f"{'EXIT':>4s}  DIR")
+    for job in jobs:
+        elapsed = (job["end"] or now) - job["start"] if job["start"] else 0
+        exit_code = "" if job["exit_code"] is None else job["exit_code"]
+        print(f"{job['id']:5d} {job['name'][:20]:20s} {job['state']:9s} {job['cpus']:4d} "
+              f"{job['mem']:6.0f}M {time.strftime('%H:%M:%S', time.gmtime(elapsed)):>8s} "
+              f"{exit_code:>4}  {job['dir']}")
+        if job["reason"]:
+            print(f"{'':42s}{job['reason']}")
+    counts = {}
+    for job in jobs:
+        counts[job["state"]] = counts.get(job["state"], 0) + 1
+    used = sum(job["cpus"] for job in jobs if job["state"] == "RUNNING")
+    print(f"\n{', '.join(f'{n} {state.lower()}' for state, n in counts.items())}; "
+          f"{used} of {queue['resources']['cores']} cores in use "
+          f"(updated {time.strftime('%H:%M:%S', time.localtime(queue['updated']))})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run sbatch job directories on local cores")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="run job directories")
+    p.add_argument("dirs", nargs="+", help="job directories (minim/, replica000/, ...)")
+    p.add_argument("--script", default=DEFAULT_SCRIPT, help="job script in every directory")
+    p.add_argument("--cores", type=int, default=os.cpu_count(), help="cores to pack jobs onto")
+    p.add_argument("--mem", help="memory to pack jobs into, e.g. 32G (default: physical)")
+    p.add_argument("--queue", default=DEFAULT_QUEUE, help="queue state file")
+
+    p = sub.add_parser("status", help="show the queue of a running or finished run")
+    p.add_argument("--queue", default=DEFAULT_QUEUE)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        try:
+            print_status(args.queue)
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        return
+
+    memory = parse_memory(args.mem) if args.mem else physical_memory()
+    jobs = [make_job(i, d, args.script) for i, d in enumerate(args.dirs, 1)]
+    for job in jobs:
+        if job["state"] == "REJECTED":
+            print(f"{job['id']:5d} {job['name']:20s} REJECTED  {job['reason']}")
+    print(f"{len(jobs)} jobs on {args.cores} cores, {memory / 1024:.1f} GB")
+    run_jobs(jobs, args.cores, memory, args.queue)
+
+    failed = [job for job in jobs if job["state"] != "COMPLETED"]
+    print(f"\n{len(jobs) - len(failed)} of {len(jobs)} jobs completed")
+    if failed:
+        for job in failed:
+            print(f"  {job['state']:9s} {job['dir']} ({job['reason'] or 'see ' + job['stderr']})")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
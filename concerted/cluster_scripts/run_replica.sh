@@ -1,4 +1,6 @@
 #!/bin/bash
+# Without Slurm, run the same directories on local cores:
+#   python3 local_runner.py run "$BASE_DIR"/*/replica0{00..15}
 
 # Define the base directory
 BASE_DIR="/home/nsekhar/stepwise/MUT/step1/HUMAN/level3"
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Make FEP files for WT and every mutant in parallel with Qpyl make_fep.
+
+makeFEP.py handles one hard-coded PDB and every call re-reads
+qoplsaa_all.prm, qoplsaa.lib and LMRR.lib. Here the library and parameter
+files are parsed once in the parent process; the worker processes are
+forked afterwards and inherit the parsed QLib / QPrm objects. Inside each
+worker make_fep gets a private copy of them instead of constructing and
+re-reading its own.
+
+Errors are not ignored (ignore_errors=True in makeFEP.py hid missing
+parameters and atoms): a failing structure is reported with the Qpyl
+message and the others carry on. The run exits non-zero if any structure
+failed. FEP files are cached under fep_cache_key, which makeFEP.py uses
+too; the key includes the ignore_errors setting, so a lenient FEP is never
+returned to a strict run. Every new FEP is checked with fep_file.py before
+it is written.
+
+Usage:
+    python batch_make_fep.py [pdb_or_dir ...] [--qmap FC_concerted.qmap] [-o mutants]
+                             [--prm ../../parameters/qoplsaa_all.prm]
+                             [--lib ../../parameters/qoplsaa.lib --lib ../../parameters/LMRR.lib]
+"""
+
+import argparse
+import copy
+import glob
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(ROOT, "prep_scripts"))
+import artifact_cache
+from fep_file import FEPFile
+
+PARAMETERS = os.path.join(ROOT, "parameters")
+DEFAULT_PRM = [os.path.join(PARAMETERS, "qoplsaa_all.prm")]
+DEFAULT_LIBS = [os.path.join(PARAMETERS, "qoplsaa.lib"), os.path.join(PARAMETERS, "LMRR.lib")]
+DEFAULT_STRUCTURES = [os.path.join(ROOT, "structures", "LMRR_WT2_solvated.pdb"),
+                      os.path.join(ROOT, "structures", "mutations")]
+DEFAULT_QMAP = os.path.join(HERE, "FC_concerted.qmap")
+FORCEFIELD = "oplsaa"
+
+# Parsed in the parent before the workers are forked
+_parsed = {}
+
+
+def parse_inputs(prm_files, lib_files, forcefield=FORCEFIELD):
+    """Parse the parameter and library files once (QPrm, QLib)."""
+    from Qpyl.core.qlibrary import QLib
+    from Qpyl.core.qparameter import QPrm
+
+    qlib = QLib(forcefield)
+    for lib_file in lib_files:
+        qlib.read_lib(lib_file)
+    qprm = QPrm(forcefield)
+    for prm_file in prm_files:
+        qprm.read_prm(prm_file)
+    return qlib, qprm
+
+
+def _preparsed(parsed):
+    """
+    Stand-in for the QLib / QPrm class inside make_fep: returns a copy of
+    the parsed object whose read_* methods do nothing, since the files it
+    is asked to read are the ones already parsed.
+    """
+    def factory(*args, **kwargs):
+        clone = copy.deepcopy(parsed)
+        for name in dir(type(clone)):
+            if name.startswith("read_"):
+                setattr(clone, name, lambda *a, **kw: None)
+        return clone
+    return factory
+
+
+def fep_name(pdb_file):
+    stem = os.path.splitext(os.path.basename(pdb_file))[0]
+    return (stem[:-len("_solvated")] if stem.endswith("_solvated") else stem) + ".fep"
+
+
+def fep_cache_key(pdb_file, qmap_file, prm_files, lib_files, ignore_errors=False):
+    """
+    Cache key of a FEP file: topology (or PDB), qmap, PDB, parameters and
+    libraries, and whether make_fep ran with ignore_errors, so a lenient
+    FEP is never served to a strict run.
+    """
+    top_file = os.path.splitext(pdb_file)[0] + ".top"
+    inputs = [top_file if os.path.exists(top_file) else pdb_file, qmap_file, pdb_file]
+    return artifact_cache.files_key("fep", inputs + list(prm_files) + list(lib_files),
+                                    extra=[f"ignore_errors={bool(ignore_errors)}"])
+
+
+def make_one(pdb_file, qmap_file, output, prm_files, lib_files, ignore_errors=False):
+    """(pdb, output, status, message) for one structure; never raises."""
+    key = fep_cache_key(pdb_file, qmap_file, prm_files, lib_files, ignore_errors)
+    if artifact_cache.fetch(key, [output]):
+        return pdb_file, output, "cached", ""
+
+    try:
+        from Qpyl import qmakefep
+        if _parsed:
+            qmakefep.QLib = _preparsed(_parsed["lib"])
+            qmakefep.QPrm = _preparsed(_parsed["prm"])
+        fepstring = qmakefep.make_fep(qmap_file=qmap_file,
+                                      pdb_file=pdb_file,
+                                      forcefield=FORCEFIELD,
+                                      parm_files=list(prm_files),
+                                      lib_files=list(lib_files),
+                                      ignore_errors=ignore_errors)
+    except Exception as e:
+        return pdb_file, output, "failed", f"{type(e).__name__}: {e}"
+
+    # Checked before anything is written, so a bad FEP never lands on disk
+    fep = FEPFile.parse(fepstring)
+    if fep.text() != fepstring or not fep.rows("atoms"):
+        return pdb_file, output, "failed", "make_fep output does not parse as a FEP file"
+    with open(output, 'w') as f:
+        f.write(fepstring)
+    artifact_cache.put(key, [output])
+    return pdb_file, output, "done", f"{len(fep.rows('atoms'))} FEP atoms"
+
+
+def _make_one(args):
+    return make_one(*args)
+
+
+def list_structures(paths):
+    structures = []
+    for path in paths:
+        if os.path.isdir(path):
+            structures.extend(sorted(glob.glob(os.path.join(path, "*_solvated.pdb"))))
+        else:
+            structures.append(path)
+    return structures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel make_fep for WT and all mutants")
+    parser.add_argument("paths", nargs="*", default=DEFAULT_STRUCTURES,
+                        help="solvated PDB files or directories with *_solvated.pdb "
+                             "(default: structures/LMRR_WT2_solvated.pdb structures/mutations)")
+    parser.add_argument("--qmap", default=DEFAULT_QMAP)
+    parser.add_argument("--prm", action="append", help="parameter file (repeatable)")
+    parser.add_argument("--lib", action="append", help="library file (repeatable)")
+    parser.add_argument("--ignore-errors", action="store_true",
+                        help="pass ignore_errors=True to make_fep (not recommended)")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default=os.path.join(HERE, "mutants"),
+                        help="directory for the FEP files")
+    args = parser.parse_args()
+
+    prm_files, lib_files = args.prm or DEFAULT_PRM, args.lib or DEFAULT_LIBS
+    structures = list_structures(args.paths)
+    if not structures:
+        print("No structures found")
+        sys.exit(1)
+    os.makedirs(args.output, exist_ok=True)
+
+    try:
+        _parsed["lib"], _parsed["prm"] = parse_inputs(prm_files, lib_files)
+    except ImportError:
+        print("Qpyl is not installed (needed for make_fep)")
+        sys.exit(1)
+    print(f"Parsed {len(lib_files)} library and {len(prm_files)} parameter file(s) once; "
+          f"making {len(structures)} FEP files")
+
+    tasks = [(pdb, args.qmap, os.path.join(args.output, fep_name(pdb)), tuple(prm_files),
+              tuple(lib_files), args.ignore_errors) for pdb in structures]
+    # Fork so the workers inherit the parsed libraries and parameters
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as pool:
+        results = list(pool.map(_make_one, tasks))
+
+    failed = [r for r in results if r[2] == "failed"]
+    for pdb, output, status, message in results:
+        print(f"{os.path.basename(pdb):40s} {status:7s} {os.path.basename(output):28s} {message}")
+    if failed:
+        print(f"\n{len(failed)} of {len(results)} structures failed:")
+        for pdb, _, _, message in failed:
+            print(f"  {os.path.basename(pdb)}: {message}")
+        sys.exit(1)
+    print(f"\nAll {len(results)} FEP files written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
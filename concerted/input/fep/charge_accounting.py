@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Charge accounting of the qmap files against the residue libraries.
+
+Charges come from the .lib files (parameters/qlib.py) as a
+(RESNAME, atom) -> charge index, so IMI.C9 and PAF.C9 are always looked up
+in their own residue. The ligand libraries are read first, then
+qoplsaa.lib and LMRR.lib (the two libraries qprep5 and make_fep use), and
+every atom the files disagree on is reported.
+
+For every qmap, in one pass, the report gives:
+
+  - the state 1 and state 2 totals over the q atoms (and the n atoms,
+    listed separately) and the state 1 -> 2 drift, which should be zero
+    when the reaction conserves charge;
+  - per group (the residue of the PDB ID column), the q-atom totals of both
+    states, their drift and the charge of the whole residue in each state:
+    the q atoms plus the library charges of the atoms of the residue that
+    are not in the qmap. Charge may move between groups (a proton
+    transfer), but the sum over all groups has to be an integer in both
+    states;
+  - lib IDs without a library entry and atoms mapped twice.
+
+A lib ID of "-" is an atom that does not exist in that state (charge 0).
+
+The concerted qmaps use concerted/parameters, the stepwise ones
+stepwise/parameters. The run exits non-zero if any qmap has missing atoms,
+atoms mapped twice or a non-integer total.
+
+Usage:
+    python charge_accounting.py [qmap ...] [--libs concerted|stepwise] [--csv charges.csv] [-v]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from collections import Counter, defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+sys.path.insert(0, os.path.join(ROOT, "parameters"))
+from qlib import read_lib
+
+LIB_DIRS = {"concerted": os.path.join(ROOT, "parameters"),
+            "stepwise": os.path.join(ROOT, "..", "stepwise", "parameters")}
+# Read last, in this order, so they win over the per-ligand libraries
+MAIN_LIBS = ("qoplsaa.lib", "LMRR.lib")
+QMAPS = {"concerted": [os.path.join(HERE, name) for name in
+                       ("FC_concerted.qmap", "FC_step1.qmap", "FC_step2.qmap",
+                        "HYD_step1.qmap")],
+         "stepwise": [os.path.join(ROOT, "..", "stepwise", "input", name) for name in
+                      ("1_1.qmap", "1_2.qmap", "2_1.qmap", "3_1.qmap")]}
+TOLERANCE = 1e-3
+ABSENT = "-"
+
+
+def lib_files(directory):
+    """Library files of a parameter directory in reading order."""
+    files = sorted(glob.glob(os.path.join(directory, "*.lib")))
+    ligands = [f for f in files if os.path.basename(f) not in MAIN_LIBS]
+    main = [os.path.join(directory, name) for name in MAIN_LIBS
+            if os.path.exists(os.path.join(directory, name))]
+    return ligands + main
+
+
+def charge_index(libs):
+    """
+    ({(RESNAME, atom): charge}, {RESNAME: [atom names]}, conflicts) over the
+    library files, later files overriding earlier ones.
+    """
+    charges, sources, residues, conflicts = {}, {}, {}, []
+    for filename in libs:
+        for resname, entry in read_lib(filename).items():
+            residues[resname] = [name for name, _, _ in entry["atoms"]]
+            for name, _, charge in entry["atoms"]:
+                key = (resname, name)
+                if key in charges and abs(charges[key] - charge) > 1e-6:
+                    conflicts.append((key, sources[key], charges[key],
+                                      os.path.basename(filename), charge))
+                charges[key] = charge
+                sources[key] = os.path.basename(filename)
+    return charges, residues, conflicts
+
+
+def read_qmap(filename):
+    """
+    (line number, kind, PDB ID, state 1 lib ID, state 2 lib ID) of each
+    entry; the lib IDs are the last two columns (FC_step1.qmap has an extra
+    one).
+    """
+    entries = []
+    with open(filename, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            fields = line.split('#')[0].split()
+            if len(fields) >= 4 and fields[0] in ('q', 'n'):
+                entries.append((line_num, fields[0], fields[1], fields[-2], fields[-1]))
+    return entries
+
+
+def lib_key(lib_id):
+    resname, _, atom = lib_id.partition('.')
+    return resname.upper(), atom
+
+
+def account(entries, charges, residues):
+    """Charge report of one qmap's entries (see the module docstring)."""
+    report = {"atoms": [], "missing": [], "duplicates": [],
+              "totals": {kind: [0.0, 0.0] for kind in ('q', 'n')},
+              "groups": defaultdict(lambda: {"q": [0.0, 0.0], "residues": set(),
+                                             "atoms": set()})}
+    seen = Counter(pdb_id for _, _, pdb_id, _, _ in entries)
+    report["duplicates"] = sorted(pdb_id for pdb_id, n in seen.items() if n > 1)
+
+    for line_num, kind, pdb_id, lib1, lib2 in entries:
+        values = []
+        for lib_id in (lib1, lib2):
+            charge = 0.0 if lib_id == ABSENT else charges.get(lib_key(lib_id))
+            if charge is None:
+                report["missing"].append((line_num, lib_id))
+            values.append(charge)
+        report["atoms"].append((line_num, kind, pdb_id, lib1, values[0], lib2, values[1]))
+        group = report["groups"][pdb_id.partition('.')[0]]
+        if lib1 != ABSENT:
+            group["residues"].add(lib_key(lib1)[0])
+            group["atoms"].add(lib_key(lib1))
+        for s in range(2):
+            report["totals"][kind][s] += values[s] or 0.0
+            if kind == 'q':
+                group["q"][s] += values[s] or 0.0
+
+    # Whole-residue charge: q atoms plus the untouched atoms of the residue
+    for group in report["groups"].values():
+        rest = sum(charges[(resname, name)] for resname in group["residues"]
+                   for name in residues.get(resname, ())
+                   if (resname, name) not in group["atoms"])
+        group["complete"] = all(resname in residues for resname in group["residues"])
+        group["residue"] = [group["q"][s] + rest for s in range(2)]
+    return report
+
+
+def off_integer(value):
+    return abs(value - round(value)) > TOLERANCE
+
+
+def print_report(qmap, report, verbose=False):
+    """Print one qmap's report; returns True if it has errors."""
+    print(f"\n{qmap}")
+    if not report["atoms"]:
+        print("    empty qmap, nothing to check")
+        return False
+    if verbose:
+        for line_num, kind, pdb_id, lib1, q1, lib2, q2 in report["atoms"]:
+            fmt = lambda q: f"{q:8.4f}" if q is not None else "       ?"
+            print(f"    {line_num:4d} {kind} {pdb_id:12s} {lib1:12s} {fmt(q1)}  ->  "
+                  f"{lib2:12s} {fmt(q2)}")
+
+    errors = bool(report["missing"] or report["duplicates"])
+    for kind, (s1, s2) in report["totals"].items():
+        n = sum(1 for atom in report["atoms"] if atom[1] == kind)
+        if n:
+            print(f"    {kind} atoms {n:4d}   state 1 {s1:8.4f}   state 2 {s2:8.4f}   "
+                  f"drift {s2 - s1:+8.4f}   "
+                  f"{'charge not conserved' if abs(s2 - s1) > TOLERANCE else 'ok'}")
+
+    print(f"    {'group':10s} {'residues':14s} {'q st.1':>9s} {'q st.2':>9s} {'drift':>9s} "
+          f"{'res st.1':>9s} {'res st.2':>9s}")
+    for name, group in sorted(report["groups"].items()):
+        s1, s2 = group["q"]
+        r1, r2 = group["residue"]
+        if group["complete"]:
+            flag = "not integer" if off_integer(r1) or off_integer(r2) else ""
+            residue = f"{r1:9.4f} {r2:9.4f}"
+        else:
+            flag, residue = "residue not in libraries", f"{'-':>9s} {'-':>9s}"
+        print(f"    {name:10s} {','.join(sorted(group['residues'])):14s} {s1:9.4f} {s2:9.4f} "
+              f"{s2 - s1:+9.4f} {residue} {flag}")
+
+    groups = report["groups"].values()
+    if all(group["complete"] for group in groups):
+        totals = [sum(group["residue"][s] for group in groups) for s in range(2)]
+        flags = [f"state {s + 1} not integer" for s in range(2) if off_integer(totals[s])]
+        errors |= bool(flags)
+        print(f"    {'all':10s} {'':14s} {'':9s} {'':9s} {'':9s} {totals[0]:9.4f} "
+              f"{totals[1]:9.4f} {', '.join(flags)}")
+    else:
+        print("    total charge not checked: residues missing from the libraries")
+
+    if report["duplicates"]:
+        print(f"    atoms mapped more than once: {', '.join(report['duplicates'])}")
+    if report["missing"]:
+        missing = sorted({lib_id for _, lib_id in report["missing"]})
+        print(f"    {len(missing)} lib IDs not in the libraries: {' '.join(missing[:12])}"
+              f"{' ...' if len(missing) > 12 else ''}")
+    return errors
+
+
+def write_csv(results, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["qmap", "line", "kind", "pdb_id", "state1", "charge1", "state2",
+                         "charge2"])
+        for qmap, report in results:
+            for atom in report["atoms"]:
+                writer.writerow([os.path.basename(qmap)] + list(atom))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-state charge accounting of qmap files")
+    parser.add_argument("qmaps", nargs="*", help="qmap files (default: all concerted and "
+                                                 "stepwise qmaps)")
+    parser.add_argument("--libs", choices=sorted(LIB_DIRS),
+                        help="library set for the given qmaps (default: by location)")
+    parser.add_argument("--csv", help="write the per-atom charges to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every atom")
+    args = parser.parse_args()
+
+    if args.qmaps:
+        jobs = [(args.libs or ("stepwise" if "stepwise" in os.path.abspath(q) else "concerted"), q)
+                for q in args.qmaps]
+    else:
+        jobs = [(libs, q) for libs, qmaps in QMAPS.items() for q in qmaps if os.path.exists(q)]
+
+    indexes = {}
+    for libs in sorted({libs for libs, _ in jobs}):
+        indexes[libs] = charge_index(lib_files(LIB_DIRS[libs]))
+        conflicts = indexes[libs][2]
+        print(f"{libs}: {len(indexes[libs][0])} library atoms, {len(conflicts)} charge conflicts")
+        for (resname, name), old_source, old, new_source, new in conflicts:
+            print(f"    {resname}.{name:6s} {old_source}: {old:8.4f}  {new_source}: {new:8.4f} "
+                  f"(used)")
+
+    results = []
+    failed = []
+    for libs, qmap in jobs:
+        charges, residues, _ = indexes[libs]
+        report = account(read_qmap(qmap), charges, residues)
+        results.append((qmap, report))
+        if print_report(qmap, report, args.verbose):
+            failed.append(qmap)
+
+    if args.csv:
+        write_csv(results, args.csv)
+        print(f"\nPer-atom charges written to {args.csv}")
+    if failed:
+        print(f"\n{len(failed)} of {len(results)} qmaps have missing atoms or non-integer "
+              f"totals: {', '.join(os.path.basename(q) for q in failed)}")
+        sys.exit(1)
+    print(f"\nAll {len(results)} qmaps balanced")
+
+
+if __name__ == "__main__":
+    main()
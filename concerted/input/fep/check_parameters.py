@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Parameter coverage check for a topology / FEP file pair before submission.
+
+qdyn5 stops on a missing parameter only after the job has queued, and
+make_fep(..., ignore_errors=True) writes an FEP file with whatever it could
+not resolve left out. This script checks a .top (with its solvated .pdb,
+same atom order) and the matching .fep against the parameter index of
+parameters/parameter_store.py. The parameters are those qprep5 read: the
+PRM_FILE of the topology header (looked up in parameters/ when the path is
+from another machine), else parameters/qoplsaa_all.prm; --set picks a named
+set of source files or other .prm files instead.
+
+
+  topology  every bond, angle, torsion and improper: the atom-type tuple of
+            each term is looked up (one lookup per distinct (type tuple,
+            code) pair, mapped back with numpy), reporting tuples without
+            parameters and codes whose values differ from the .prm files
+            (a topology built from an older qoplsaa_all.prm);
+  FEP       every term touching an FEP atom, in state 1 and state 2, with
+            the atom types of [change_atoms]: listed terms must point at
+            defined, filled-in types (no <FIX> placeholders) that agree with
+            the parameters of that state's atom types; unlisted terms keep
+            the topology values in both states, so a type change that
+            needs different or missing parameters is reported as well.
+
+Errors (missing parameters, placeholders, undefined types or atoms, FEP
+atom types the parameter set does not define) make the run exit non-zero, so it can gate sbatch:
+
+    python check_parameters.py && sbatch run_qdyn_5.sh
+
+Warnings (values that differ from the .prm files) only fail with --strict.
+
+Structures are given as solvated PDB files or directories of
+*_solvated.pdb; the .top next to each PDB is used and the FEP file is found
+by batch_make_fep.py's naming (LMRR_WT2_ARG10A_solvated.pdb ->
+mutants/LMRR_WT2_ARG10A.fep). All structures are checked in parallel.
+
+Usage:
+    python check_parameters.py [pdb_or_dir ...] [--fep-dir mutants] [--fep file.fep]
+                               [--set concerted | --set file.prm ...] [--strict] [-v]
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(ROOT, "parameters"))
+sys.path.insert(0, os.path.join(ROOT, "structures"))
+from batch_make_fep import DEFAULT_STRUCTURES, fep_name, list_structures
+from fep_file import FEPFile, strip_id
+from parameter_store import ParameterStore, parameter_files
+from pdb_arrays import read_pdb
+from qtop import atom_types, load_topology
+
+KINDS = ("bonds", "angles", "torsions", "impropers")
+N_ATOMS = {"bonds": 2, "angles": 3, "torsions": 4, "impropers": 4}
+FEP_SECTIONS = {"bonds": ("bond_types", "change_bonds"),
+                "angles": ("angle_types", "change_angles"),
+                "torsions": ("torsion_types", "change_torsions"),
+                "impropers": ("improper_types", "change_impropers")}
+# Parameter values compared: (fc, r0), (fc, theta0), (fc, mult, phase), (fc, phi0)
+N_COMPARED = {"bonds": 2, "angles": 2, "torsions": 3, "impropers": 2}
+RTOL = 1e-3
+ATOL = 2e-3
+DEFAULT_PRM = os.path.join(ROOT, "parameters", "qoplsaa_all.prm")
+
+
+def topology_prm_files(top_file):
+    """
+    [PRM_FILE] of a topology header; the file of the same name in
+    parameters/ if the path does not exist here, else DEFAULT_PRM.
+    """
+    if not os.path.isfile(top_file):
+        return [DEFAULT_PRM]     # reported by check_structure
+    with open(top_file, 'r') as f:
+        for line in f:
+            if line.startswith("PRM_FILE"):
+                path = line[10:].strip()
+                break
+            if line.startswith("END"):
+                return [DEFAULT_PRM]
+        else:
+            return [DEFAULT_PRM]
+    for candidate in (path, os.path.join(ROOT, "parameters", os.path.basename(path))):
+        if os.path.isfile(candidate):
+            return [os.path.abspath(candidate)]
+    return [DEFAULT_PRM]
+
+
+def read_topology(top_file):
+    """
+    Atom types and bonded terms of a Q topology:
+    {"types": (n_atoms,) type names, kind: (atoms (M, n) 0-based, codes (M,)),
+     kind + "_codes": {code: values}}.
+    """
+    top = load_topology(top_file)
+    topology = {"types": atom_types(top)}
+    for kind in KINDS:
+        term = kind[:-1]
+        topology[kind] = (top[kind], top[f"{term}_codes"])
+        topology[kind + "_codes"] = {code: tuple(float(v) for v in values) for code, values
+                                     in enumerate(top[f"{term}_parameters"], 1)}
+    return topology
+
+
+def _is_int(token):
+    return token.lstrip('-').isdigit()
+
+
+def term_key(kind, atoms):
+    """Order-independent key of a term's atom indices."""
+    atoms = tuple(int(a) for a in atoms)
+    if kind == "bonds":
+        return tuple(sorted(atoms))
+    if kind == "impropers":
+        return tuple(sorted(atoms))
+    return min(atoms, atoms[::-1])
+
+
+def expected(store, kind, types):
+    """Parameter terms [(fc, r0/theta0/mult.., ...)] of a type tuple, or None."""
+    values = store.get(kind, *types)
+    if values is None:
+        return None
+    if kind == "torsions":
+        return [(fc / paths, mult, phase) for fc, mult, phase, paths in values]
+    return [values[:N_COMPARED[kind]]]
+
+
+def agrees(kind, actual, wanted):
+    """Do the actual parameter terms match the expected ones?"""
+    n = N_COMPARED[kind]
+    actual = sorted(tuple(a[:n]) for a in actual)
+    wanted = sorted(tuple(w[:n]) for w in wanted)
+    if kind == "torsions":
+        # Zero-force terms may be left out on either side
+        actual = [a for a in actual if a[0] != 0.0]
+        wanted = [w for w in wanted if w[0] != 0.0]
+    return len(actual) == len(wanted) and all(
+        np.allclose(a, w, rtol=RTOL, atol=ATOL) for a, w in zip(actual, wanted))
+
+
+def check_topology(topology, store):
+    """Issues of the topology terms, one per (type tuple, code) pair."""
+    issues = []
+    for kind in KINDS:
+        atoms, codes = topology[kind]
+        if not len(codes):
+            continue
+        type_rows = topology["types"][atoms]
+        tuples, inverse = np.unique(type_rows, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        pairs, pair_index = np.unique(np.column_stack([inverse, codes]), axis=0,
+                                      return_inverse=True)
+        counts = np.bincount(pair_index.ravel(), minlength=len(pairs))
+        for (u, code), count in zip(pairs, counts):
+            types = tuple(tuples[u])
+            wanted = expected(store, kind, types)
+            label = f"{kind[:-1]} {'-'.join(types)} (code {code}, {count} terms)"
+            if wanted is None:
+                issues.append(("error", "topology", f"{label}: no parameters"))
+                continue
+            actual = topology[kind + "_codes"].get(int(code))
+            if actual is None:
+                issues.append(("error", "topology", f"{label}: undefined code"))
+                continue
+            if kind == "torsions":
+                # Torsion codes are single terms: compare with the same multiplicity
+                wanted = [w for w in wanted if w[1] == abs(actual[1])]
+                actual = [(actual[0] / (actual[3] or 1.0), abs(actual[1]), actual[2])]
+            else:
+                actual = [actual]
+            if not agrees(kind, actual, wanted):
+                issues.append(("warning", "topology",
+                               f"{label}: {actual[0]} differs from .prm {wanted}"))
+    return issues
+
+
+def fep_atom_indices(fep, atoms):
+    """{FEP index: topology atom index} through the PDB IDs of [atoms]."""
+    lookup = {(int(r), n): i for i, (r, n) in enumerate(zip(atoms["resseq"], atoms["name"]))}
+    mapping, missing = {}, []
+    for row in fep.rows("atoms"):
+        pdb_id = strip_id(row.values[1])
+        residue, _, name = pdb_id.partition('.')
+        index = lookup.get((int(residue), name))
+        if index is None:
+            missing.append(pdb_id)
+        else:
+            mapping[int(row.values[0])] = index
+    return mapping, missing
+
+
+def _fep_atom(token, by_pdb_id):
+    """Topology index of a change_* atom field ($res.name$ or a Q index)."""
+    if token.startswith('$'):
+        return by_pdb_id.get(strip_id(token))
+    return int(token) - 1 if _is_int(token) else None
+
+
+def check_fep(fep, topology, atoms, store):
+    """Issues of the state 1 / state 2 terms involving FEP atoms."""
+    issues = []
+    mapping, missing = fep_atom_indices(fep, atoms)
+    for pdb_id in missing:
+        issues.append(("error", "fep", f"atom {pdb_id} not in the structure"))
+    by_pdb_id = {strip_id(row.values[1]): mapping[int(row.values[0])]
+                 for row in fep.rows("atoms") if int(row.values[0]) in mapping}
+
+    fep_types = fep.index("atom_types")
+    states = [topology["types"].astype(object), topology["types"].astype(object)]
+    changed = set()
+    for row in fep.rows("change_atoms"):
+        index = mapping.get(int(row.values[0]))
+        if index is None:
+            continue
+        changed.add(index)
+        for s in range(2):
+            states[s][index] = row.values[1 + s]
+
+    used = sorted({name for state in states for name in state[sorted(changed)]})
+    for name in used:
+        if name not in fep_types:
+            issues.append(("error", "fep", f"atom type {name} used in [change_atoms] "
+                                           f"but not in [atom_types]"))
+        elif any(v.startswith('<') for v in fep_types[name].values):
+            issues.append(("error", "fep", f"atom type {name} has placeholders: "
+                                           f"{' '.join(fep_types[name].values[1:])}"))
+    # Terms with types the parameter set does not know cannot be checked
+    unknown = {name for name in used if store.atom_type(name) is None}
+    if unknown:
+        issues.append(("error", "fep", f"{len(unknown)} FEP atom types not in the parameter "
+                                       f"set, their terms are not checked: "
+                                       f"{' '.join(sorted(unknown))}"))
+
+    fep_atoms = np.array(sorted(mapping.values()), dtype=np.int64)
+    for kind in KINDS:
+        n = N_ATOMS[kind]
+        types_section, change_section = FEP_SECTIONS[kind]
+        parameters = fep.index(types_section) if types_section in fep.sections else {}
+
+        # FEP rows per term: codes of state 1 and 2 (several rows for torsions)
+        listed = {}
+        for row in fep.rows(change_section):
+            if len(row.values) < n + 2:
+                issues.append(("error", "fep", f"{change_section}: no state codes in "
+                                               f"'{row.text.strip()}'"))
+                continue
+            term_atoms = [_fep_atom(t, by_pdb_id) for t in row.values[:n]]
+            if None in term_atoms:
+                issues.append(("error", "fep", f"{change_section}: unknown atom in "
+                                               f"{' '.join(row.values[:n])}"))
+                continue
+            key = term_key(kind, term_atoms)
+            entry = listed.setdefault(key, (term_atoms, [[], []]))
+            for s in range(2):
+                entry[1][s].append(row.values[n + s])
+
+        top_atoms, top_codes = topology[kind]
+        touching = np.flatnonzero(np.isin(top_atoms, fep_atoms).any(axis=1))
+        # Terms of the topology (topology codes) plus those only in the FEP file
+        terms = {}
+        for i in touching:
+            terms.setdefault(term_key(kind, top_atoms[i]),
+                             (top_atoms[i], []))[1].append(int(top_codes[i]))
+        for key, (term_atoms, _) in listed.items():
+            terms.setdefault(key, (term_atoms, []))
+
+        for key, (term_atoms, codes) in terms.items():
+            term_atoms = np.asarray(term_atoms)
+            label_ids = "-".join(atoms_label(atoms, a) for a in term_atoms)
+            for s in range(2):
+                types = tuple(states[s][term_atoms])
+                if unknown.intersection(types):
+                    continue
+                label = f"{kind[:-1]} {label_ids} state {s + 1} ({'-'.join(types)})"
+                if key in listed:
+                    fep_codes = [c for c in listed[key][1][s] if c != '0']
+                    if not fep_codes:
+                        continue
+                    undefined = [c for c in fep_codes if c not in parameters]
+                    if undefined:
+                        issues.append(("error", "fep", f"{label}: [{types_section}] "
+                                                       f"{', '.join(undefined)} not defined"))
+                        continue
+                    values = [parameters[c].values[1:] for c in fep_codes]
+                    if any(v.startswith('<') for vals in values for v in vals):
+                        issues.append(("error", "fep", f"{label}: placeholder parameters "
+                                                       f"({' '.join(values[0])})"))
+                        continue
+                    if kind == "bonds" and len(values[0]) == 3:
+                        # Morse bond (D, alpha, r0): only the type is checked
+                        continue
+                    actual = [tuple(float(v) for v in vals) for vals in values]
+                else:
+                    if all(states[s][a] == topology["types"][a] for a in term_atoms):
+                        continue
+                    top_values = [topology[kind + "_codes"].get(c) for c in codes]
+                    if kind == "torsions":
+                        actual = [(v[0] / (v[3] or 1.0), abs(v[1]), v[2]) for v in top_values]
+                    else:
+                        actual = top_values
+                wanted = expected(store, kind, types)
+                if wanted is None and key in listed:
+                    issues.append(("warning", "fep", f"{label}: no .prm parameters to "
+                                                     f"compare the FEP values with"))
+                elif wanted is None:
+                    # A term among changing atoms only is one make_fep should have
+                    # written (ignore_errors=True leaves it out); at the edge of the
+                    # FEP region the topology value is the usual choice
+                    severity = "error" if changed.issuperset(term_atoms.tolist()) else "warning"
+                    issues.append((severity, "fep", f"{label}: no parameters, topology "
+                                                    f"value used in both states"))
+                elif not agrees(kind, actual, wanted):
+                    where = "FEP" if key in listed else "topology (not in FEP)"
+                    issues.append(("warning", "fep", f"{label}: {where} {actual} "
+                                                     f"differs from .prm {wanted}"))
+    return issues
+
+
+def atoms_label(atoms, index):
+    return f"{atoms['resseq'][index]}.{atoms['name'][index]}"
+
+
+def check_structure(pdb_file, fep_file, prm_files):
+    """(pdb, fep, issues) for one structure; never raises."""
+    top_file = os.path.splitext(pdb_file)[0] + ".top"
+    try:
+        store = ParameterStore.load(prm_files)
+        topology = read_topology(top_file)
+        atoms = read_pdb(pdb_file)
+        if len(atoms["name"]) != len(topology["types"]):
+            return pdb_file, fep_file, [("error", "input", f"{len(atoms['name'])} atoms in "
+                                         f"the PDB, {len(topology['types'])} in {top_file}")]
+        issues = check_topology(topology, store)
+        if fep_file is None:
+            issues.append(("error", "input", "no FEP file"))
+        else:
+            issues += check_fep(FEPFile.read(fep_file), topology, atoms, store)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        return pdb_file, fep_file, [("error", "input", f"{type(e).__name__}: {e}")]
+    return pdb_file, fep_file, issues
+
+
+def _check_structure(args):
+    return check_structure(*args)
+
+
+def find_fep(pdb_file, fep_dirs):
+    for directory in fep_dirs:
+        candidate = os.path.join(directory, fep_name(pdb_file))
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check topology / FEP parameter coverage "
+                                                 "before submitting")
+    parser.add_argument("paths", nargs="*", default=DEFAULT_STRUCTURES,
+                        help="solvated PDB files (with .top alongside) or directories "
+                             "with *_solvated.pdb")
+    parser.add_argument("--fep", help="FEP file to use for every structure")
+    parser.add_argument("--fep-dir", action="append",
+                        help="directory to look for <name>.fep (default: mutants, .)")
+    parser.add_argument("--set", nargs="+", help="parameter set name (parameter_store.py) or "
+                                                 ".prm files (default: the topology's "
+                                                 "PRM_FILE)")
+    parser.add_argument("--strict", action="store_true", help="fail on warnings too")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every issue")
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    structures = list_structures(args.paths)
+    if not structures:
+        print("No structures found")
+        sys.exit(1)
+    fep_dirs = args.fep_dir or [os.path.join(HERE, "mutants"), HERE]
+    try:
+        prm_files = [parameter_files(args.set) if args.set else
+                     topology_prm_files(os.path.splitext(pdb)[0] + ".top")
+                     for pdb in structures]
+        # Build each cached parameter index once before the workers load it
+        for files in {tuple(files) for files in prm_files}:
+            ParameterStore.load(list(files))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    tasks = [(pdb, args.fep or find_fep(pdb, fep_dirs), files)
+             for pdb, files in zip(structures, prm_files)]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(_check_structure, tasks))
+
+    failed = 0
+    for pdb, fep, issues in results:
+        errors = [i for i in issues if i[0] == "error"]
+        warnings = [i for i in issues if i[0] == "warning"]
+        bad = errors or (args.strict and warnings)
+        failed += bool(bad)
+        print(f"{os.path.basename(pdb):40s} {os.path.basename(fep or '-'):28s} "
+              f"{'FAIL' if bad else 'ok':4s} {len(errors)} errors, {len(warnings)} warnings")
+        shown = issues if args.verbose else errors
+        for severity, where, message in shown:
+            print(f"    {severity:7s} {where:8s} {message}")
+    if failed:
+        print(f"\n{failed} of {len(results)} structures failed the parameter check")
+        sys.exit(1)
+    print(f"\nAll {len(results)} structures passed")
+
+
+if __name__ == "__main__":
+    main()
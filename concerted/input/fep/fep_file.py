@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Read, edit and write Q .fep files without Qpyl.
+
+The file is split into its header comments and the [sections]
+([FEP], [atoms], [atom_types], [change_atoms], [change_charges],
+[soft_pairs], [off_diagonals], [bond_types], [change_bonds], ...). Every
+line is kept with its original text; data lines are also tokenized with
+the column at which each token starts. Unchanged lines are written back
+verbatim, so write(read(x)) is byte-identical to x, hand-edited columns
+included. A changed line is re-rendered by putting every token back at its
+original column (pushed right only if the previous token grew), so edits
+keep the Qtools layout.
+
+Lookups:
+
+    fep = FEPFile.read("LMRR_WT2.fep")
+    fep.atom("224.C10")             Q index of a PDB ID (also "$224.C10$")
+    fep.pdb_id(12)                  PDB ID of a Q index
+    fep.index("change_bonds")       {("224.C10", "224.H12"): Row, ...}
+    fep.index("bond_types")["46"].values
+
+renumber() maps residue numbers in every PDB ID (data and comments), which
+is what a per-mutant FEP file needs when the topology numbering shifts;
+residue_map() derives that mapping from the old and new structures by a
+sequence alignment.
+
+Usage:
+    python fep_file.py LMRR_WT2.fep [...]                  round-trip check + summary
+    python fep_file.py LMRR_WT2.fep --renumber 224:225 --renumber 225:226 -o out.fep
+    python fep_file.py LMRR_WT2.fep --old-pdb WT.pdb --new-pdb MUT.pdb -o out.fep
+"""
+
+import argparse
+import difflib
+import os
+import re
+import sys
+
+# Sections whose first field is the key of the row
+KEYED_BY_FIRST = ("atoms", "atom_types", "change_atoms", "change_charges", "bond_types",
+                  "angle_types", "torsion_types", "improper_types")
+# Sections whose rows are keyed by their atoms: (section, number of atoms)
+KEYED_BY_ATOMS = {"change_bonds": 2, "change_angles": 3, "change_torsions": 4,
+                  "change_impropers": 4, "soft_pairs": 2}
+
+SECTION_RE = re.compile(r'^\[([^\]]+)\]')
+# residue.atom inside $...$ PDB IDs and in comments ("224.C10-224.H12");
+# the atom name has to start with a letter so numbers like 0.945 are left alone
+PDB_ID_RE = re.compile(r"(?<![\w.])(\d+)\.([A-Za-z][\w']*)")
+
+
+class Row:
+    """One data line: whitespace-separated tokens with their start columns."""
+
+    def __init__(self, text, section):
+        self.text = text
+        self.section = section
+        self.tokens, self.starts = [], []
+        body = text.rstrip('\n')
+        for match in re.finditer(r'\S+', body):
+            self.tokens.append(match.group())
+            self.starts.append(match.start())
+        self.width = len(body)
+        self.newline = text[len(body):]
+        self.dirty = False
+
+    @property
+    def split(self):
+        """Position of the comment marker (number of data tokens)."""
+        return self.tokens.index('#') if '#' in self.tokens else len(self.tokens)
+
+    @property
+    def values(self):
+        """Data tokens (before the '#' comment)."""
+        return self.tokens[:self.split]
+
+    @property
+    def comment(self):
+        """Comment tokens (after the '#')."""
+        return self.tokens[self.split + 1:]
+
+    def set(self, i, value):
+        """Replace data token i."""
+        self.tokens[i] = str(value)
+        self.dirty = True
+
+    def replace_tokens(self, func):
+        """Apply func to every token (data and comment), marking changes."""
+        for i, token in enumerate(self.tokens):
+            new = func(token)
+            if new != token:
+                self.tokens[i] = new
+                self.dirty = True
+
+    def render(self):
+        if not self.dirty:
+            return self.text
+        out = ""
+        for token, start in zip(self.tokens, self.starts):
+            if len(out) < start:
+                out += " " * (start - len(out))
+            elif out:
+                out += " "
+            out += token
+        return out.ljust(self.width) + self.newline
+
+
+class Section:
+    def __init__(self, name, header):
+        self.name = name
+        self.header = header
+        # Lines are either str (comments / blanks) or Row
+        self.lines = []
+
+    @property
+    def rows(self):
+        return [line for line in self.lines if isinstance(line, Row)]
+
+    def text(self):
+        return self.header + "".join(line.render() if isinstance(line, Row) else line
+                                     for line in self.lines)
+
+
+class FEPFile:
+    def __init__(self, preamble, sections):
+        self.preamble = preamble
+        self.sections = sections
+        self._atoms = None
+
+    @classmethod
+    def parse(cls, text):
+        preamble = []
+        sections = {}
+        current = None
+        for line in text.splitlines(keepends=True):
+            match = SECTION_RE.match(line)
+            if match:
+                current = Section(match.group(1).strip(), line)
+                sections[current.name] = current
+            elif current is None:
+                preamble.append(line)
+            elif not line.strip() or line.lstrip().startswith('#') or \
+                    line.strip().startswith('<'):
+                current.lines.append(line)
+            else:
+                current.lines.append(Row(line, current.name))
+        return cls("".join(preamble), sections)
+
+    @classmethod
+    def read(cls, filename):
+        with open(filename, 'r', newline='') as f:
+            return cls.parse(f.read())
+
+    def text(self):
+        return self.preamble + "".join(s.text() for s in self.sections.values())
+
+    def write(self, filename):
+        with open(filename, 'w', newline='') as f:
+            f.write(self.text())
+
+    def rows(self, section):
+        return self.sections[section].rows if section in self.sections else []
+
+    def index(self, section):
+        """Rows of a section keyed by their index / type name or their atoms."""
+        if section in KEYED_BY_ATOMS:
+            n = KEYED_BY_ATOMS[section]
+            return {tuple(strip_id(v) for v in row.values[:n]): row for row in self.rows(section)}
+        if section in KEYED_BY_FIRST:
+            return {row.values[0]: row for row in self.rows(section)}
+        raise KeyError(f"section [{section}] has no row key")
+
+    @property
+    def states(self):
+        for row in self.rows("FEP"):
+            if row.values[0] == "states":
+                return int(row.values[1])
+        return None
+
+    def _atom_table(self):
+        if self._atoms is None:
+            self._atoms = {strip_id(row.values[1]): int(row.values[0])
+                           for row in self.rows("atoms")}
+        return self._atoms
+
+    def atom(self, pdb_id):
+        """Q (FEP) index of a PDB ID such as '224.C10' or '$224.C10$'."""
+        return self._atom_table()[strip_id(pdb_id)]
+
+    def pdb_id(self, q_index):
+        for row in self.rows("atoms"):
+            if int(row.values[0]) == q_index:
+                return strip_id(row.values[1])
+        raise KeyError(q_index)
+
+    def residues(self):
+        """Residue numbers referenced by the [atoms] section."""
+        return sorted({int(pdb_id.split('.')[0]) for pdb_id in self._atom_table()})
+
+    def renumber(self, mapping):
+        """Map residue numbers {old: new} in every PDB ID of the file."""
+        mapping = {int(k): int(v) for k, v in mapping.items()}
+
+        def remap(token):
+            return PDB_ID_RE.sub(lambda m: f"{mapping.get(int(m.group(1)), int(m.group(1)))}."
+                                           f"{m.group(2)}", token)
+
+        for section in self.sections.values():
+            for row in section.rows:
+                row.replace_tokens(remap)
+        self._atoms = None
+
+
+def strip_id(pdb_id):
+    return pdb_id.strip('$')
+
+
+def residue_map(old_pdb, new_pdb, residues):
+    """
+    {old residue number: new residue number} for the given residues, from a
+    sequence alignment of the two structures (Q numbering = residue order).
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    "..", "..", "structures"))
+    from pdb_arrays import read_pdb, residue_table
+
+    old, new = residue_table(read_pdb(old_pdb)), residue_table(read_pdb(new_pdb))
+    matcher = difflib.SequenceMatcher(None, old["resname"].tolist(), new["resname"].tolist(),
+                                      autojunk=False)
+    pairs = {}
+    for a, b, size in matcher.get_matching_blocks():
+        pairs.update((a + k + 1, b + k + 1) for k in range(size))
+    missing = [r for r in residues if r not in pairs]
+    if missing:
+        raise ValueError(f"residues {missing} of {old_pdb} have no counterpart in {new_pdb}")
+    return {r: pairs[r] for r in residues}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Q .fep file round trip and renumbering")
+    parser.add_argument("fep", nargs="+")
+    parser.add_argument("--renumber", action="append", default=[], metavar="OLD:NEW",
+                        help="residue number mapping (repeatable)")
+    parser.add_argument("--old-pdb", help="structure the FEP file was made for")
+    parser.add_argument("--new-pdb", help="structure to renumber the FEP file for")
+    parser.add_argument("-o", "--output", help="output file (single input only)")
+    args = parser.parse_args()
+
+    renumbering = args.renumber or (args.old_pdb and args.new_pdb)
+    if args.output and len(args.fep) > 1:
+        parser.error("-o needs a single input file")
+
+    failed = False
+    for filename in args.fep:
+        with open(filename, 'r', newline='') as f:
+            original = f.read()
+        fep = FEPFile.parse(original)
+        identical = fep.text() == original
+        failed |= not identical
+        counts = ", ".join(f"{name} {len(s.rows)}" for name, s in fep.sections.items()
+                           if s.rows and name != "FEP")
+        print(f"{filename}: {fep.states} states, {counts}; round trip "
+              f"{'identical' if identical else 'DIFFERS'}")
+
+        if renumbering:
+            if args.renumber:
+                mapping = dict(item.split(':') for item in args.renumber)
+            else:
+                mapping = residue_map(args.old_pdb, args.new_pdb, fep.residues())
+            changes = {int(k): int(v) for k, v in mapping.items() if int(k) != int(v)}
+            fep.renumber(changes)
+            print(f"  renumbered residues: "
+                  f"{', '.join(f'{k}->{v}' for k, v in sorted(changes.items())) or 'none'}")
+        if args.output:
+            fep.write(args.output)
+            print(f"  written to {args.output}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
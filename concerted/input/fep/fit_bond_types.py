@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Fit Morse (or harmonic) bond types to QM scans and patch them into a .fep file.
+
+The [bond_types] and [change_bonds] entries of the reacting bonds used to be
+typed in by hand from morse.py printouts. Here every scan is fitted in one
+batch (MorseParameterCalculator.fit_morse_scans), converted to Q units
+(D in kcal/mol, alpha in 1/A, r0 in A; harmonic Fc = 2 D alpha^2 in
+kcal/mol/A^2) and written into the FEP file with fep_file.py, so all other
+lines stay byte-identical.
+
+A scan is a two-column text file of bond length (A) and energy, e.g. saved
+from the relaxed scan in charges/TS_scan.ipynb with
+
+    np.savetxt("scan_NC.txt", np.column_stack(
+        [np.linspace(d_rs, d_ps, len(scan_energies)), scan_energies]))
+
+and is given as BOND=FILE, where BOND is
+
+    a [bond_types] index                      11=scan.txt
+    a morse.py reactive bond                  "C=N iminium=cn.txt", C12-C3=cc.txt
+    a PRM_ID from the [bond_types] comments   prd.C12-prd.C3=scan.txt
+    a pair of PDB IDs from [change_bonds]     224.C12-225.C3=scan.txt
+
+A reactive bond is turned into its PDB ID pair through the library IDs in
+the [atoms] comments (IMI.C12-IND.C3 -> 224.C12-225.C3), since the
+[bond_types] PRM_IDs name the product atoms (prd.C12-prd.C3).
+
+Index and PRM_ID entries are replaced in place. For a PDB ID pair the bond
+types of its [change_bonds] row are replaced; a type that other rows also
+use is left alone and the row gets a new type instead. A pair that is not
+in [change_bonds] yet gets a new row, with the fitted type in the states
+listed after a colon (224.C12-225.C3:2=scan.txt; default all states).
+Scans that would set the same bond type or pair are refused.
+
+Usage:
+    python fit_bond_types.py LMRR_WT4.fep --scan BOND=FILE [...] [--units hartree]
+                             [--harmonic BOND ...] [-o out.fep | --in-place] [--dry-run]
+"""
+
+import argparse
+import sys
+
+from fep_file import FEPFile, Row, strip_id
+from morse import (DEFAULT_UNITS, ENERGY_UNITS, EV_TO_KCAL, REACTIVE_BONDS,
+                   MorseParameterCalculator, read_scan)
+
+SECTION = "bond_types"
+CHANGES = "change_bonds"
+
+
+def parse_bond(spec):
+    """(bond, states or None) of 'BOND[:states]'."""
+    bond, _, states = spec.partition(':')
+    if not states:
+        return bond, None
+    return bond, [int(s) for s in states.split(',')]
+
+
+def _prm_key(text):
+    """Order- and case-independent key of an 'a.X-b.Y' PRM_ID."""
+    return tuple(sorted(part.lower() for part in text.split('-')))
+
+
+def type_row(index, values, comment, morse=True):
+    """A [bond_types] row in the Qtools layout."""
+    if morse:
+        D, alpha, r0 = values
+        line = f"{index:<6s}{D:>10.3f}{alpha:>11.3f}{r0:>14.3f}"
+    else:
+        fc, r0 = values
+        line = f"{index:<6s}{fc:>18.1f}{r0:>17.3f}"
+    return Row(f"{line}   # {comment}\n", SECTION)
+
+
+def change_row(atoms, codes, comment):
+    """A [change_bonds] row in the Qtools layout."""
+    ids = (f"${atoms[0]}$".ljust(11) + f"${atoms[1]}$").ljust(20)
+    states = f"{codes[0]:>5d}" + "".join(f"{c:>6d}" for c in codes[1:])
+    return Row(f"{ids}{states}     # {comment}\n", CHANGES)
+
+
+def replace_row(fep, section, old, new):
+    lines = fep.sections[section].lines
+    lines[lines.index(old)] = new
+
+
+def append_row(fep, section, row):
+    """Insert row after the last data row of the section."""
+    lines = fep.sections[section].lines
+    last = max((i for i, line in enumerate(lines) if isinstance(line, Row)), default=-1)
+    lines.insert(last + 1, row)
+
+
+def next_type_index(fep):
+    return str(max((int(k) for k in fep.index(SECTION) if k.isdigit()), default=0) + 1)
+
+
+def lib_pdb_ids(fep):
+    """{LIB_ID: PDB ID} from the comments of the [atoms] section."""
+    ids = {}
+    for row in fep.rows("atoms"):
+        if len(row.comment) >= 2:
+            ids[row.comment[1].upper()] = strip_id(row.values[1])
+    return ids
+
+
+def resolve(fep, bond):
+    """
+    ("types", [type indices]) for a type index or PRM_ID, or
+    ("pair", (atom1, atom2)) for a reactive bond or a pair of PDB IDs.
+    """
+    types = fep.index(SECTION)
+    if bond in types:
+        return "types", [bond]
+    if bond in REACTIVE_BONDS:
+        ids = lib_pdb_ids(fep)
+        missing = [a for a in REACTIVE_BONDS[bond] if a.upper() not in ids]
+        if missing:
+            raise ValueError(f"{bond}: {', '.join(missing)} not in [atoms]")
+        return "pair", tuple(ids[a.upper()] for a in REACTIVE_BONDS[bond])
+    matches = [k for k, row in types.items()
+               if row.comment and _prm_key(row.comment[0]) == _prm_key(bond)]
+    if matches:
+        return "types", matches
+    atoms = [strip_id(a) for a in bond.split('-')]
+    if len(atoms) == 2 and all(a.split('.')[0].isdigit() for a in atoms):
+        return "pair", tuple(atoms)
+    raise ValueError(f"{bond}: not a bond type index, PRM_ID in [{SECTION}] or PDB ID pair")
+
+
+def _type_users(changes, n_states):
+    """{type code: ids of the [change_bonds] rows using it}."""
+    users = {}
+    for row in changes.values():
+        for c in row.values[2:2 + n_states]:
+            users.setdefault(int(c), set()).add(id(row))
+    return users
+
+
+def claims(fep, bond, states):
+    """
+    What patch would overwrite for a bond: ("type", index) for every type
+    replaced in place and ("pair", atoms) for a PDB ID pair.
+    """
+    kind, target = resolve(fep, bond)
+    if kind == "types":
+        return {("type", index) for index in target}
+    n_states = fep.states or 2
+    changes = fep.index(CHANGES)
+    row = changes.get(target) or changes.get(target[::-1])
+    claimed = {("pair", frozenset(target))}
+    if row is not None:
+        users = _type_users(changes, n_states)
+        for s, code in enumerate(int(c) for c in row.values[2:2 + n_states]):
+            if code and (states is None or s + 1 in states) and len(users[code]) == 1:
+                claimed.add(("type", str(code)))
+    return claimed
+
+
+def clashes(fep, bonds):
+    """Messages for bonds that would overwrite each other's fit."""
+    owner, messages = {}, {}
+    for bond, states in bonds:
+        try:
+            claimed = claims(fep, bond, states)
+        except (KeyError, ValueError):
+            continue  # reported when it is patched
+        for claim in sorted(claimed, key=str):
+            if claim in owner and owner[claim] != bond:
+                what = f"bond type {claim[1]}" if claim[0] == "type" else \
+                    "-".join(sorted(claim[1]))
+                messages.setdefault((owner[claim], bond),
+                                    f"{owner[claim]} and {bond} both set {what}")
+            owner.setdefault(claim, bond)
+    return list(messages.values())
+
+
+def patch(fep, bond, states, values, morse=True):
+    """Write the fitted values for one bond; returns a description of the change."""
+    kind, target = resolve(fep, bond)
+    types = fep.index(SECTION)
+    if kind == "types":
+        for index in target:
+            row = types[index]
+            replace_row(fep, SECTION, row, type_row(index, values, " ".join(row.comment), morse))
+        return f"bond type {', '.join(target)} replaced"
+
+    changes = fep.index(CHANGES)
+    row = changes.get(target) or changes.get(target[::-1])
+    n_states = fep.states or 2
+    if row is None:
+        index = next_type_index(fep)
+        append_row(fep, SECTION, type_row(index, values, "-".join(target), morse))
+        codes = [int(index) if states is None or s + 1 in states else 0 for s in range(n_states)]
+        append_row(fep, CHANGES, change_row(target, codes, "-".join(target)))
+        return f"new bond type {index}, new [{CHANGES}] row"
+
+    codes = [int(c) for c in row.values[2:2 + n_states]]
+    users = _type_users(changes, n_states)
+    done = []
+    for s, code in enumerate(codes):
+        if code == 0 or (states is not None and s + 1 not in states):
+            continue
+        if len(users[code]) == 1:
+            old = types[str(code)]
+            replace_row(fep, SECTION, old, type_row(str(code), values,
+                                                    " ".join(old.comment), morse))
+            done.append(f"type {code} replaced")
+        else:
+            index = next_type_index(fep)
+            append_row(fep, SECTION, type_row(index, values, "-".join(target), morse))
+            row.set(2 + s, index)
+            types = fep.index(SECTION)
+            done.append(f"state {s + 1}: new type {index} (type {code} is shared)")
+    return "; ".join(done) or "no state uses the bond"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit bond types to QM scans and patch a "
+                                                 ".fep file")
+    parser.add_argument("fep")
+    parser.add_argument("--scan", action="append", required=True, metavar="BOND=FILE",
+                        help="scan of a bond (repeatable, see the module docstring)")
+    parser.add_argument("--units", choices=sorted(ENERGY_UNITS), default=DEFAULT_UNITS,
+                        help="energy unit of the scans (TS_scan.ipynb writes Hartree)")
+    parser.add_argument("--harmonic", nargs="+", default=[], metavar="BOND",
+                        help="write these bonds as harmonic (Fc, r0) instead of Morse")
+    parser.add_argument("-o", "--output", help="patched .fep file")
+    parser.add_argument("--in-place", action="store_true", help="overwrite the input file")
+    parser.add_argument("--dry-run", action="store_true", help="only print the fits")
+    args = parser.parse_args()
+    if not (args.output or args.in_place or args.dry_run):
+        parser.error("give -o, --in-place or --dry-run")
+
+    specs = [item.rsplit('=', 1) for item in args.scan]
+    bonds = [parse_bond(spec) for spec, _ in specs]
+    fep = FEPFile.read(args.fep)
+    messages = clashes(fep, bonds)
+    if messages:
+        print("Error: scans would overwrite each other:\n  " + "\n  ".join(messages))
+        sys.exit(1)
+    try:
+        scans = [read_scan(filename, args.units) for _, filename in specs]
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    fits = MorseParameterCalculator().fit_morse_scans(scans)
+
+    failed = False
+    print(f"{'Bond':24s} {'D (kcal/mol)':>12s} {'alpha':>7s} {'r0':>7s} {'Fc':>8s} "
+          f"{'RMSE':>7s} {'max err':>7s}  change")
+    for (bond, states), fit in zip(bonds, fits):
+        D = fit['De_eV'] * EV_TO_KCAL
+        alpha, r0 = fit['a_per_angstrom'], fit['re_angstrom']
+        fc = 2 * D * alpha**2
+        morse = bond not in args.harmonic
+        try:
+            change = patch(fep, bond, states, (D, alpha, r0) if morse else (fc, r0), morse)
+        except (KeyError, ValueError) as e:
+            change, failed = f"ERROR {e}", True
+        print(f"{bond:24s} {D:12.3f} {alpha:7.3f} {r0:7.3f} {fc:8.1f} "
+              f"{fit['rmse_eV'] * EV_TO_KCAL:7.3f} {fit['max_error_eV'] * EV_TO_KCAL:7.3f}  "
+              f"{change}")
+
+    if failed:
+        print("\nNot written: some bonds could not be placed")
+        sys.exit(1)
+    if args.dry_run:
+        return
+    output = args.fep if args.in_place else args.output
+    fep.write(output)
+    print(f"\nBond types written to {output}")
+
+
+if __name__ == "__main__":
+    main()
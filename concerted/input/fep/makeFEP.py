@@ -1,10 +1,31 @@
+import os
+import sys
+
 from Qpyl.qmakefep import make_fep
 
-fepstring = make_fep(qmap_file="FC_concerted.qmap", 
-                     ignore_errors=True,
-                     pdb_file="/home/hp/nayanika/github/LMRR_vaccum/WT_solvated.pdb", 
-                     forcefield="oplsaa",
-                     parm_files=["/home/hp/nayanika/github/LmrR_EVB/parameters/qoplsaa_all.prm"],
-                     lib_files=["/home/hp/nayanika/github/LmrR_EVB/parameters/qoplsaa.lib", "/home/hp/nayanika/github/LmrR_EVB/parameters/LMRR.lib"])
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "prep_scripts"))
+import artifact_cache
+from batch_make_fep import fep_cache_key
+
+qmap_file = "FC_concerted.qmap"
+pdb_file = "/home/hp/nayanika/github/LMRR_vaccum/WT_solvated.pdb"
+parm_files = ["/home/hp/nayanika/github/LmrR_EVB/parameters/qoplsaa_all.prm"]
+lib_files = ["/home/hp/nayanika/github/LmrR_EVB/parameters/qoplsaa.lib", "/home/hp/nayanika/github/LmrR_EVB/parameters/LMRR.lib"]
+output_file = "LMRR_WT4.fep"
+
+# Same key as batch_make_fep.py; ignore_errors=True keeps these lenient
+# FEP files apart from the strict ones
+key = fep_cache_key(pdb_file, qmap_file, parm_files, lib_files, ignore_errors=True)
+
+if artifact_cache.fetch(key, [output_file]):
+    print(f"{output_file} is up to date (cache key {key[:12]}), skipping make_fep")
+else:
+    fepstring = make_fep(qmap_file=qmap_file, 
+                         ignore_errors=True,
+                         pdb_file=pdb_file, 
+                         forcefield="oplsaa",
+                         parm_files=parm_files,
+                         lib_files=lib_files)
 
-open("LMRR_WT4.fep", "w").write(fepstring)
+    open(output_file, "w").write(fepstring)
+    artifact_cache.put(key, [output_file])
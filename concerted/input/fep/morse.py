@@ -1,3 +1,21 @@
+"""
+Morse potential parameters for the reactive bonds of the FEP files.
+
+Without arguments: parameters, plot and data file for the default C=N
+iminium values, and a table over a grid of De / re / k (--De, --re, --k).
+With --scan: batch fit of Morse curves to energy scans (two columns, r in
+Angstroms and E) of the bonds formed or broken in the qmaps; prints the
+best-fit parameters with their residuals and the Q Morse rows for the
+<FIX_D> <FIX_a> <FIX_r0> placeholders in [bond_types].
+
+Usage:
+    python morse.py [--De 5 5.5 6] [--re 1.22 1.25] [--k 1000 1200 1400]
+    python morse.py --scan "C=N iminium=cn_scan.txt" --scan N-C10=nc.txt
+                    --scan C12-C3=cc.txt [--units hartree|kcal/mol|kJ/mol|eV]
+"""
+
+import argparse
+
 import numpy as np
 
 # Try to import plotting libraries, but don't fail if they're missing
@@ -16,6 +34,20 @@ except ImportError:
     SCIPY_AVAILABLE = False
     print("Scipy not available - curve fitting disabled")
 
+ATOMIC_MASSES = {'H': 1.008, 'C': 12.011, 'N': 14.007, 'O': 15.999, 'S': 32.06}
+# Bonds formed or broken in the qmaps (FC_step1.qmap bond changes)
+REACTIVE_BONDS = {
+    "C=N iminium": ("IMI.C10", "IMI.N2"),
+    "N-C10": ("IMI.N1", "IMI.C10"),
+    "C12-C3": ("IMI.C12", "IND.C3"),
+}
+EV_TO_KCAL = 23.0605
+# Scan energy units -> eV
+ENERGY_UNITS = {"eV": 1.0, "kcal/mol": 1 / EV_TO_KCAL, "kJ/mol": 1 / 96.485,
+                "hartree": 27.211386}
+# charges/TS_scan.ipynb writes Hartree
+DEFAULT_UNITS = "hartree"
+
 class MorseParameterCalculator:
     """Calculate Morse potential parameters for C=N iminium ion"""
     
@@ -31,7 +63,7 @@ class MorseParameterCalculator:
         self.avogadro = 6.022e23  # mol⁻¹
         self.ev_to_joules = 1.602e-19  # J/eV
         
-    def calculate_morse_parameters(self, De=None, re=None, k=None):
+    def calculate_morse_parameters(self, De=None, re=None, k=None, masses=(12.011, 14.007)):
         """
         Calculate Morse potential parameters
         
@@ -39,6 +71,7 @@ class MorseParameterCalculator:
         De: Dissociation energy (eV)
         re: Equilibrium bond length (Angstroms) 
         k: Force constant (N/m)
+        masses: Atomic masses of the bonded atoms (amu), C and N by default
         
         Returns:
         dict with Morse parameters
@@ -48,19 +81,30 @@ class MorseParameterCalculator:
         re = re or self.equilibrium_bond_length
         k = k or self.force_constant
         
+        grid = self.calculate_morse_grid(De, re, k, masses)
+        return {name: value.item() for name, value in grid.items()}
+    
+    def calculate_morse_grid(self, De, re, k, masses=(12.011, 14.007)):
+        """
+        Morse parameters for whole grids of De (eV), re (Angstroms) and k (N/m)
+        
+        The inputs are broadcast against each other (pass De[:, None, None],
+        re[None, :, None], k[None, None, :] for a full 3D sweep); every entry
+        of the returned dict is an array of the broadcast shape, with the
+        same keys as calculate_morse_parameters.
+        """
+        De, re, k = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (De, re, k)))
+        
         # Convert units
         De_joules = De * self.ev_to_joules  # J
         re_meters = re * 1e-10  # m
         
-        # Calculate reduced mass for C=N (approximate atomic masses)
-        m_C = 12.011  # amu
-        m_N = 14.007  # amu
-        reduced_mass = (m_C * m_N) / (m_C + m_N)  # amu
+        m1, m2 = masses
+        reduced_mass = (m1 * m2) / (m1 + m2)  # amu
         reduced_mass_kg = reduced_mass * 1.66054e-27  # kg
         
-        # Calculate Morse parameter 'a'
-        # a = sqrt(k / (2 * De * mu))
-        a = np.sqrt(k / (2 * De_joules * reduced_mass_kg))  # m⁻¹
+        # Morse parameter 'a' from the curvature at re: k = 2 * De * a^2
+        a = np.sqrt(k / (2 * De_joules))  # m⁻¹
         a_angstrom = a * 1e-10  # Å⁻¹
         
         # Calculate vibrational frequency
@@ -69,28 +113,142 @@ class MorseParameterCalculator:
         
         # Anharmonicity constant
         xe = (self.planck_constant * omega_e) / (4 * De_joules)
+        levels = np.where(xe > 0, np.floor(1 / (2 * np.where(xe > 0, xe, 1)) - 0.5), 0)
         
-        results = {
+        return {
             'De_eV': De,
             'De_joules': De_joules,
-            'De_cm': De_joules / (self.planck_constant * self.speed_of_light * 100),
+            'De_cm': De_joules / (self.planck_constant * self.speed_of_light),
             're_angstrom': re,
             're_meters': re_meters,
             'a_per_angstrom': a_angstrom,
             'a_per_meter': a,
             'force_constant_N_per_m': k,
-            'reduced_mass_amu': reduced_mass,
+            'reduced_mass_amu': np.full(De.shape, reduced_mass),
             'omega_e_cm': omega_e_cm,
             'anharmonicity_xe': xe,
-            'vibrational_levels': int(1/(2*xe) - 0.5) if xe > 0 else 0
+            'vibrational_levels': levels.astype(int)
         }
-        
-        return results
     
     def morse_potential(self, r, De, re, a):
         """Morse potential function"""
         return De * (1 - np.exp(-a * (r - re)))**2
     
+    def morse_potential_grid(self, r, De, re, a):
+        """
+        Morse potentials of a grid of parameter sets on the points r
+        
+        De, re and a are broadcast against each other; the result has
+        shape (*parameter shape, len(r)).
+        """
+        De, re, a = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (De, re, a)))
+        r = np.asarray(r, dtype=float)
+        return self.morse_potential(r, De[..., None], re[..., None], a[..., None])
+    
+    def fit_morse_scans(self, scans, n_grid=40, iterations=100):
+        """
+        Fit V(r) = De * (1 - exp(-a (r - re)))^2 + E0 to many energy scans at once
+        
+        scans: list of (r, E) arrays (Angstroms, eV), of any lengths.
+        
+        All scans are fitted together: a grid search over (re, a), where De
+        and E0 are solved by linear least squares for every grid point of
+        every scan, followed by damped Gauss-Newton (Levenberg-Marquardt)
+        steps on all four parameters, with the normal equations of all
+        scans solved as one batch.
+        
+        Returns a list of dicts: De_eV, re_angstrom, a_per_angstrom, E0_eV,
+        force_constant_N_per_m, rmse_eV, max_error_eV and the residuals.
+        """
+        n = max(len(r) for r, _ in scans)
+        r = np.zeros((len(scans), n))
+        E = np.zeros((len(scans), n))
+        w = np.zeros((len(scans), n))
+        for i, (r_i, E_i) in enumerate(scans):
+            r[i, :len(r_i)], E[i, :len(E_i)], w[i, :len(r_i)] = r_i, E_i, 1.0
+        
+        # Grid search: re around the lowest point of each scan, a over 0.5-5 Å⁻¹;
+        # one re column at a time keeps the basis at (scans, a grid, points)
+        lowest = r[np.arange(len(scans)), np.argmin(np.where(w > 0, E, np.inf), axis=1)]
+        re_grid = lowest[:, None] + np.linspace(-0.2, 0.2, n_grid)[None, :]   # (S, G)
+        a_grid = np.linspace(0.5, 5.0, n_grid)                                 # (G,)
+        p = np.zeros((len(scans), 4))
+        best_sse = np.full(len(scans), np.inf)
+        for re_column in re_grid.T:
+            basis = (1 - np.exp(-a_grid[None, :, None] *
+                                (r[:, None, :] - re_column[:, None, None])))**2   # (S, G, n)
+            De, E0 = self._linear_fit(basis, E[:, None, :], w[:, None, :])
+            sse = np.sum(w[:, None, :] * (De[..., None] * basis + E0[..., None]
+                                          - E[:, None, :])**2, axis=-1)
+            i_a = np.argmin(sse, axis=1)
+            rows = np.arange(len(scans))
+            better = sse[rows, i_a] < best_sse
+            best_sse = np.where(better, sse[rows, i_a], best_sse)
+            p[better] = np.column_stack([De[rows, i_a], re_column, a_grid[i_a],
+                                         E0[rows, i_a]])[better]
+        
+        p = self._levenberg_marquardt(p, r, E, w, iterations)
+        
+        residuals = (self._morse_model(p, r) - E) * w
+        rmse = np.sqrt(np.sum(residuals**2, axis=1) / w.sum(axis=1))
+        results = []
+        for i, (De_i, re_i, a_i, E0_i) in enumerate(p):
+            results.append({
+                'De_eV': De_i,
+                're_angstrom': re_i,
+                'a_per_angstrom': a_i,
+                'E0_eV': E0_i,
+                'force_constant_N_per_m': 2 * De_i * self.ev_to_joules * (a_i * 1e10)**2,
+                'rmse_eV': rmse[i],
+                'max_error_eV': np.abs(residuals[i]).max(),
+                'residuals_eV': residuals[i, :len(scans[i][0])]
+            })
+        return results
+    
+    @staticmethod
+    def _linear_fit(basis, E, w):
+        """Weighted least-squares De, E0 of E = De * basis + E0 (broadcast)"""
+        sw = w.sum(-1)
+        sb = (w * basis).sum(-1)
+        sbb = (w * basis**2).sum(-1)
+        se = (w * E).sum(-1)
+        sbe = (w * basis * E).sum(-1)
+        det = sw * sbb - sb**2
+        det = np.where(np.abs(det) > 1e-12, det, np.inf)
+        return (sw * sbe - sb * se) / det, (sbb * se - sb * sbe) / det
+    
+    @staticmethod
+    def _morse_model(p, r):
+        De, re, a, E0 = (p[:, i, None] for i in range(4))
+        return De * (1 - np.exp(-a * (r - re)))**2 + E0
+    
+    def _levenberg_marquardt(self, p, r, E, w, iterations):
+        """Batched Levenberg-Marquardt refinement of (De, re, a, E0) per scan"""
+        damping = np.full(len(p), 1e-3)
+        cost = np.sum(w * (self._morse_model(p, r) - E)**2, axis=1)
+        for _ in range(iterations):
+            De, re, a = p[:, 0, None], p[:, 1, None], p[:, 2, None]
+            e = np.exp(-a * (r - re))
+            J = np.stack([(1 - e)**2,
+                          -2 * De * (1 - e) * a * e,
+                          2 * De * (1 - e) * (r - re) * e,
+                          np.ones_like(r)], axis=-1) * w[..., None]      # (S, n, 4)
+            f = (self._morse_model(p, r) - E) * w
+            JTJ = np.einsum('sni,snj->sij', J, J)
+            JTf = np.einsum('sni,sn->si', J, f)
+            diagonal = np.einsum('sii->si', JTJ)
+            A = JTJ + damping[:, None, None] * np.eye(4) * (diagonal[:, None, :] + 1e-12)
+            step = np.linalg.solve(A, -JTf[..., None])[..., 0]
+            trial = p + step
+            trial_cost = np.sum(w * (self._morse_model(trial, r) - E)**2, axis=1)
+            better = trial_cost < cost
+            p = np.where(better[:, None], trial, p)
+            cost = np.where(better, trial_cost, cost)
+            damping = np.clip(np.where(better, damping / 3, damping * 4), 1e-9, 1e9)
+            if np.all(np.abs(step) < 1e-10):
+                break
+        return p
+    
     def create_ascii_plot(self, r, V, params, width=70, height=20):
         """Create ASCII art plot"""
         print("\n" + "="*75)
@@ -216,13 +374,97 @@ class MorseParameterCalculator:
         print(f"  Estimated Vibrational Levels: {params['vibrational_levels']}")
         print("=" * 65)
 
+def read_scan(filename, units=DEFAULT_UNITS):
+    """(r in Angstroms, E in eV) of a two-column scan file ('#' comments)"""
+    data = np.loadtxt(filename, comments='#', ndmin=2)
+    if data.shape[1] < 2 or len(data) < 5:
+        raise ValueError(f"{filename}: need at least 5 rows of 'r E'")
+    order = np.argsort(data[:, 0])
+    return data[order, 0], data[order, 1] * ENERGY_UNITS[units]
+
+
+def bond_masses(atoms):
+    """Atomic masses of a bond from the element letter of its atom names"""
+    return tuple(ATOMIC_MASSES[name.split('.')[-1][0]] for name in atoms)
+
+
+def fit_reactive_bonds(calc, scan_files, units=DEFAULT_UNITS):
+    """
+    Best-fit Morse parameters of every {bond: scan file} in one batch;
+    returns {bond: fit result}, with omega_e and xe from the bond's masses
+    """
+    scans = [read_scan(scan_files[bond], units) for bond in scan_files]
+    fits = calc.fit_morse_scans(scans)
+    results = {}
+    for bond, fit in zip(scan_files, fits):
+        atoms = REACTIVE_BONDS.get(bond, bond.split('-'))
+        params = calc.calculate_morse_parameters(fit['De_eV'], fit['re_angstrom'],
+                                                 fit['force_constant_N_per_m'],
+                                                 bond_masses(atoms))
+        results[bond] = dict(fit, omega_e_cm=params['omega_e_cm'],
+                             anharmonicity_xe=params['anharmonicity_xe'], atoms=atoms)
+    return results
+
+
+def print_fits(results):
+    """Fit table, plus the Q Morse rows (D kcal/mol, alpha, r0) for [bond_types]"""
+    print("\n" + "=" * 100)
+    print("BEST-FIT MORSE PARAMETERS")
+    print("=" * 100)
+    print(f"{'Bond':14s} {'Atoms':20s} {'De (eV)':>8s} {'re (Å)':>7s} {'a (Å⁻¹)':>8s} "
+          f"{'k (N/m)':>8s} {'ωe (cm⁻¹)':>10s} {'RMSE':>8s} {'max err':>8s}  kcal/mol")
+    for bond, fit in results.items():
+        print(f"{bond:14s} {'-'.join(fit['atoms']):20s} {fit['De_eV']:8.3f} "
+              f"{fit['re_angstrom']:7.3f} {fit['a_per_angstrom']:8.3f} "
+              f"{fit['force_constant_N_per_m']:8.0f} {fit['omega_e_cm']:10.1f} "
+              f"{fit['rmse_eV'] * EV_TO_KCAL:8.3f} {fit['max_error_eV'] * EV_TO_KCAL:8.3f}")
+    print("\nQ [bond_types] Morse rows (D alpha r0):")
+    for bond, fit in results.items():
+        print(f"  {fit['De_eV'] * EV_TO_KCAL:10.3f} {fit['a_per_angstrom']:8.3f} "
+              f"{fit['re_angstrom']:8.3f}   # {'-'.join(fit['atoms'])}")
+
+
+def print_sweep(calc, De, re, k):
+    """Table of the Morse parameters over the full De x re x k grid"""
+    grid = calc.calculate_morse_grid(np.asarray(De)[:, None, None], np.asarray(re)[None, :, None],
+                                     np.asarray(k)[None, None, :])
+    print("-" * 72)
+    print(f"{'De (eV)':>8s} {'re (Å)':>7s} {'k (N/m)':>8s} {'a (Å⁻¹)':>8s} {'ωe (cm⁻¹)':>10s} "
+          f"{'xe':>8s} {'levels':>7s}")
+    print("-" * 72)
+    for index in np.ndindex(grid['De_eV'].shape):
+        print(f"{grid['De_eV'][index]:8.2f} {grid['re_angstrom'][index]:7.3f} "
+              f"{grid['force_constant_N_per_m'][index]:8.0f} {grid['a_per_angstrom'][index]:8.3f} "
+              f"{grid['omega_e_cm'][index]:10.1f} {grid['anharmonicity_xe'][index]:8.4f} "
+              f"{grid['vibrational_levels'][index]:7d}")
+    print("-" * 72)
+
+
 def main():
     """Main execution function"""
-    print("MORSE PARAMETER CALCULATOR FOR C=N IMINIUM ION")
-    print("=" * 50)
+    parser = argparse.ArgumentParser(description="Morse parameters for the reactive bonds")
+    parser.add_argument("--scan", action="append", default=[], metavar="BOND=FILE",
+                        help=f"energy scan (r E) of a bond to fit; BOND is one of "
+                             f"{', '.join(REACTIVE_BONDS)} or atom names like IMI.N2-IMI.C10 "
+                             f"(repeatable)")
+    parser.add_argument("--units", choices=sorted(ENERGY_UNITS), default=DEFAULT_UNITS,
+                        help="energy unit of the scan files")
+    parser.add_argument("--De", type=float, nargs="+", default=[5.0, 5.5, 6.0],
+                        help="sweep: dissociation energies (eV)")
+    parser.add_argument("--re", type=float, nargs="+", default=[1.22, 1.25, 1.28],
+                        help="sweep: equilibrium bond lengths (Å)")
+    parser.add_argument("--k", type=float, nargs="+", default=[1000, 1200, 1400],
+                        help="sweep: force constants (N/m)")
+    args = parser.parse_args()
     
-    # Create calculator
     calc = MorseParameterCalculator()
+    if args.scan:
+        scan_files = dict(item.rsplit('=', 1) for item in args.scan)
+        print_fits(fit_reactive_bonds(calc, scan_files, args.units))
+        return
+    
+    print("MORSE PARAMETER CALCULATOR FOR C=N IMINIUM ION")
+    print("=" * 50)
     
     # Calculate with default parameters
     print("\n1. USING DEFAULT PARAMETERS:")
@@ -237,32 +479,12 @@ def main():
     print("\n3. SAVING DATA:")
     calc.save_data_file(r, V, params)
     
-    # Example with custom parameters
-    print("\n4. CUSTOM PARAMETERS EXAMPLE:")
-    print("-" * 40)
-    custom_params = calc.calculate_morse_parameters(
-        De=6.0,  # eV - stronger bond
-        re=1.22,  # Å - slightly shorter
-        k=1400   # N/m - stiffer
-    )
-    calc.print_results(custom_params)
-    
-    # Show some key values in a table format
-    print("\n5. COMPARISON TABLE:")
-    print("-" * 60)
-    print("Parameter        | Default | Custom  | Units")
-    print("-" * 60)
-    print(f"De               | {params['De_eV']:7.2f} | {custom_params['De_eV']:7.2f} | eV")
-    print(f"re               | {params['re_angstrom']:7.3f} | {custom_params['re_angstrom']:7.3f} | Å")
-    print(f"a                | {params['a_per_angstrom']:7.3f} | {custom_params['a_per_angstrom']:7.3f} | Å⁻¹")
-    print(f"k                | {params['force_constant_N_per_m']:7.0f} | {custom_params['force_constant_N_per_m']:7.0f} | N/m")
-    print(f"ωe               | {params['omega_e_cm']:7.1f} | {custom_params['omega_e_cm']:7.1f} | cm⁻¹")
-    print(f"xe               | {params['anharmonicity_xe']:7.4f} | {custom_params['anharmonicity_xe']:7.4f} | -")
-    print(f"Vib. levels      | {params['vibrational_levels']:7.0f} | {custom_params['vibrational_levels']:7.0f} | -")
-    print("-" * 60)
+    # Sweep over a grid of parameters instead of single hand-picked sets
+    print("\n4. PARAMETER SWEEP:")
+    print_sweep(calc, args.De, args.re, args.k)
     
     if not MATPLOTLIB_AVAILABLE:
-        print("\n6. TO GET BETTER PLOTS:")
+        print("\n5. TO GET BETTER PLOTS:")
         print("Install matplotlib with: pip install matplotlib")
     
     print("\nCalculation completed successfully!")
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Merged, indexed view of the Q parameter (.prm) files.
+
+merge_parameters.py reads qoplsaa.prm and the ligand .prm files with Qpyl
+and writes qoplsaa_all.prm on every run. The store does the same merge
+without Qpyl and keeps the result as an index of atom-type tuples:
+
+    store = ParameterStore.load("concerted")
+    store.atom_type("C135")                 -> (Avdw1, Avdw2, Bvdw1, Avdw3, Bvdw2&3, mass)
+    store.bond("C136", "C135")              -> (fc, r0)
+    store.angle("C135", "C136", "C137")     -> (fc, theta0, fc_UB, r_UB)
+    store.torsion("H140", "C135", "C136", "H140")   -> ((fc, mult, phase, paths), ...)
+    store.improper("C502", "C501", "C145", "C500")  -> (fc, imp0)
+    store.get("torsions", "H140", "C135", "C136", "H140")  -> the same, by kind
+
+Keys are canonical, so lookups are single dict hits in either atom order:
+bonds are sorted, angles and torsions are read in whichever direction
+sorts first, and impropers keep their central (second) atom with the other
+three sorted, as Qpyl does. Torsions fall back to the "? j k ?" wildcard
+entry, as in Q. A later file overrides an earlier one (a later file
+replaces all terms of a torsion); every override or repeated key with
+different values is recorded in store.conflicts.
+
+The merged index is pickled into the artifact cache under the SHA-256 of
+the input files, so loading a set is one hash of the .prm files plus one
+unpickle, and editing any of the files rebuilds it.
+
+The committed qoplsaa_all.prm is written by merge_parameters.py and can
+drift from its sources (renamed atom types, rounded values). --compare
+lists every entry the store and another .prm file disagree on, and exits
+non-zero if there is any.
+
+Usage:
+    python parameter_store.py [--set concerted|stepwise | file.prm ...] [--conflicts]
+                              [--lookup bond C135 C136] [--write merged.prm]
+                              [--compare qoplsaa_all.prm]
+"""
+
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "prep_scripts"))
+import artifact_cache
+
+# Same order as merge_parameters.py; the stepwise set adds the enal (UNL)
+PRM_FILES = ["qoplsaa.prm", "PAF.prm", "IND.prm", "IMI.prm", "HO2.prm", "PRD.prm"]
+PARAMETER_SETS = {
+    "concerted": [os.path.join(HERE, f) for f in PRM_FILES],
+    "stepwise": [os.path.join(HERE, "..", "..", "stepwise", "parameters", f)
+                 for f in PRM_FILES + ["HEX_ENAL.prm"]],
+}
+
+KINDS = ("atom_types", "bonds", "angles", "torsions", "impropers")
+# Atom types per row
+N_TYPES = {"atom_types": 1, "bonds": 2, "angles": 3, "torsions": 4, "impropers": 4}
+# Numbers per row: atom types stop before the SYBYL column, angles are
+# padded with a zero Urey-Bradley term, torsions with a single path
+N_VALUES = {"atom_types": 6, "bonds": 2, "angles": 4, "torsions": 4, "impropers": 2}
+PADDING = {"angles": (0.0, 0.0), "torsions": (1.0,)}
+WILDCARD = "?"
+STORE_VERSION = 1
+
+
+def parameter_files(spec):
+    """The .prm files of a set name, a single .prm path or a list of paths."""
+    if isinstance(spec, str):
+        spec = [spec]
+    if len(spec) == 1 and spec[0] in PARAMETER_SETS:
+        return PARAMETER_SETS[spec[0]]
+    unknown = [p for p in spec if not os.path.isfile(p)]
+    if unknown:
+        raise ValueError(f"not a parameter set ({', '.join(sorted(PARAMETER_SETS))}) or "
+                         f".prm file: {', '.join(unknown)}")
+    return list(spec)
+
+
+def canonical(kind, types):
+    """Order-independent key of an atom-type tuple."""
+    types = tuple(types)
+    if kind == "bonds":
+        return tuple(sorted(types))
+    if kind in ("angles", "torsions"):
+        return min(types, types[::-1])
+    if kind == "impropers":
+        others = sorted((types[0], types[2], types[3]))
+        return (others[0], types[1], others[1], others[2])
+    return types
+
+
+def _strip_comment(line):
+    for marker in ('!', '#'):
+        line = line.split(marker)[0]
+    return line.strip()
+
+
+def _comment(line):
+    for marker in ('#', '!'):
+        if marker in line:
+            return line.split(marker, 1)[1].strip()
+    return ""
+
+
+def read_prm(filename):
+    """
+    Rows of one .prm file: {"options": {name: value}, kind: [(types, values,
+    comment), ...]}, values as float tuples.
+    """
+    rows = {kind: [] for kind in KINDS}
+    rows["options"] = {}
+    section = None
+    with open(filename, 'r') as f:
+        for raw in f:
+            if raw.lstrip().startswith('*'):
+                continue
+            line = _strip_comment(raw)
+            if not line:
+                continue
+            if line.startswith('['):
+                section = line[1:line.index(']')].strip().lower()
+                continue
+
+            fields = line.split()
+            if section == "options":
+                rows["options"][fields[0]] = " ".join(fields[1:])
+            elif section in N_TYPES:
+                n = N_TYPES[section]
+                values = tuple(float(v) for v in fields[n:n + N_VALUES[section]])
+                missing = N_VALUES[section] - len(values)
+                if 0 < missing <= len(PADDING.get(section, ())):
+                    values += PADDING[section][-missing:]
+                if len(values) != N_VALUES[section]:
+                    raise ValueError(f"{filename}: short [{section}] row: {raw.strip()}")
+                rows[section].append((tuple(fields[:n]), values, _comment(raw)))
+    return rows
+
+
+class ParameterStore:
+    def __init__(self, sources):
+        # (file name, SHA-256) in merge order
+        self.sources = sources
+        self.options = {}
+        # kind -> {canonical key: (values, source, comment)}
+        self.entries = {kind: {} for kind in KINDS}
+        # (kind, key, earlier source, earlier values, later source, later values)
+        self.conflicts = []
+
+    @classmethod
+    def build(cls, prm_files):
+        """Merge the files in order (no cache)."""
+        store = cls([(os.path.basename(p), artifact_cache.file_hash(p)) for p in prm_files])
+        for prm_file in prm_files:
+            store._merge(os.path.basename(prm_file), read_prm(prm_file))
+        return store
+
+    @classmethod
+    def load(cls, prm_files="concerted", use_cache=True):
+        """Store of a named set or list of files, from the artifact cache if unchanged."""
+        prm_files = parameter_files(prm_files)
+        if not use_cache:
+            return cls.build(prm_files)
+
+        key = artifact_cache.files_key("parameter_store", prm_files, extra=[STORE_VERSION])
+        cached = artifact_cache.cached_files(key)
+        if cached:
+            store = cls([])
+            # Plain containers are pickled, not the class, so the cache does
+            # not depend on how this module was imported
+            with open(cached[0], 'rb') as f:
+                store.__dict__.update(pickle.load(f))
+            return store
+
+        store = cls.build(prm_files)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "parameter_store.pkl")
+            with open(path, 'wb') as f:
+                pickle.dump(vars(store), f, protocol=pickle.HIGHEST_PROTOCOL)
+            artifact_cache.put(key, [path])
+        return store
+
+    def _merge(self, source, rows):
+        for name, value in rows["options"].items():
+            if name in self.options and self.options[name][0] != value:
+                self.conflicts.append(("options", (name,), self.options[name][1],
+                                       self.options[name][0], source, value))
+            self.options[name] = (value, source)
+
+        for kind in ("atom_types", "bonds", "angles", "impropers"):
+            index = self.entries[kind]
+            for types, values, comment in rows[kind]:
+                key = canonical(kind, types)
+                if key in index and index[key][0] != values:
+                    self.conflicts.append((kind, key, index[key][1], index[key][0],
+                                           source, values))
+                index[key] = (values, source, comment)
+
+        # Torsion terms of one file accumulate (one per multiplicity); a
+        # torsion from a later file replaces the earlier one as a whole
+        terms = {}
+        for types, values, comment in rows["torsions"]:
+            key = canonical("torsions", types)
+            by_mult = terms.setdefault(key, ({}, comment))[0]
+            term = (values[0], abs(values[1]), values[2], values[3])
+            if term[1] in by_mult and by_mult[term[1]] != term:
+                self.conflicts.append(("torsions", key, source, by_mult[term[1]], source, term))
+            by_mult[term[1]] = term
+        index = self.entries["torsions"]
+        for key, (by_mult, comment) in terms.items():
+            values = tuple(by_mult[m] for m in sorted(by_mult))
+            if key in index and index[key][0] != values:
+                self.conflicts.append(("torsions", key, index[key][1], index[key][0],
+                                       source, values))
+            index[key] = (values, source, comment)
+
+    def _entry(self, kind, types):
+        entry = self.entries[kind].get(canonical(kind, types))
+        if entry is None and kind == "torsions":
+            entry = self.entries[kind].get(canonical(kind, (WILDCARD, types[1], types[2],
+                                                            WILDCARD)))
+        return entry
+
+    def get(self, kind, *types):
+        """Values for the atom types, or None; torsions try the wildcard form too."""
+        entry = self._entry(kind, types)
+        return entry[0] if entry else None
+
+    def source(self, kind, *types):
+        """File the values for the atom types come from, or None."""
+        entry = self._entry(kind, types)
+        return entry[1] if entry else None
+
+    def atom_type(self, name):
+        return self.get("atom_types", name)
+
+    def bond(self, a, b):
+        return self.get("bonds", a, b)
+
+    def angle(self, a, b, c):
+        return self.get("angles", a, b, c)
+
+    def torsion(self, a, b, c, d):
+        return self.get("torsions", a, b, c, d)
+
+    def improper(self, a, b, c, d):
+        return self.get("impropers", a, b, c, d)
+
+    def counts(self):
+        return {kind: len(self.entries[kind]) for kind in KINDS}
+
+    def differences(self, other):
+        """
+        [(kind, key, values here, values in other)] of every entry the two
+        stores define differently; None stands for a missing entry.
+        """
+        diffs = []
+        for kind in KINDS:
+            mine, theirs = self.entries[kind], other.entries[kind]
+            for key in sorted(set(mine) | set(theirs)):
+                a, b = mine.get(key), theirs.get(key)
+                if a is None or b is None or a[0] != b[0]:
+                    diffs.append((kind, key, a and a[0], b and b[0]))
+        return diffs
+
+    def text(self):
+        """The merged parameters as a Q .prm file."""
+        def row(types, values, comment, type_width=13, value_width=11):
+            out = "".join(t.ljust(type_width) for t in types)
+            out += "".join(str(v).rjust(value_width) for v in values)
+            return (out + (f" # {comment}" if comment else "")).rstrip() + "\n"
+
+        lines = ["# Merged by parameter_store.py from: "
+                 + ", ".join(name for name, _ in self.sources) + "\n", "[options]\n"]
+        lines += [f"{name:30s} {value}\n" for name, (value, _) in self.options.items()]
+        for kind in KINDS:
+            lines.append(f"\n[{kind}]\n")
+            for key in sorted(self.entries[kind]):
+                values, _, comment = self.entries[kind][key]
+                if kind == "atom_types":
+                    lines.append(row(key, values, comment, type_width=12))
+                elif kind == "angles":
+                    lines.append(row(key, values if any(values[2:]) else values[:2], comment))
+                elif kind == "torsions":
+                    lines.extend(row(key, term, comment) for term in values)
+                else:
+                    lines.append(row(key, values, comment))
+        return "".join(lines)
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.text())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cached merged index of Q parameter files")
+    parser.add_argument("prm", nargs="*", help="parameter files in merge order "
+                                               "(default: the --set files)")
+    parser.add_argument("--set", choices=sorted(PARAMETER_SETS), default="concerted")
+    parser.add_argument("--conflicts", action="store_true",
+                        help="list every parameter defined differently by two sources")
+    parser.add_argument("--lookup", nargs="+", action="append", default=[],
+                        metavar=("KIND", "TYPE"),
+                        help="e.g. --lookup bonds C135 C136 (repeatable)")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--write", help="write the merged parameters to this .prm file")
+    parser.add_argument("--compare", metavar="PRM",
+                        help="report the entries that differ from this .prm file "
+                             "(e.g. qoplsaa_all.prm)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = ParameterStore.load(args.prm or args.set, use_cache=not args.no_cache)
+    elapsed = (time.perf_counter() - start) * 1000
+    counts = ", ".join(f"{kind} {n}" for kind, n in store.counts().items())
+    print(f"{' + '.join(name for name, _ in store.sources)}: {counts} "
+          f"({len(store.conflicts)} conflicts, loaded in {elapsed:.1f} ms)")
+
+    if args.conflicts:
+        for kind, key, old_source, old, new_source, new in store.conflicts:
+            print(f"  {kind:10s} {' '.join(key):32s} {old_source}: {old} -> {new_source}: {new}")
+    for kind, *types in args.lookup:
+        kind = kind if kind in KINDS else kind + "s"
+        if kind not in KINDS:
+            parser.error(f"unknown kind {kind}, use one of {', '.join(KINDS)}")
+        print(f"  {kind} {' '.join(types)}: {store.get(kind, *types)} "
+              f"({store.source(kind, *types) or 'not found'})")
+    if args.write:
+        store.write(args.write)
+        print(f"Merged parameters written to {args.write}")
+    if args.compare:
+        diffs = store.differences(ParameterStore.load([args.compare],
+                                                      use_cache=not args.no_cache))
+        name = os.path.basename(args.compare)
+        for kind, key, mine, theirs in diffs:
+            print(f"  {kind:10s} {' '.join(key):32s} store: {mine}  {name}: {theirs}")
+        counts = {}
+        for kind, *_ in diffs:
+            counts[kind] = counts.get(kind, 0) + 1
+        print(f"{len(diffs)} entries differ from {name}"
+              + (f" ({', '.join(f'{kind} {n}' for kind, n in counts.items())})" if diffs else ""))
+        if diffs:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
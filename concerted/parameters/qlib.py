@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Reader for Q fragment library (.lib) files.
+
+Parses every {RESIDUE} entry of one or more .lib files into plain
+dictionaries so scripts can look up atom names, atom types, charges and
+bonds without going through qprep5 or Qpyl:
+
+    residues = read_lib_files(["qoplsaa.lib", "LMRR.lib"])
+    residues["IMI"]["atoms"]        -> [(name, type, charge), ...]
+    residues["IMI"]["bonds"]        -> [(name1, name2), ...]
+    residues["ALA"]["connections"]  -> {"head": "N", "tail": "C"}
+
+Residue names are stored upper case (LMRR.lib has both {IMI} and {prd}).
+Entries in later files override earlier ones, as in qprep5.
+"""
+
+import sys
+
+
+def _new_residue():
+    return {"atoms": [], "bonds": [], "impropers": [], "charge_groups": [],
+            "connections": {}, "info": {}}
+
+
+def _strip_comment(line):
+    for marker in ('!', '#'):
+        line = line.split(marker)[0]
+    return line.strip()
+
+
+def read_lib(filename, residues=None):
+    """Parse one .lib file, adding its entries to residues (a dict)."""
+    if residues is None:
+        residues = {}
+
+    current = None
+    section = None
+    with open(filename, 'r') as f:
+        for raw in f:
+            if raw.lstrip().startswith('*'):
+                continue
+            line = _strip_comment(raw)
+            if not line:
+                continue
+
+            if line.startswith('{'):
+                name = line[1:line.index('}')].strip().upper()
+                current = residues[name] = _new_residue()
+                section = None
+                continue
+            if line.startswith('['):
+                section = line[1:line.index(']')].strip().lower()
+                continue
+            if current is None:
+                continue
+
+            fields = line.split()
+            if section == "atoms" and len(fields) >= 4:
+                current["atoms"].append((fields[1], fields[2], float(fields[3])))
+            elif section == "bonds" and len(fields) >= 2:
+                current["bonds"].append((fields[0], fields[1]))
+            elif section == "impropers" and len(fields) >= 4:
+                current["impropers"].append(tuple(fields[:4]))
+            elif section == "charge_groups":
+                current["charge_groups"].append(fields)
+            elif section == "connections" and len(fields) >= 2:
+                current["connections"][fields[0].lower()] = fields[1]
+            elif section == "info" and len(fields) >= 2:
+                current["info"][fields[0]] = fields[1]
+
+    return residues
+
+
+def read_lib_files(filenames):
+    """Parse several .lib files into one residue dictionary."""
+    residues = {}
+    for filename in filenames:
+        read_lib(filename, residues)
+    return residues
+
+
+def atom_charges(residues):
+    """Flatten to a {(RESNAME, atom): charge} index."""
+    return {(resname, name): charge
+            for resname, entry in residues.items()
+            for name, _, charge in entry["atoms"]}
+
+
+def atom_types(residues):
+    """Flatten to a {(RESNAME, atom): atom type} index."""
+    return {(resname, name): atype
+            for resname, entry in residues.items()
+            for name, atype, _ in entry["atoms"]}
+
+
+def residue_charge(entry):
+    """Net charge of a library residue."""
+    return sum(charge for _, _, charge in entry["atoms"])
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: qlib.py file.lib [file2.lib ...]")
+        sys.exit(1)
+
+    residues = read_lib_files(sys.argv[1:])
+    print(f"{'Residue':8s} {'Atoms':>6s} {'Bonds':>6s} {'Charge':>9s}")
+    for name, entry in sorted(residues.items()):
+        print(f"{name:8s} {len(entry['atoms']):6d} {len(entry['bonds']):6d} "
+              f"{residue_charge(entry):9.4f}")
+
+
+if __name__ == "__main__":
+    main()
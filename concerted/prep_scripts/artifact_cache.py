@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for pipeline artefacts (mutant PDBs, solvated
+.pdb/.top pairs, FEP files and stamped run directories).
+
+Every artefact is stored under a key that is the SHA-256 of its inputs:
+
+    mutant PDB   -> (WT PDB hash, mutation spec)
+    solvated     -> (mutant PDB hash, qprep5 solvation commands, lib/prm hashes)
+    FEP file     -> (topology hash, qmap hash)
+
+so re-running prep.sh / minim.sh / fep.sh after adding new mutants only does
+work for the mutants whose inputs actually changed.
+
+Usage from the shell scripts:
+
+    key=$(python3 artifact_cache.py key solvated --pdb X.pdb --inp X.inp --lib a.lib --prm b.prm)
+    python3 artifact_cache.py fetch "$key" X_solvated.top X_solvated.pdb || {
+        qprep5 X.inp
+        python3 artifact_cache.py put "$key" X_solvated.top X_solvated.pdb
+    }
+
+Run directories that are generated in place (genrelax, genfeps) are not
+copied into the store; instead a `.cache_key` stamp is written into the
+directory and compared on the next run (`check-stamp` / `write-stamp`; use
+`--name` to keep one stamp per pipeline step in a shared directory).
+
+`key` exits 1 with a message on stderr (and prints no key) when an input
+file is missing, and the other commands refuse an empty key, so a script
+that does not check "$key" still cannot fetch, store or stamp under it.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# Override with LMRR_CACHE_DIR to share the cache between checkouts
+CACHE_DIR = Path(os.environ.get(
+    "LMRR_CACHE_DIR",
+    Path(__file__).resolve().parent.parent / ".artifact_cache"))
+
+STAMP_FILE = ".cache_key"
+
+# qprep5 commands that only name input/output files; they are replaced by
+# content hashes when the solvation input is keyed
+QPREP_FILE_COMMANDS = ("readlib", "readprm", "readpdb", "readtop", "maketop",
+                       "writetop", "writepdb", "quit")
+
+_hash_memo = {}
+
+
+def file_hash(path):
+    """SHA-256 of a file's contents, memoized on (path, size, mtime)."""
+    path = Path(path)
+    st = path.stat()
+    memo_key = (str(path.resolve()), st.st_size, st.st_mtime_ns)
+    if memo_key in _hash_memo:
+        return _hash_memo[memo_key]
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _hash_memo[memo_key] = digest
+    return digest
+
+
+def make_key(kind, *parts):
+    """Combine an artefact kind and its input descriptors into one key."""
+    payload = json.dumps([kind] + [str(p) for p in parts], separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def qprep_commands(inp_file):
+    """
+    Return the qprep5 commands of an input file that affect the result,
+    i.e. everything except the lines that just name files.
+    """
+    commands = []
+    with open(inp_file, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].split('!')[0].strip()
+            if not line or line.split()[0].lower() in QPREP_FILE_COMMANDS:
+                continue
+            commands.append(' '.join(line.split()))
+    return commands
+
+
+def mutant_key(wt_pdb, mutation_spec, extra_files=()):
+    """Key for a mutant PDB: (WT hash, mutation spec such as '96:ALA')."""
+    return make_key("mutant_pdb", file_hash(wt_pdb), mutation_spec,
+                    *[file_hash(p) for p in extra_files])
+
+
+def solvated_key(mutant_pdb, qprep_inp, lib_files=(), prm_files=()):
+    """Key for a solvated .pdb/.top pair."""
+    return make_key("solvated",
+                    file_hash(mutant_pdb),
+                    "|".join(qprep_commands(qprep_inp)),
+                    *[file_hash(p) for p in list(lib_files) + list(prm_files)])
+
+
+def fep_key(top_file, qmap_file, extra_files=()):
+    """Key for an FEP file: (topology hash, qmap hash[, extra inputs])."""
+    return make_key("fep", file_hash(top_file), file_hash(qmap_file),
+                    *[file_hash(p) for p in extra_files])
+
+
+def files_key(kind, files, extra=()):
+    """Generic key over a list of input files plus free-form settings."""
+    return make_key(kind, *[file_hash(p) for p in files], *extra)
+
+
+def _entry_dir(key):
+    return CACHE_DIR / key[:2] / key
+
+
+def lookup(key):
+    """Return the manifest of a cached entry, or None on a miss."""
+    manifest = _entry_dir(key) / "manifest.json"
+    if not manifest.is_file():
+        return None
+    with open(manifest, 'r') as f:
+        return json.load(f)
+
+
+def put(key, files):
+    """
+    Store files under key. The entry is assembled in a temporary directory
+    and renamed into place, so a crashed or concurrent writer never leaves a
+    half-written entry behind.
+    """
+    entry = _entry_dir(key)
+    if entry.is_dir():
+        return entry
+    entry.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp = Path(tempfile.mkdtemp(prefix=f".{key[:8]}_", dir=entry.parent))
+    names = []
+    for i, src in enumerate(files):
+        src = Path(src)
+        # Position is part of the stored name so fetch can map files back
+        name = f"{i:02d}_{src.name}"
+        shutil.copy2(src, tmp / name)
+        names.append(name)
+    with open(tmp / "manifest.json", 'w') as f:
+        json.dump({"key": key, "files": names}, f, indent=1)
+
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # Another process stored the same key first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return entry
+
+
+def cached_files(key):
+    """Paths of the files stored under key (read in place), or None on a miss."""
+    manifest = lookup(key)
+    if manifest is None:
+        return None
+    return [_entry_dir(key) / name for name in manifest["files"]]
+
+
+def fetch(key, destinations):
+    """
+    Copy a cached entry to the given destination paths (same order as put).
+    Returns True on a hit, False on a miss.
+    """
+    manifest = lookup(key)
+    if manifest is None or len(manifest["files"]) != len(destinations):
+        return False
+
+    entry = _entry_dir(key)
+    for name, dest in zip(manifest["files"], destinations):
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(entry / name, dest)
+    return True
+
+
+def check_stamp(directory, key, name=STAMP_FILE):
+    """True if directory was generated from inputs with this key."""
+    stamp = Path(directory) / name
+    return stamp.is_file() and stamp.read_text().strip() == key
+
+
+def write_stamp(directory, key, name=STAMP_FILE):
+    """Record the input key a generated directory was built from."""
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    (Path(directory) / name).write_text(key + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("hash", help="print the content hash of files")
+    p.add_argument("files", nargs="+")
+
+    p = sub.add_parser("key", help="print the cache key for an artefact")
+    p.add_argument("kind", choices=["mutant", "solvated", "fep", "files"])
+    p.add_argument("--wt", help="WT PDB (mutant)")
+    p.add_argument("--mutation", help="mutation spec, e.g. 96:ALA (mutant)")
+    p.add_argument("--pdb", help="mutant PDB (solvated)")
+    p.add_argument("--inp", help="qprep5 input (solvated)")
+    p.add_argument("--lib", action="append", default=[])
+    p.add_argument("--prm", action="append", default=[])
+    p.add_argument("--top", help="topology (fep)")
+    p.add_argument("--qmap", help="qmap file (fep)")
+    p.add_argument("--file", action="append", default=[],
+                   help="input file (files, or extra inputs for mutant/fep)")
+    p.add_argument("--tag", action="append", default=[],
+                   help="free-form setting folded into the key (files)")
+
+    p = sub.add_parser("fetch", help="copy a cached entry, exit 1 on a miss")
+    p.add_argument("key")
+    p.add_argument("destinations", nargs="+")
+
+    p = sub.add_parser("put", help="store files under a key")
+    p.add_argument("key")
+    p.add_argument("files", nargs="+")
+
+    for name in ("check-stamp", "write-stamp"):
+        p = sub.add_parser(name)
+        p.add_argument("directory")
+        p.add_argument("key")
+        p.add_argument("--name", default=STAMP_FILE,
+                       help="stamp file name, for several steps in one directory")
+
+    args = parser.parse_args()
+    # An empty key is what a shell script gets from a failed `key` command
+    if getattr(args, "key", None) is not None and not args.key.strip():
+        parser.error(f"{args.command}: empty cache key")
+
+    if args.command == "hash":
+        for path in args.files:
+            print(f"{file_hash(path)}  {path}")
+    elif args.command == "key":
+        try:
+            if args.kind == "mutant":
+                key = mutant_key(args.wt, args.mutation, args.file)
+            elif args.kind == "solvated":
+                key = solvated_key(args.pdb, args.inp, args.lib, args.prm)
+            elif args.kind == "fep":
+                key = fep_key(args.top, args.qmap, args.file)
+            else:
+                key = files_key("files", args.file, args.tag)
+        except OSError as e:
+            print(f"artifact_cache.py key {args.kind}: missing input {e.filename}",
+                  file=sys.stderr)
+            sys.exit(1)
+        print(key)
+    elif args.command == "fetch":
+        sys.exit(0 if fetch(args.key, args.destinations) else 1)
+    elif args.command == "put":
+        put(args.key, args.files)
+    elif args.command == "check-stamp":
+        sys.exit(0 if check_stamp(args.directory, args.key, args.name) else 1)
+    elif args.command == "write-stamp":
+        write_stamp(args.directory, args.key, args.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Estimate the size of a solvated system before qprep5 is run.
+
+qprep5.inp solvates a sphere around one atom (`solvate 8:CA 28. grid HOH`)
+after `set solvent_pack 2.7`. The same thing is mimicked here:
+
+  - a cubic grid of water oxygens at liquid-water spacing (3.1 Å, as in
+    qprep5's grid solvation) is laid over the sphere
+  - grid points closer than solvent_pack to any solute heavy atom are
+    dropped (one cKDTree query for the whole grid)
+  - solute atoms are counted per residue from the .lib entries, so the
+    hydrogens qprep5 adds to heavy-atom-only files are included
+
+For LMRR_WT2.pdb this gives 1921 waters against the 1925 in
+LMRR_WT2_solvated.pdb. From the water count and the solute atoms inside
+the sphere each system gets a predicted atom count, a cost relative to
+LMRR_WT2 and a size class with the SLURM partition/memory to use (see
+cluster_scripts/change_partition_human*.sh).
+
+The sphere spec is read from a qprep5 input (default qprep5.inp next to
+this script); --center/--radius/--pack override it. As in Q, the residue
+number of the centre is the sequential residue number in the file.
+
+Usage:
+    python estimate_system_size.py [pdb_or_dir ...] [--inp qprep5.inp] [--csv sizes.csv]
+"""
+
+import argparse
+import csv
+import os
+import re
+import sys
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+sys.path.insert(0, os.path.join(HERE, "..", "parameters"))
+from pdb_arrays import heavy_mask, list_pdb_files, read_pdb, residue_index
+from qlib import read_lib_files
+
+DEFAULT_INP = os.path.join(HERE, "qprep5.inp")
+DEFAULT_PDBS = os.path.join(HERE, "..", "prep_structures", "mutations")
+DEFAULT_LIBS = [os.path.join(HERE, "..", "parameters", "qoplsaa.lib"),
+                os.path.join(HERE, "..", "parameters", "LMRR.lib")]
+
+WATER_SPACING = 3.1       # Å, grid spacing of qprep5 grid solvation (~1 g/cm3)
+ATOMS_PER_WATER = 3
+DEFAULT_PACK = 2.4        # qprep5 default solvent_pack
+
+# LMRR_WT2_solvated: 3189 solute atoms inside the sphere + 1925 waters
+REFERENCE_SPHERE_ATOMS = 3189 + 1925 * ATOMS_PER_WATER
+
+# (max total atoms, class, partition, memory)
+SIZE_CLASSES = [
+    (10000, "small", "normal1,normal2,normal3,normal4,normal5", "2G"),
+    (14000, "medium", "normal1,normal2,normal3,normal4,normal5", "4G"),
+    (None, "large", "highmem", "8G"),
+]
+
+
+def read_sphere_spec(inp_file):
+    """(residue number, atom name, radius, solvent_pack) from a qprep5 input."""
+    center, radius, pack = None, None, DEFAULT_PACK
+    with open(inp_file, 'r') as f:
+        for line in f:
+            fields = line.split('#')[0].split('!')[0].split()
+            if not fields:
+                continue
+            command = fields[0].lower()
+            if command == "set" and len(fields) >= 3 and fields[1].lower() == "solvent_pack":
+                pack = float(fields[2])
+            elif command in ("solvate", "boundary") and len(fields) >= 3:
+                spec = fields[2] if command == "boundary" else fields[1]
+                size = fields[3] if command == "boundary" else fields[2]
+                center, radius = spec, float(size)
+    if center is None:
+        raise ValueError(f"no solvate/boundary sphere in {inp_file}")
+    match = re.match(r"(\d+):(\S+)", center)
+    if not match:
+        raise ValueError(f"cannot parse sphere centre '{center}' in {inp_file}")
+    return int(match.group(1)), match.group(2), radius, pack
+
+
+def sphere_center(atoms, residue, name):
+    """Coordinates of atom `name` in the residue-th residue (1-based, Q numbering)."""
+    res = residue_index(atoms)
+    hits = np.flatnonzero((res == residue - 1) & (atoms["name"] == name))
+    if not len(hits):
+        raise ValueError(f"atom {residue}:{name} not found")
+    return atoms["xyz"][hits[0]]
+
+
+def water_grid(center, radius, spacing=WATER_SPACING):
+    """Water oxygen grid points inside the sphere."""
+    axis = np.arange(-radius, radius + 1e-6, spacing)
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+    return grid[np.einsum('ij,ij->i', grid, grid) <= radius ** 2] + center
+
+
+def atom_weights(atoms, residues):
+    """
+    Per-atom weight = library atoms / atoms present for its residue, so the
+    weights of a residue sum to the atom count qprep5 will write. Residues
+    without a library entry count as they are.
+    """
+    res = residue_index(atoms)
+    present = np.bincount(res)
+    first = np.flatnonzero(np.r_[True, res[1:] != res[:-1]])
+    expected = np.array([len(residues[name]["atoms"]) if name in residues else n
+                         for name, n in zip(atoms["resname"][first].tolist(), present)])
+    return (expected / present)[res]
+
+
+def estimate(atoms, center, radius, pack, residues=None):
+    """Predicted counts for one structure."""
+    solute_xyz = atoms["xyz"][heavy_mask(atoms)]
+    grid = water_grid(center, radius)
+    dist, _ = cKDTree(solute_xyz).query(grid, distance_upper_bound=pack)
+    n_water = int(np.isinf(dist).sum())
+
+    weights = atom_weights(atoms, residues) if residues else np.ones(len(atoms["name"]))
+    in_sphere = np.linalg.norm(atoms["xyz"] - center, axis=1) <= radius
+    inside = int(round(weights[in_sphere].sum()))
+    n_solute = int(round(weights.sum()))
+    total = n_solute + n_water * ATOMS_PER_WATER
+    sphere_atoms = inside + n_water * ATOMS_PER_WATER
+    return {
+        "solute_atoms": n_solute,
+        "solute_in_sphere": inside,
+        "waters": n_water,
+        "total_atoms": total,
+        "sphere_atoms": sphere_atoms,
+        "relative_cost": sphere_atoms / REFERENCE_SPHERE_ATOMS,
+        "occupancy": 1.0 - n_water / len(grid),
+    }
+
+
+def size_class(total_atoms):
+    """(class, partition, memory) for a predicted atom count."""
+    for limit, label, partition, memory in SIZE_CLASSES:
+        if limit is None or total_atoms <= limit:
+            return label, partition, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict solvated system sizes before qprep5")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_PDBS],
+                        help="PDB files or directories (default: prep_structures/mutations)")
+    parser.add_argument("--inp", default=DEFAULT_INP, help="qprep5 input with the sphere spec")
+    parser.add_argument("--center", help="sphere centre as residue:atom, e.g. 8:CA")
+    parser.add_argument("--radius", type=float, help="sphere radius (Å)")
+    parser.add_argument("--pack", type=float, help="solvent_pack (Å)")
+    parser.add_argument("--lib", action="append", help="library file (repeatable)")
+    parser.add_argument("--csv", help="write the estimates to CSV")
+    args = parser.parse_args()
+
+    residues = read_lib_files(args.lib or DEFAULT_LIBS)
+
+    residue, name, radius, pack = read_sphere_spec(args.inp)
+    if args.center:
+        residue, name = args.center.split(':')
+        residue = int(residue)
+    radius = args.radius or radius
+    pack = args.pack or pack
+    print(f"Sphere {residue}:{name} {radius:.1f} Å, solvent_pack {pack:.1f} Å\n")
+
+    rows = []
+    print(f"{'Structure':40s} {'solute':>7s} {'waters':>7s} {'total':>7s} "
+          f"{'cost':>5s}  class   memory  partition")
+    for filename in [f for path in args.paths for f in list_pdb_files(path)]:
+        atoms = read_pdb(filename)
+        result = estimate(atoms, sphere_center(atoms, residue, name), radius, pack,
+                          residues)
+        label, partition, memory = size_class(result["total_atoms"])
+        print(f"{os.path.basename(filename):40s} {result['solute_atoms']:7d} "
+              f"{result['waters']:7d} {result['total_atoms']:7d} "
+              f"{result['relative_cost']:5.2f}  {label:7s} {memory:6s}  {partition}")
+        rows.append({"file": filename, **result, "class": label,
+                     "partition": partition, "memory": memory})
+
+    if args.csv and rows:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\nEstimates written to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
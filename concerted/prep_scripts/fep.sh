@@ -1,11 +1,13 @@
 #!/bin/bash
-# Run qprep5 + q_genfeps for WT and mutants
+# Convert the relaxed restart + run q_genfeps for WT and mutants
 # Paths
 PARAMS_DIR="/home/hp/nayanika/github/LmrR_EVB/parameters"
 INPUT_DIR="/home/hp/nayanika/github/LmrR_EVB/input"
 RESULTS_DIR="/home/hp/results/LMRR"
 MUTATIONS_DIR="/home/hp/nayanika/github/LmrR_EVB/structures/mutations"
 RS_SCRIPT="/home/hp/nayanika/github/LmrR_EVB/cluster_scripts/run_qdyn_5.sh"
+CACHE="python3 /home/hp/nayanika/github/LmrR_EVB/prep_scripts/artifact_cache.py"
+RESTART_TO_PDB="python3 /home/hp/nayanika/github/LmrR_EVB/prep_scripts/restart_to_pdb.py"
 
 # Mutants list (WT included at end)
 MUTANTS="ASN14A GLU103A VAL98A ARG10A LYS100A LEU9A ILE15A"
@@ -42,17 +44,42 @@ for NAME in $MUTANTS; do
     # Change to the mutant directory
     cd "$FOLDER"
     
-    # Run qprep5 with direct command line input
-    echo "   ➡️ Running qprep5 for $NAME (using $(basename $PDBFILE))"
-    qprep5 <<EOF
-readlib ${PARAMS_DIR}/qoplsaa.lib
-readlib ${PARAMS_DIR}/LMRR.lib
-readprm ${PARAMS_DIR}/qoplsaa_all.prm
-readtop ${TOPFILE}
-rx ${RXFILE}
-writepdb ${PDBFILE} y
-quit
-EOF
+    # Relaxed structure is keyed on the topology, the final restart and the
+    # libraries the atom names come from
+    PDBKEY=$($CACHE key files --file "$TOPFILE" --file "$RXFILE" \
+        --file "${PARAMS_DIR}/qoplsaa.lib" --file "${PARAMS_DIR}/LMRR.lib" --tag restart_pdb)
+    if [ -z "$PDBKEY" ]; then
+        echo "❌ Missing input for $NAME, skipping"
+        cd - > /dev/null
+        continue
+    fi
+    if $CACHE fetch "$PDBKEY" "$PDBFILE"; then
+        echo "   ✔ Relaxed PDB for $NAME up to date, skipping restart conversion"
+    else
+        echo "   ➡️ Converting relax_012.re for $NAME (to $(basename $PDBFILE))"
+        if $RESTART_TO_PDB --top "$TOPFILE" --re "$RXFILE" -o "$PDBFILE" \
+                --lib "${PARAMS_DIR}/qoplsaa.lib" --lib "${PARAMS_DIR}/LMRR.lib"; then
+            $CACHE put "$PDBKEY" "$PDBFILE"
+        else
+            echo "❌ Could not convert $RXFILE, skipping"
+            cd - > /dev/null
+            continue
+        fi
+    fi
+    
+    # Replicas only need regenerating when their inputs changed
+    FEPKEY=$($CACHE key files --file "$PDBFILE" --file "${INPUT_DIR}/genfeps.proc" \
+        --file relax_012.inp --file "$RS_SCRIPT" --tag genfeps)
+    if [ -z "$FEPKEY" ]; then
+        echo "❌ Missing input for $NAME, skipping"
+        cd - > /dev/null
+        continue
+    fi
+    if $CACHE check-stamp . "$FEPKEY" --name .genfeps_key; then
+        echo "   ✔ Replicas for $NAME up to date, skipping q_genfeps.py"
+        cd - > /dev/null
+        continue
+    fi
     
     # Remove existing replica folders if they exist
     echo "   🧹 Cleaning up existing replica folders..."
@@ -67,7 +94,8 @@ EOF
         --frames 51 \
         --fromlambda 1.0 \
         --prefix replica \
-        --rs "$RS_SCRIPT"
+        --rs "$RS_SCRIPT" \
+        && $CACHE write-stamp . "$FEPKEY" --name .genfeps_key
     
     # Return to original directory
     cd - > /dev/null
@@ -1,6 +1,11 @@
 #!/bin/bash
 # Run genrelax for WT and all mutants, results stored in /home/hp/results/LMRR_PAF
 
+CACHE="python3 /home/hp/nayanika/github/LmrR_EVB/prep_scripts/artifact_cache.py"
+GENRELAX_PROC=/home/hp/nayanika/github/LmrR_EVB/input/genrelax.proc
+FEPFILE=/home/hp/nayanika/github/LmrR_EVB/input/fep/LMRR_WT4.fep
+RUN_SCRIPT=/home/hp/nayanika/github/LmrR_EVB/cluster_scripts/run_qdyn_5.sh
+
 run_genrelax() {
     NAME=$1
     TOP=$2
@@ -8,24 +13,31 @@ run_genrelax() {
 
     OUTDIR="/home/hp/results/LMRR/${NAME}"
 
-    # Remove old directory if exists
+    # Skip mutants whose relaxation inputs are unchanged since the last run
+    KEY=$($CACHE key files --file "$TOP" --file "$PDB" --file "$FEPFILE" \
+        --file "$GENRELAX_PROC" --file "$RUN_SCRIPT" --tag genrelax)
+    [ -n "$KEY" ] || { echo "$NAME: missing input, skipping"; return 1; }
+    if $CACHE check-stamp "$OUTDIR" "$KEY"; then
+        echo "$NAME: relaxation inputs up to date, skipping"
+        return
+    fi
+
+    # Inputs changed (or first run): regenerate from scratch.
+    # rm -rf is synchronous, no need to poll for the directory to vanish.
     if [ -d "$OUTDIR" ]; then
-        echo "Removing existing directory: $OUTDIR"
+        echo "Removing stale directory: $OUTDIR"
         rm -rf "$OUTDIR"
-        # Wait until it's really gone
-        while [ -d "$OUTDIR" ]; do
-            sleep 1
-        done
     fi
 
     # Run genrelax (will create OUTDIR itself)
-    q_genrelax.py /home/hp/nayanika/github/LmrR_EVB/input/genrelax.proc \
+    q_genrelax.py "$GENRELAX_PROC" \
         --top "$TOP" \
         --pdb "$PDB" \
-        --fep /home/hp/nayanika/github/LmrR_EVB/input/fep/LMRR_WT4.fep \
+        --fep "$FEPFILE" \
         --outdir "$OUTDIR" \
         --rest top \
-        --rs /home/hp/nayanika/github/LmrR_EVB/cluster_scripts/run_qdyn_5.sh
+        --rs "$RUN_SCRIPT" \
+        && $CACHE write-stamp "$OUTDIR" "$KEY"
 }
 
 # Wild-type
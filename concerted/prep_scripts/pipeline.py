@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Run the preparation and FEP chain of every mutant as a dependency graph.
+
+prep.sh, minim.sh, fep.sh and preprestart.sh each had hard-coded paths and
+their own mutant list. Here one config (pipeline.json, paths relative to
+the repository; results go to results/LMRR unless --results-dir is given)
+lists the mutants, and every mutant gets the chain
+
+    mutate -> solvate -> [make_fep] -> genrelax -> relax -> restart_pdb
+           -> genfeps -> fep -> analysis
+
+WT starts at solvate. make_fep (batch_make_fep.py) is only part of the chain
+when the config has no shared "fep" file; by default every mutant is relaxed
+with input/fep/LMRR_WT4.fep, as in minim.sh.
+
+    mutate       prep_mutants.mutate_residue on the WT PDB (ASN18A: residue
+                 18, ASN -> ALA)
+    solvate      structure validation, then qprep5 with the prep.sh input
+    genrelax     q_genrelax.py into <results>/<mutant> (removed first)
+    relax        qdyn5 on every .inp of that folder in natural order, as
+                 run_qdyn_5.sh does
+    restart_pdb  restart_to_pdb.py: relax_012.re -> <results>/<mutant>/minim.pdb
+                 (fep.sh wrote it over the solvated PDB)
+    genfeps      q_genfeps.py with the fep.sh arguments (replica* removed first)
+    fep          qdyn5 in every replica folder
+    analysis     q_mapper.py and q_analysefeps.py -> <results>/<mutant>/analysis.log
+
+Every node is keyed on the content hashes of its input files and its
+settings (artifact_cache.files_key). The key is stamped under
+<results>/.pipeline/<mutant>/ when the node succeeds, and a node runs again
+only when its key changed, an output is missing or its step is forced.
+Editing one mutant PDB therefore only reruns that mutant's chain, and the
+chain stops early where a rerun step writes the same files as before.
+
+Nodes run as soon as their dependencies are done, so independent mutants
+go through the chain concurrently. At most --cores qprep5/qdyn5/Qtools
+processes (and in-process steps) run at any time; the replicas of one
+mutant run side by side. A failing node is reported with its log and the
+nodes after it are skipped; the other mutants carry on and the run exits
+non-zero.
+
+--stand-ins replaces qprep5, qdyn5, the Qtools scripts and make_fep with
+stand_ins.py, which writes files of the right shape in a fraction of a
+second, so the graph can be exercised without Q (with --workdir to keep
+the output out of the repository).
+
+Usage:
+    python pipeline.py [--config pipeline.json] [--mutants WT2 ASN18A ...] [--until STEP]
+                       [--cores N] [--force STEP ...] [--dry-run]
+                       [--results-dir DIR] [--stand-ins] [--workdir DIR]
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(ROOT, "prep_structures"))
+sys.path.insert(0, os.path.join(ROOT, "parameters"))
+sys.path.insert(0, os.path.join(ROOT, "structures"))
+import artifact_cache
+from pdb_arrays import read_pdb
+from prep_mutants import get_residue_name, mutate_residue, read_pdb_file, write_pdb_file
+from qlib import read_lib_files
+from restart_to_pdb import folder_task, write_restart_pdb
+from validate_structures import LibraryIndex, has_errors, validate_atoms
+
+DEFAULT_CONFIG = os.path.join(HERE, "pipeline.json")
+STAND_INS = os.path.join(HERE, "stand_ins.py")
+BATCH_MAKE_FEP = os.path.join(ROOT, "input", "fep", "batch_make_fep.py")
+
+STEPS = ("mutate", "solvate", "make_fep", "genrelax", "relax", "restart_pdb", "genfeps",
+         "fep", "analysis")
+PATH_KEYS = ("wt_pdb", "mutants_dir", "solvated_dir", "results_dir", "fep", "qmap", "fep_dir",
+             "genrelax_proc", "run_script", "genfeps_proc")
+# Output directories under --workdir
+WORK_DIRS = {"mutants_dir": "mutations", "solvated_dir": "solvated", "results_dir": "results",
+             "fep_dir": "fep"}
+STATE_DIR = ".pipeline"
+RELAXED_PDB = "minim.pdb"
+ANALYSIS_LOG = "analysis.log"
+# Mutant names as in prep_mutants.py: original residue, number, one-letter target
+MUTANT_NAME = re.compile(r"^([A-Z]{3})(\d+)([A-Z])$")
+TARGETS = {'A': 'ALA', 'L': 'LEU', 'E': 'GLU'}
+
+
+class StepError(Exception):
+    pass
+
+
+def natural_key(text):
+    """Sort key that orders relax_2 before relax_10, like ls -v."""
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", text)]
+
+
+def expand(patterns, required=False):
+    """Sorted paths matching the patterns; with required, every pattern must match."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern), key=natural_key)
+        if required and not matches:
+            raise StepError(f"missing input {pattern}")
+        paths.extend(matches)
+    return paths
+
+
+def load_config(filename, workdir=None, results_dir=None):
+    """Config with its paths made absolute (relative ones are relative to the repository)."""
+    with open(filename, 'r') as f:
+        config = json.load(f)
+    if results_dir:
+        config["results_dir"] = os.path.abspath(results_dir)
+    for key in PATH_KEYS:
+        if config.get(key):
+            config[key] = os.path.join(ROOT, config[key])
+    for key in ("libs", "prm"):
+        config[key] = [os.path.join(ROOT, path) for path in config[key]]
+    if workdir:
+        for key, name in WORK_DIRS.items():
+            config[key] = os.path.join(os.path.abspath(workdir), name)
+    return config
+
+
+def tools(config, stand_ins=False):
+    """Command prefix of every external program."""
+    commands = {name: list(command) if isinstance(command, list) else [command]
+                for name, command in config["executables"].items()}
+    commands["make_fep"] = [sys.executable, BATCH_MAKE_FEP]
+    if stand_ins:
+        commands = {name: [sys.executable, STAND_INS, name] for name in commands}
+    return commands
+
+
+class Node:
+    """
+    One step of one mutant. inputs and outputs are paths or glob patterns;
+    settings are the non-file parts of the key (command-line arguments).
+    """
+
+    def __init__(self, step, mutant, deps, inputs, outputs, action, settings=(), state_dir=None):
+        self.step = step
+        self.mutant = mutant
+        self.name = f"{mutant}:{step}"
+        self.deps = [f"{mutant}:{d}" for d in deps]
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.action = action
+        self.settings = [str(s) for s in settings]
+        self.state_dir = state_dir
+        self.stamp = f".{step}_key"
+
+    def key(self):
+        return artifact_cache.files_key(f"pipeline_{self.step}", expand(self.inputs, True),
+                                        extra=self.settings)
+
+    def missing_outputs(self):
+        return [pattern for pattern in self.outputs if not glob.glob(pattern)]
+
+
+class Runner:
+    """Runs the node actions; every process (or in-process step) holds one core."""
+
+    def __init__(self, config, commands, cores):
+        self.config = config
+        self.commands = commands
+        self.n_cores = cores
+        self.cores = threading.BoundedSemaphore(cores)
+        self._lock = threading.Lock()
+        self._residues = None
+        self._lib_index = None
+
+    def residues(self):
+        with self._lock:
+            if self._residues is None:
+                self._residues = read_lib_files(self.config["libs"])
+                self._lib_index = LibraryIndex(self._residues)
+            return self._residues
+
+    def run(self, program, args, cwd, log, append=False):
+        """Run a program from the executables map; its output goes to log."""
+        command = self.commands[program] + [str(a) for a in args]
+        os.makedirs(os.path.dirname(log), exist_ok=True)
+        with self.cores, open(log, 'a' if append else 'w') as f:
+            result = subprocess.run(command, cwd=cwd, stdout=f, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise StepError(f"{program} exited with {result.returncode}, see {log}")
+
+    def run_qdyn(self, folder):
+        """Every .inp of a folder in natural order, as run_qdyn_5.sh does."""
+        for inp in expand([os.path.join(folder, "*.inp")]):
+            step = os.path.splitext(os.path.basename(inp))[0]
+            self.run("qdyn5", [os.path.basename(inp)], folder, os.path.join(folder, f"{step}.log"))
+
+    # Actions
+
+    def mutate(self, spec, output):
+        resname, resnum, target = spec
+        lines = read_pdb_file(self.config["wt_pdb"])
+        found = get_residue_name(lines, resnum)
+        if found != resname:
+            raise StepError(f"residue {resnum} of {self.config['wt_pdb']} is {found}, "
+                            f"not {resname}")
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with self.cores:
+            write_pdb_file(mutate_residue(lines, resnum, target), output)
+
+    def solvate(self, pdb, base):
+        self.residues()
+        with self.cores:
+            issues, _ = validate_atoms(read_pdb(pdb), self._lib_index)
+        if has_errors(issues):
+            kinds = sorted({issue["kind"] for issue in issues})
+            raise StepError(f"{pdb} fails validation ({', '.join(kinds)}); "
+                            f"run validate_structures.py for details")
+
+        directory = self.config["solvated_dir"]
+        os.makedirs(directory, exist_ok=True)
+        lines = [f"readlib {lib}" for lib in self.config["libs"]]
+        lines += [f"readprm {prm}" for prm in self.config["prm"]]
+        lines += [f"readpdb {pdb}"] + self.config["solvation"]
+        lines += [f"maketop {base}_solvated.top", f"writetop {base}_solvated.top",
+                  f"writepdb {base}_solvated.pdb y", "quit"]
+        with open(os.path.join(directory, f"{base}_solvation.inp"), 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        self.run("qprep5", [f"{base}_solvation.inp"], directory,
+                 os.path.join(directory, f"{base}_solvation.log"))
+
+    def make_fep(self, pdb, log):
+        os.makedirs(self.config["fep_dir"], exist_ok=True)
+        args = [pdb, "--qmap", self.config["qmap"], "-o", self.config["fep_dir"], "--jobs", 1]
+        args += [a for lib in self.config["libs"] for a in ("--lib", lib)]
+        args += [a for prm in self.config["prm"] for a in ("--prm", prm)]
+        self.run("make_fep", args, self.config["fep_dir"], log)
+
+    def genrelax(self, top, pdb, fep, folder, log):
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+        self.run("q_genrelax", [self.config["genrelax_proc"], "--top", top, "--pdb", pdb,
+                                "--fep", fep, "--outdir", folder] + self.config["genrelax"] +
+                 ["--rs", self.config["run_script"]], os.path.dirname(folder), log)
+
+    def restart_pdb(self, folder):
+        residues = self.residues()
+        task = folder_task(folder, self.config["relax_restart"], RELAXED_PDB, residues)
+        if task is None:
+            raise StepError(f"no .top file in {folder}")
+        with self.cores:
+            write_restart_pdb(*task)
+
+    def genfeps(self, folder, log):
+        prefix = self.config["replica_prefix"]
+        for old in glob.glob(os.path.join(folder, f"{prefix}*")):
+            shutil.rmtree(old)
+        self.run("q_genfeps", [self.config["genfeps_proc"], "--pdb", RELAXED_PDB,
+                               self.config["relax_input"]] + self.config["genfeps"] +
+                 ["--prefix", prefix, "--rs", self.config["run_script"]], folder, log)
+
+    def fep(self, folder):
+        replicas = expand([os.path.join(folder, f"{self.config['replica_prefix']}*")])
+        with ThreadPoolExecutor(max_workers=len(replicas) or 1) as pool:
+            list(pool.map(self.run_qdyn, replicas))
+
+    def analysis(self, folder):
+        replicas = [os.path.basename(path) for path in
+                    expand([os.path.join(folder, f"{self.config['replica_prefix']}*")])]
+        log = os.path.join(folder, ANALYSIS_LOG)
+        self.run("q_mapper", self.config["mapper"] + ["--dirs"] + replicas, folder, log)
+        self.run("q_analysefeps", replicas, folder, log, append=True)
+
+
+def parse_mutant(name):
+    """(original residue, number, target residue) of a name such as ASN18A."""
+    match = MUTANT_NAME.match(name)
+    if not match or match.group(3) not in TARGETS:
+        raise ValueError(f"{name}: not a mutant name like ASN18A (targets "
+                         f"{', '.join(TARGETS)})")
+    return match.group(1), int(match.group(2)), TARGETS[match.group(3)]
+
+
+def build_graph(config, runner, mutants, steps=STEPS):
+    """{node name: Node} in dependency order for the given mutants and steps."""
+    c = config
+    base = os.path.splitext(os.path.basename(c["wt_pdb"]))[0]
+    prefix = c["replica_prefix"]
+    nodes = {}
+    for name in mutants:
+        is_wt = name == c["wt"]
+        stem = base if is_wt else f"{base}_{name}"
+        mutant_pdb = c["wt_pdb"] if is_wt else os.path.join(c["mutants_dir"], f"{stem}.pdb")
+        top = os.path.join(c["solvated_dir"], f"{stem}_solvated.top")
+        pdb = os.path.join(c["solvated_dir"], f"{stem}_solvated.pdb")
+        fep = c["fep"] or os.path.join(c["fep_dir"], f"{stem}.fep")
+        folder = os.path.join(c["results_dir"], name)
+        replicas = os.path.join(folder, f"{prefix}*")
+        state = os.path.join(c["results_dir"], STATE_DIR, name)
+        log = lambda step: os.path.join(state, f"{step}.log")
+
+        candidates = []
+        if not is_wt:
+            spec = parse_mutant(name)
+            candidates.append(("mutate", [], [c["wt_pdb"]], [mutant_pdb],
+                               lambda s=spec, o=mutant_pdb: runner.mutate(s, o), spec))
+        candidates.append(("solvate", ["mutate"], [mutant_pdb] + c["libs"] + c["prm"], [top, pdb],
+                           lambda p=mutant_pdb, s=stem: runner.solvate(p, s), c["solvation"]))
+        if not c["fep"]:
+            candidates.append(("make_fep", ["solvate"], [pdb, top, c["qmap"]] + c["libs"] + c["prm"],
+                               [fep], lambda p=pdb, l=log("make_fep"): runner.make_fep(p, l)))
+        candidates += [
+            ("genrelax", ["solvate", "make_fep"],
+             [top, pdb, fep, c["genrelax_proc"], c["run_script"]],
+             [os.path.join(folder, c["relax_input"])],
+             lambda t=top, p=pdb, f=fep, d=folder, l=log("genrelax"): runner.genrelax(t, p, f, d, l),
+             c["genrelax"]),
+            ("relax", ["genrelax"], [os.path.join(folder, "*.inp"), os.path.join(folder, "*.top")],
+             [os.path.join(folder, c["relax_restart"])], lambda d=folder: runner.run_qdyn(d)),
+            ("restart_pdb", ["relax"],
+             [os.path.join(folder, "*.top"), os.path.join(folder, c["relax_restart"])] + c["libs"],
+             [os.path.join(folder, RELAXED_PDB)], lambda d=folder: runner.restart_pdb(d)),
+            ("genfeps", ["restart_pdb"],
+             [os.path.join(folder, RELAXED_PDB), os.path.join(folder, c["relax_input"]),
+              c["genfeps_proc"], c["run_script"]],
+             [os.path.join(replicas, "*.inp")],
+             lambda d=folder, l=log("genfeps"): runner.genfeps(d, l), c["genfeps"] + [prefix]),
+            ("fep", ["genfeps"], [os.path.join(replicas, "*.inp")],
+             [os.path.join(replicas, "*.en")], lambda d=folder: runner.fep(d)),
+            ("analysis", ["fep"], [os.path.join(replicas, "*.en")],
+             [os.path.join(folder, ANALYSIS_LOG)], lambda d=folder: runner.analysis(d), c["mapper"]),
+        ]
+
+        for step, deps, inputs, outputs, action, *settings in candidates:
+            if step not in steps:
+                continue
+            deps = [d for d in deps if f"{name}:{d}" in nodes]
+            node = Node(step, name, deps, inputs, outputs, action,
+                        settings[0] if settings else (), state)
+            nodes[node.name] = node
+    return nodes
+
+
+def status(node, force=()):
+    """(fresh, key, reason) of a node; key is None when inputs are missing."""
+    try:
+        key = node.key()
+    except StepError as e:
+        return False, None, str(e)
+    if node.step in force:
+        return False, key, "forced"
+    if not artifact_cache.check_stamp(node.state_dir, key, node.stamp):
+        stamped = os.path.exists(os.path.join(node.state_dir, node.stamp))
+        return False, key, "inputs changed" if stamped else "not run yet"
+    missing = node.missing_outputs()
+    if missing:
+        return False, key, f"missing {missing[0]}"
+    return True, key, ""
+
+
+def execute(node, force=()):
+    """
+    (status, message) of bringing one node up to date. Never raises: any
+    error fails this node only, so the other mutants carry on.
+    """
+    try:
+        return _execute(node, force)
+    except (StepError, SystemExit) as e:
+        return "failed", str(e)
+    except Exception as e:
+        return "failed", f"{type(e).__name__}: {e}"
+
+
+def _execute(node, force):
+    start = time.perf_counter()
+    fresh, key, reason = status(node, force)
+    if fresh:
+        return "up to date", ""
+    if key is None:
+        return "failed", reason
+    for path in expand(node.outputs):
+        if os.path.isfile(path):
+            os.remove(path)
+    node.action()
+    missing = node.missing_outputs()
+    if missing:
+        return "failed", f"finished without writing {missing[0]}"
+    artifact_cache.write_stamp(node.state_dir, key, node.stamp)
+    return "done", f"{reason}, {time.perf_counter() - start:.1f} s"
+
+
+def run_graph(nodes, force=()):
+    """Run the stale nodes, each as soon as its dependencies are done; {name: status}."""
+    results = {}
+    pending = list(nodes.values())
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as pool:
+        while pending or running:
+            for node in list(pending):
+                states = [results.get(dep) for dep in node.deps]
+                if any(s in ("failed", "skipped") for s in states):
+                    pending.remove(node)
+                    results[node.name] = "skipped"
+                    blocked = next(d for d, s in zip(node.deps, states) if s in ("failed", "skipped"))
+                    print(f"{node.name:24s} {'skipped':10s} {blocked} did not complete", flush=True)
+                elif all(s in ("done", "up to date") for s in states):
+                    pending.remove(node)
+                    running[pool.submit(execute, node, force)] = node
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                results[node.name], message = future.result()
+                print(f"{node.name:24s} {results[node.name]:10s} {message}", flush=True)
+    return results
+
+
+def plan(nodes, force=()):
+    """Print which nodes would run; nodes after a stale node are stale too."""
+    stale = set()
+    for node in nodes.values():
+        upstream = [dep for dep in node.deps if dep in stale]
+        if upstream:
+            fresh, reason = False, f"after {upstream[0]}"
+        else:
+            fresh, _, reason = status(node, force)
+        if not fresh:
+            stale.add(node.name)
+        print(f"{node.name:24s} {'up to date' if fresh else 'stale':10s} {reason}")
+    return stale
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the mutant preparation and FEP chain as "
+                                                 "a dependency graph")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--mutants", nargs="+", help="subset of the config's mutants")
+    parser.add_argument("--until", choices=STEPS, help="last step to run")
+    parser.add_argument("--cores", type=int, help="concurrent processes (default: config)")
+    parser.add_argument("--force", nargs="+", default=[], choices=STEPS + ("all",),
+                        help="rerun these steps even if up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only list the stale nodes")
+    parser.add_argument("--stand-ins", action="store_true",
+                        help="use stand_ins.py instead of Q and Qtools")
+    parser.add_argument("--results-dir", help="results folder (default: the config's, "
+                                              "results/LMRR in the repository)")
+    parser.add_argument("--workdir", help="put the mutant, solvated, FEP and results folders "
+                                          "under this directory")
+    args = parser.parse_args()
+
+    config = load_config(args.config, args.workdir, args.results_dir)
+    mutants = args.mutants or config["mutants"]
+    steps = STEPS[:STEPS.index(args.until) + 1] if args.until else STEPS
+    force = STEPS if "all" in args.force else args.force
+    runner = Runner(config, tools(config, args.stand_ins), args.cores or config["cores"])
+    try:
+        nodes = build_graph(config, runner, mutants, steps)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.dry_run:
+        stale = plan(nodes, force)
+        print(f"\n{len(stale)} of {len(nodes)} nodes would run")
+        return
+
+    print(f"{len(mutants)} mutants, {len(nodes)} nodes, {runner.n_cores} cores")
+    start = time.perf_counter()
+    results = run_graph(nodes, force)
+    counts = {s: sum(1 for r in results.values() if r == s)
+              for s in ("done", "up to date", "failed", "skipped")}
+    print(f"\n{counts['done']} run, {counts['up to date']} up to date, {counts['failed']} failed, "
+          f"{counts['skipped']} skipped in {time.perf_counter() - start:.1f} s")
+    if counts["failed"] or counts["skipped"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
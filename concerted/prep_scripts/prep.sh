@@ -7,6 +7,8 @@
 INPUT_DIR="/home/hp/nayanika/github/LmrR_EVB/prep_structures/mutations"
 OUTPUT_DIR="/home/hp/nayanika/github/LmrR_EVB/structures/mutations"  # Changed to save in mutations folder
 PARAM_DIR="/home/hp/nayanika/github/LmrR_EVB/parameters"
+CACHE="python3 /home/hp/nayanika/github/LmrR_EVB/prep_scripts/artifact_cache.py"
+VALIDATE="python3 /home/hp/nayanika/github/LmrR_EVB/prep_structures/validate_structures.py"
 
 # Create output directory if it doesn't exist
 mkdir -p "$OUTPUT_DIR"
@@ -23,8 +25,19 @@ echo "Input directory: $INPUT_DIR"
 echo "Output directory: $OUTPUT_DIR"
 echo "================================================"
 
+# Validate all mutant PDBs up front (in parallel) so broken inputs never reach qprep5
+echo "Validating input structures..."
+FAILED=$($VALIDATE "$INPUT_DIR" --lib "$PARAM_DIR/qoplsaa.lib" --lib "$PARAM_DIR/LMRR.lib" --list-failed)
+if [ -n "$FAILED" ]; then
+    echo "Structures failing validation (run validate_structures.py for details):"
+    echo "$FAILED" | sed 's/^/  /'
+fi
+echo "================================================"
+
 # Counter for processed files
 count=0
+cached=0
+skipped=0
 
 # Change to output directory to avoid path issues
 cd "$OUTPUT_DIR" || exit 1
@@ -40,10 +53,11 @@ for pdb_file in "$INPUT_DIR"/*.pdb; do
     # Extract basename without extension
     basename=$(basename "$pdb_file" .pdb)
     
-    # Skip problematic A11L and A91E mutations for now
-    if [[ "$basename" == *"A11L"* ]] || [[ "$basename" == *"A91E"* ]]; then
-        echo "Skipping $basename (incomplete sidechain - needs manual fixing)"
+    # Skip structures that failed validation (e.g. incomplete A11L/A91E side chains)
+    if grep -qxF "$pdb_file" <<< "$FAILED"; then
+        echo "Skipping $basename (failed structure validation - needs manual fixing)"
         echo "  --------------------------------"
+        ((skipped++))
         continue
     fi
     
@@ -66,6 +80,24 @@ EOF
     
     echo "  Created input file: ${basename}_solvation.inp"
     
+    # Reuse the solvated system if this mutant PDB was already solvated
+    # with the same qprep5 settings, libraries and parameters
+    key=$($CACHE key solvated --pdb "$pdb_file" --inp "${basename}_solvation.inp" \
+        --lib "$PARAM_DIR/qoplsaa.lib" --lib "$PARAM_DIR/LMRR.lib" \
+        --prm "$PARAM_DIR/qoplsaa_all.prm")
+    if [ -z "$key" ]; then
+        echo "  ✗ Error: missing input for $basename, skipping"
+        echo "  --------------------------------"
+        continue
+    fi
+    if $CACHE fetch "$key" "${basename}_solvated.top" "${basename}_solvated.pdb"; then
+        echo "  ✓ Up to date (cache key ${key:0:12}), skipping qprep5"
+        ((count++))
+        ((cached++))
+        echo "  --------------------------------"
+        continue
+    fi
+    
     # Run qprep5 
     echo "  Running solvation for $basename..."
     qprep5 "${basename}_solvation.inp" > "${basename}_solvation.log" 2>&1
@@ -74,6 +106,7 @@ EOF
     if [ -f "${basename}_solvated.pdb" ] && [ -f "${basename}_solvated.top" ]; then
         echo "  ✓ Successfully created ${basename}_solvated.pdb"
         echo "  ✓ Files saved: ${basename}_solvated.pdb, ${basename}_solvated.top, ${basename}_solvation.log"
+        $CACHE put "$key" "${basename}_solvated.top" "${basename}_solvated.pdb"
         ((count++))
     else
         echo "  ✗ Error: Solvation failed for $basename"
@@ -94,15 +127,19 @@ done
 echo "================================================"
 echo "Batch solvation completed!"
 echo "Successfully processed: $count files"
+echo "Reused from cache: $cached files"
+echo "Skipped (failed validation): $skipped files"
 echo "All files saved to: $OUTPUT_DIR"
-echo ""
-echo "Note: A11L and A91E mutations were skipped due to incomplete sidechains."
-echo "To fix these, use a structure building tool to add missing LEU/GLU atoms."
+if [ "$skipped" -gt 0 ]; then
+    echo ""
+    echo "Fix the skipped structures (e.g. add missing side-chain atoms) and re-run."
+fi
 
 # Optional: Create summary file
 echo "Solvation Summary - $(date)" > "$OUTPUT_DIR/solvation_summary.txt"
 echo "Processed $count PDB files" >> "$OUTPUT_DIR/solvation_summary.txt"
-echo "Skipped A11L and A91E mutations (incomplete sidechains)" >> "$OUTPUT_DIR/solvation_summary.txt"
+echo "Skipped $skipped structures that failed validation:" >> "$OUTPUT_DIR/solvation_summary.txt"
+[ -n "$FAILED" ] && echo "$FAILED" >> "$OUTPUT_DIR/solvation_summary.txt"
 echo "Files created:" >> "$OUTPUT_DIR/solvation_summary.txt"
 ls -1 "$OUTPUT_DIR"/*_solvated.pdb >> "$OUTPUT_DIR/solvation_summary.txt" 2>/dev/null
 
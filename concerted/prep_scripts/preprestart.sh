@@ -1,47 +1,21 @@
 #!/bin/bash
-# Run qprep5 to generate minim.pdb for WT and mutants from relax_012.re
-# It will use the .top file that is already present in each folder.
+# Write minim.pdb for WT and mutants from relax_012.re, using the .top file
+# that is already present in each folder. restart_to_pdb.py reads the
+# restarts directly (no qprep5) and converts all folders in parallel.
 
 PARAMS_DIR="/home/hp/nayanika/github/LmrR_EVB/parameters"
 RESULTS_DIR="/home/hp/results/LMRR_PAF"
+RESTART_TO_PDB="/home/hp/nayanika/github/LmrR_EVB/prep_scripts/restart_to_pdb.py"
 
 # Mutants list (each has its own folder in RESULTS_DIR)
 MUTANTS="ASN18A ASN87A ASP99A GLU7A LEU17A LYS21A MET88A PHE92A SER94A SER96A WT2 TRP95A"
 
+FOLDERS=""
 for NAME in $MUTANTS; do
-    echo "Processing $NAME ..."
-
-    FOLDER="${RESULTS_DIR}/${NAME}"
-
-    TOPFILE=$(ls "$FOLDER"/*.top 2>/dev/null)
-    RXFILE="${FOLDER}/relax_012.re"
-    OUTPDB="${FOLDER}/minim.pdb"
-    INPFILE="${FOLDER}/preprestart.inp"
-
-    if [ ! -f "$TOPFILE" ]; then
-        echo "❌ No .top file found in $FOLDER, skipping."
-        continue
-    fi
-
-    if [ ! -f "$RXFILE" ]; then
-        echo "❌ No relax_012.re file in $FOLDER, skipping."
-        continue
-    fi
-
-    # Create input file for qprep5
-    cat > "$INPFILE" <<EOF
-readlib ${PARAMS_DIR}/qoplsaa.lib
-readlib ${PARAMS_DIR}/LMRR.lib
-readprm ${PARAMS_DIR}/qoplsaa_all.prm
-readtop ${TOPFILE}
-rx ${RXFILE}
-writepdb ${OUTPDB} y
-quit
-EOF
-
-    # Run qprep5
-    qprep5 "$INPFILE"
-
+    FOLDERS="$FOLDERS ${RESULTS_DIR}/${NAME}"
 done
 
+python3 "$RESTART_TO_PDB" $FOLDERS --restart relax_012.re --output minim.pdb \
+    --lib "${PARAMS_DIR}/qoplsaa.lib" --lib "${PARAMS_DIR}/LMRR.lib"
+
 echo "✅ All minim.pdb files generated (where inputs existed)."
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Read Q restart (.re) files and write their coordinates as PDB files without
+qprep5.
+
+preprestart.sh and fep.sh used to run qprep5 (readlib, readprm, readtop,
+rx relax_012.re, writepdb) once per mutant only to get the relaxed
+coordinates. A restart is a Fortran unformatted sequential file (every
+record framed by its length as a 4-byte integer) written by Qdyn as
+
+    natom, x(1:3*natom)          coordinates
+    natom, v(1:3*natom)          velocities (absent in some restarts)
+    boxlength(3), boxcentre(3)   periodic box (PBC runs only)
+
+with 4- or 8-byte reals; the size is worked out from the record length.
+
+Atom and residue names come from the topology (structures/qtop.py, cached)
+and the residue libraries: Q stores the atoms of every residue in library
+order, as qprep5's writepdb assumes. Residues are numbered sequentially
+and TER records separate the solute molecules, as in qprep5's output.
+
+Usage:
+    python restart_to_pdb.py FOLDER [...] [--restart relax_012.re] [--output minim.pdb]
+                             [--lib qoplsaa.lib --lib LMRR.lib] [--jobs N]
+    python restart_to_pdb.py --top X.top --re relax_012.re -o minim.pdb
+"""
+
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, os.path.join(ROOT, "parameters"))
+sys.path.insert(0, os.path.join(ROOT, "structures"))
+from pdb_arrays import format_atom_line
+from qlib import read_lib_files
+from qtop import load_topology
+
+DEFAULT_LIBS = [os.path.join(ROOT, "parameters", name) for name in ("qoplsaa.lib", "LMRR.lib")]
+MARKER = np.dtype("<i4")
+
+
+def _records(data):
+    """Payloads of the Fortran unformatted records in data (bytes)."""
+    offset = 0
+    while offset < len(data):
+        length = int(np.frombuffer(data, MARKER, 1, offset)[0])
+        end = offset + MARKER.itemsize + length
+        if length < 0 or end + MARKER.itemsize > len(data) or \
+                int(np.frombuffer(data, MARKER, 1, end)[0]) != length:
+            raise ValueError(f"broken record at byte {offset}")
+        yield data[offset + MARKER.itemsize:end]
+        offset = end + MARKER.itemsize
+
+
+def _vectors(record):
+    """(natom, (natom, 3) array) of a coordinate or velocity record."""
+    natom = int(np.frombuffer(record, MARKER, 1)[0])
+    size = (len(record) - MARKER.itemsize) // max(3 * natom, 1)
+    if natom <= 0 or size not in (4, 8) or MARKER.itemsize + 3 * natom * size != len(record):
+        raise ValueError(f"record of {len(record)} bytes is not natom + 3*natom reals")
+    values = np.frombuffer(record, f"<f{size}", 3 * natom, MARKER.itemsize)
+    return natom, values.astype(np.float64).reshape(natom, 3)
+
+
+def read_restart(filename):
+    """
+    {"xyz": (natom, 3), "velocities": (natom, 3) or None,
+     "box": (length, centre) or None} of a Q restart file.
+    """
+    with open(filename, 'rb') as f:
+        records = list(_records(f.read()))
+    if not records:
+        raise ValueError(f"{filename}: empty restart file")
+
+    try:
+        xyz = _vectors(records[0])[1]
+        restart = {"xyz": xyz, "velocities": None, "box": None}
+        for record in records[1:]:
+            if len(record) == len(records[0]):
+                restart["velocities"] = _vectors(record)[1]
+            elif len(record) in (6 * 4, 6 * 8):
+                box = np.frombuffer(record, f"<f{len(record) // 6}").astype(np.float64)
+                restart["box"] = (box[:3], box[3:])
+            else:
+                raise ValueError(f"unexpected record of {len(record)} bytes")
+    except ValueError as e:
+        raise ValueError(f"{filename}: {e}") from None
+    return restart
+
+
+def write_restart(filename, xyz, velocities=None, box=None, dtype=np.float64):
+    """Write a restart in the layout read_restart expects (and Qdyn reads)."""
+    def record(payload):
+        length = np.array([len(payload)], MARKER).tobytes()
+        return length + payload + length
+
+    real = f"<f{np.dtype(dtype).itemsize}"
+    natom = np.array([len(xyz)], MARKER).tobytes()
+    with open(filename, 'wb') as f:
+        f.write(record(natom + np.asarray(xyz, real).tobytes()))
+        if velocities is not None:
+            f.write(record(natom + np.asarray(velocities, real).tobytes()))
+        if box is not None:
+            f.write(record(np.concatenate(box).astype(real).tobytes()))
+
+
+def atom_names(top, residues):
+    """Atom name of every topology atom from the library entries of its residue."""
+    starts = np.append(top["residue_start"], top["header"]["n_atoms"])
+    names = []
+    for i, resname in enumerate(top["residue_names"]):
+        entry = residues.get(str(resname).upper())
+        n = int(starts[i + 1] - starts[i])
+        if entry is None:
+            raise ValueError(f"residue {i + 1} {resname} is not in the libraries")
+        if len(entry["atoms"]) != n:
+            raise ValueError(f"residue {i + 1} {resname} has {n} atoms in the topology, "
+                             f"{len(entry['atoms'])} in the library")
+        names.extend(name for name, _, _ in entry["atoms"])
+    return names
+
+
+def write_restart_pdb(top_file, restart_file, output, residues):
+    """Write the restart coordinates as a PDB with the topology's atoms."""
+    top = load_topology(top_file)
+    restart = read_restart(restart_file)
+    n_atoms = top["header"]["n_atoms"]
+    if len(restart["xyz"]) != n_atoms:
+        raise ValueError(f"{restart_file} has {len(restart['xyz'])} atoms, "
+                         f"{top_file} {n_atoms}")
+
+    names = atom_names(top, residues)
+    starts = top["residue_start"]
+    residue = np.searchsorted(starts, np.arange(n_atoms), side='right') - 1
+    # TER between solute molecules only, as qprep5 writes it
+    n_solute = top["header"]["n_solute_atoms"]
+    ter_after = {int(s) - 1 for s in top["molecule_start"][1:] if s < n_solute}
+
+    lines = []
+    for i, (x, y, z) in enumerate(restart["xyz"]):
+        resname, resseq = str(top["residue_names"][residue[i]]), int(residue[i]) + 1
+        lines.append(format_atom_line(i + 1, names[i], resname, ' ', resseq, x, y, z))
+        if i in ter_after:
+            lines.append(f"TER              {resname:3s} {resseq % 10000:5d}\n")
+    lines.append("END\n")
+    with open(output, 'w') as f:
+        f.writelines(lines)
+    return restart
+
+
+def convert(top_file, restart_file, output, residues):
+    """(output, status, message) of one conversion; errors are reported, not raised."""
+    try:
+        restart = write_restart_pdb(top_file, restart_file, output, residues)
+    except (OSError, ValueError) as e:
+        return output, "failed", str(e)
+    extra = [name for name in ("velocities", "box") if restart[name] is not None]
+    return output, "ok", f"{len(restart['xyz'])} atoms" + \
+        (f" (with {' and '.join(extra)})" if extra else "")
+
+
+def _convert(args):
+    return convert(*args)
+
+
+def folder_task(folder, restart, output, residues):
+    """Conversion arguments of a results folder (first *.top in it), or None."""
+    tops = sorted(glob.glob(os.path.join(folder, "*.top")))
+    if not tops:
+        return None
+    return (tops[0], os.path.join(folder, restart), os.path.join(folder, output), residues)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Q restart files to PDB without qprep5")
+    parser.add_argument("folders", nargs="*",
+                        help="results folders, each with a .top and the restart file")
+    parser.add_argument("--restart", default="relax_012.re",
+                        help="restart file name inside each folder")
+    parser.add_argument("--output", default="minim.pdb", help="PDB name inside each folder")
+    parser.add_argument("--top", help="topology of a single conversion")
+    parser.add_argument("--re", help="restart file of a single conversion")
+    parser.add_argument("-o", help="output PDB of a single conversion")
+    parser.add_argument("--lib", action="append", help="library file (repeatable)")
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    residues = read_lib_files(args.lib or DEFAULT_LIBS)
+    tasks = []
+    if args.top or args.re:
+        if not (args.top and args.re and args.o):
+            parser.error("--top, --re and -o go together")
+        tasks.append((args.top, args.re, args.o, residues))
+    for folder in args.folders:
+        task = folder_task(folder, args.restart, args.output, residues)
+        if task is None:
+            print(f"No .top file found in {folder}, skipping")
+        elif not os.path.exists(task[1]):
+            print(f"No {args.restart} in {folder}, skipping")
+        else:
+            tasks.append(task)
+    if not tasks:
+        print("Nothing to convert")
+        sys.exit(1)
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(_convert, tasks))
+
+    failed = [r for r in results if r[1] == "failed"]
+    for output, status, message in results:
+        print(f"{output:50s} {status:7s} {message}")
+    if failed:
+        print(f"\n{len(failed)} of {len(results)} conversions failed")
+        sys.exit(1)
+    print(f"\nAll {len(results)} PDB files written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Stand-ins for qprep5, qdyn5 and the Qtools scripts, for running pipeline.py
+on a machine without Q.
+
+Every stand-in takes the command line of the program it replaces and writes
+files of the right names and shape in a fraction of a second:
+
+    qprep5 X.inp          writepdb: the readpdb structure; writetop: the WT
+                          topology (structures/LMRR_WT2_solvated.top)
+    qdyn5 X.inp           [files] final: a restart of zeros with the topology's
+                          atom count; [files] energy: an empty .en file
+    q_genrelax.py         --outdir with the topology and relax_001..012.inp
+    q_genfeps.py          --prefix000.. folders, each with equil_000.inp and
+                          one fep_NNN.inp per frame
+    q_mapper.py           one line per --dirs folder with its .en file count
+    q_analysefeps.py      one line per folder
+    make_fep              a copy of input/fep/LMRR_WT4.fep under the
+                          batch_make_fep.py output name
+
+The results are only good for checking the plumbing (file names,
+dependencies, reruns), not the chemistry.
+
+Usage:
+    python stand_ins.py PROGRAM [arguments of PROGRAM]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+sys.path.insert(0, os.path.join(ROOT, "input", "fep"))
+from restart_to_pdb import write_restart
+
+TEMPLATE_TOP = os.path.join(ROOT, "structures", "LMRR_WT2_solvated.top")
+TEMPLATE_FEP = os.path.join(ROOT, "input", "fep", "LMRR_WT4.fep")
+RELAX_STEPS = 12
+
+
+def _inp_files(inp_file):
+    """{keyword: file name} of the [files] section of a Qdyn input."""
+    files, section = {}, None
+    with open(inp_file, 'r') as f:
+        for line in f:
+            fields = line.split('#')[0].split()
+            if fields and fields[0].startswith('['):
+                section = fields[0]
+            elif section == "[files]" and len(fields) == 2:
+                files[fields[0]] = fields[1]
+    return files
+
+
+def _qdyn_input(filename, topology, final, energy=None):
+    with open(filename, 'w') as f:
+        f.write("[files]\n")
+        f.write(f"topology    {topology}\n")
+        f.write(f"final       {final}\n")
+        if energy:
+            f.write(f"energy      {energy}\n")
+
+
+def _n_atoms(top_file):
+    with open(top_file, 'r') as f:
+        for line in f:
+            if "Total no. of atoms" in line:
+                return int(line.split()[0])
+    raise ValueError(f"{top_file}: no atom count")
+
+
+def qprep5(argv):
+    commands = []
+    with open(argv[0], 'r') as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                commands.append((fields[0], fields[1:]))
+    pdb = dict(commands).get("readpdb")
+    for command, args in commands:
+        if command == "writepdb":
+            shutil.copyfile(pdb[0], args[0])
+        elif command == "writetop":
+            shutil.copyfile(TEMPLATE_TOP, args[0])
+    print(f"stand-in qprep5: {len(commands)} commands")
+
+
+def qdyn5(argv):
+    files = _inp_files(argv[0])
+    natom = _n_atoms(files["topology"])
+    write_restart(files["final"], np.zeros((natom, 3)), velocities=np.zeros((natom, 3)))
+    if "energy" in files:
+        open(files["energy"], 'w').close()
+    print(f"stand-in qdyn5: {argv[0]}, {natom} atoms")
+
+
+def genrelax(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("proc")
+    parser.add_argument("--top", required=True)
+    parser.add_argument("--outdir", required=True)
+    args, _ = parser.parse_known_args(argv)
+    os.makedirs(args.outdir)
+    top = os.path.basename(args.top)
+    shutil.copyfile(args.top, os.path.join(args.outdir, top))
+    for step in range(1, RELAX_STEPS + 1):
+        _qdyn_input(os.path.join(args.outdir, f"relax_{step:03d}.inp"), top,
+                    f"relax_{step:03d}.re")
+
+
+def genfeps(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("proc")
+    parser.add_argument("relax_input")
+    parser.add_argument("restraint")
+    parser.add_argument("--pdb", required=True)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=51)
+    parser.add_argument("--prefix", default="replica")
+    args, _ = parser.parse_known_args(argv)
+    top = os.path.abspath(_inp_files(args.relax_input)["topology"])
+    for i in range(args.repeats):
+        folder = f"{args.prefix}{i:03d}"
+        os.makedirs(folder)
+        _qdyn_input(os.path.join(folder, "equil_000.inp"), top, "equil_000.re")
+        for frame in range(args.frames):
+            _qdyn_input(os.path.join(folder, f"fep_{frame:03d}.inp"), top,
+                        f"fep_{frame:03d}.re", f"fep_{frame:03d}.en")
+
+
+def mapper(argv):
+    dirs = argv[argv.index("--dirs") + 1:] if "--dirs" in argv else []
+    for folder in dirs:
+        n = len([f for f in os.listdir(folder) if f.endswith(".en")])
+        print(f"{folder}: {n} energy files, dG# 0.00 dG0 0.00 (stand-in)")
+
+
+def analysefeps(argv):
+    for folder in argv:
+        print(f"{folder}: ok (stand-in)")
+
+
+def make_fep(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("-o", "--output", required=True)
+    args, _ = parser.parse_known_args(argv)
+    from batch_make_fep import fep_name
+    os.makedirs(args.output, exist_ok=True)
+    for pdb in args.paths:
+        shutil.copyfile(TEMPLATE_FEP, os.path.join(args.output, fep_name(pdb)))
+
+
+PROGRAMS = {"qprep5": qprep5, "qdyn5": qdyn5, "q_genrelax": genrelax, "q_genfeps": genfeps,
+            "q_mapper": mapper, "q_analysefeps": analysefeps, "make_fep": make_fep}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in PROGRAMS:
+        print(f"Usage: stand_ins.py {{{','.join(PROGRAMS)}}} [arguments]")
+        sys.exit(2)
+    try:
+        PROGRAMS[sys.argv[1]](sys.argv[2:])
+    except (OSError, KeyError, ValueError) as e:
+        print(f"stand-in {sys.argv[1]} failed: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
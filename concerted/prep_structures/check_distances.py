@@ -1,6 +1,33 @@
-from Bio.PDB import PDBParser
-import numpy as np
+"""
+Residue - ligand distances.
+
+Single mode (default) measures CA -> MPO N1 for a list of target residues in
+one structure and writes residue_distances.txt next to it.
+
+Batch mode measures every residue of every structure in one go:
+
+    python check_distances.py --batch structures/ mutations/ results/ --ligand IMI
+
+For each structure the CA, CB and side-chain centroid (heavy atoms beyond CB;
+CB/CA for Ala/Gly) of all residues are gathered into one (residues x 3 x 3) array
+and the full residue x ligand-atom distance matrix is a single broadcast.
+Structures are processed in parallel and combined into one CSV table with
+one row per (structure, residue, ligand atom). Directories are searched
+recursively, so minimised minim.pdb files in per-mutant folders are found.
+"""
+
+import argparse
+import csv
+import glob
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+from pdb_arrays import BACKBONE, heavy_mask, read_pdb, residue_index, residue_table
 
 # ------------ INPUTS ----------------
 input_pdb = r"D:\PhD_Thesis\LmrR_EVB\structures\6i8n.pdb"
@@ -20,9 +47,12 @@ ligand_resname = "MPO"  # Ligand residue name in PDB
 ligand_atom_name = "N1"  # Atom in MPO to measure from
 # -----------------------------------
 
-# Load PDB structure
-parser = PDBParser(QUIET=True)
-structure = parser.get_structure("protein", input_pdb)
+# Points measured per residue in batch mode
+RESIDUE_POINTS = ("CA", "CB", "SC")
+
+# Residues that are never treated as protein in batch mode
+NON_PROTEIN = ("HOH", "WAT", "IMI", "IND", "HO2", "PAF", "PRD", "MPO", "UNL")
+
 
 # Function to find MPO N1 atom coordinates
 def get_mpo_n1_coord(structure):
@@ -35,42 +65,186 @@ def get_mpo_n1_coord(structure):
                             return atom.coord
     return None
 
-# Get MPO N1 coordinate
-mpo_coord = get_mpo_n1_coord(structure)
-if mpo_coord is None:
-    raise ValueError(f"Could not find atom {ligand_atom_name} in residue {ligand_resname} in the PDB!")
 
 # Function to calculate Euclidean distance
 def distance(coord1, coord2):
     return np.linalg.norm(coord1 - coord2)
 
-# Collect distances
-distances = []
 
-for model in structure:
-    for chain in model:
-        if chain.id == chain_id:
-            for residue in chain:
-                resname = residue.get_resname().strip()
-                resnum = residue.get_id()[1]
-                for target_name, target_num in target_residues:
-                    if resnum == target_num:
-                        # Use CA atom for the residue
-                        if "CA" in residue:
-                            ca_coord = residue["CA"].coord
-                            dist = distance(mpo_coord, ca_coord)
-                            distances.append((f"{resname}{resnum}", round(dist, 3)))
-
-# Save results to a text file
-output_file = os.path.join(os.path.dirname(input_pdb), "residue_distances.txt")
-with open(output_file, "w") as f:
-    f.write("Residue\tDistance_from_MPO_N1(Å)\n")
+def single_mode(input_pdb):
+    from Bio.PDB import PDBParser
+
+    # Load PDB structure
+    parser = PDBParser(QUIET=True)
+    structure = parser.get_structure("protein", input_pdb)
+
+    # Get MPO N1 coordinate
+    mpo_coord = get_mpo_n1_coord(structure)
+    if mpo_coord is None:
+        raise ValueError(f"Could not find atom {ligand_atom_name} in residue {ligand_resname} in the PDB!")
+
+    # Collect distances
+    distances = []
+
+    for model in structure:
+        for chain in model:
+            if chain.id == chain_id:
+                for residue in chain:
+                    resname = residue.get_resname().strip()
+                    resnum = residue.get_id()[1]
+                    for target_name, target_num in target_residues:
+                        if resnum == target_num:
+                            # Use CA atom for the residue
+                            if "CA" in residue:
+                                ca_coord = residue["CA"].coord
+                                dist = distance(mpo_coord, ca_coord)
+                                distances.append((f"{resname}{resnum}", round(dist, 3)))
+
+    # Save results to a text file
+    output_file = os.path.join(os.path.dirname(input_pdb), "residue_distances.txt")
+    with open(output_file, "w") as f:
+        f.write("Residue\tDistance_from_MPO_N1(Å)\n")
+        for res, dist in distances:
+            f.write(f"{res}\t{dist}\n")
+
+    # Print to terminal
+    print("Distances from MPO N1:")
     for res, dist in distances:
-        f.write(f"{res}\t{dist}\n")
+        print(f"{res} -> {dist} Å")
+
+    print(f"\nSaved to: {output_file}")
+
+
+def residue_points(atoms):
+    """
+    (residue table, points) for the protein residues of a structure, points
+    being an (R, 3, 3) array of CA, CB and side-chain centroid coordinates
+    (NaN where a residue has no such atom).
+    """
+    atoms = {key: value[heavy_mask(atoms)] for key, value in atoms.items()
+             if key not in ("conflict_lines", "ter_after")}
+    res = residue_index(atoms)
+    table = residue_table(atoms)
+    n_res = len(table["first_atom"])
+
+    points = np.full((n_res, len(RESIDUE_POINTS), 3), np.nan)
+    for k, name in enumerate(("CA", "CB")):
+        sel = atoms["name"] == name
+        points[res[sel], k] = atoms["xyz"][sel]
+
+    side = ~np.isin(atoms["name"], BACKBONE + ("CB",) + ("OXT",))
+    counts = np.bincount(res[side], minlength=n_res)
+    sums = np.stack([np.bincount(res[side], weights=atoms["xyz"][side, d], minlength=n_res)
+                     for d in range(3)], axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        points[:, 2] = sums / counts[:, None]
+    # Gly (and Ala) have no atoms beyond CB; fall back to CB, then CA
+    points[:, 2] = np.where(counts[:, None] > 0, points[:, 2],
+                            np.where(np.isnan(points[:, 1]), points[:, 0], points[:, 1]))
+
+    protein = ~np.isnan(points[:, 0, 0]) & ~np.isin(table["resname"], NON_PROTEIN)
+    table = {key: value[protein] for key, value in table.items()}
+    return table, points[protein]
+
+
+def ligand_atoms(atoms, ligands):
+    """(RESN.NAME labels, xyz) of the heavy atoms of the ligand residues."""
+    sel = np.isin(atoms["resname"], ligands) & heavy_mask(atoms)
+    labels = np.char.add(np.char.add(atoms["resname"][sel], '.'), atoms["name"][sel])
+    return labels, atoms["xyz"][sel]
+
+
+def distance_table(filename, ligands, cutoff=None):
+    """
+    All residue x ligand-atom distances of one structure as columns
+    (chain, resseq, resname, ligand_atom, distances (rows x 3)).
+    """
+    atoms = read_pdb(filename)
+    table, points = residue_points(atoms)
+    labels, lig_xyz = ligand_atoms(atoms, ligands)
+
+    # (R, 3, 1, 3) - (1, 1, L, 3) -> (R, 3, L)
+    dist = np.linalg.norm(points[:, :, None, :] - lig_xyz[None, None, :, :], axis=-1)
+
+    n_res, n_lig = len(table["resseq"]), len(labels)
+    res = np.repeat(np.arange(n_res), n_lig)
+    dist = dist.transpose(0, 2, 1).reshape(-1, len(RESIDUE_POINTS))
+    keep = np.ones(len(res), dtype=bool)
+    if cutoff is not None:
+        keep = (np.nan_to_num(dist, nan=np.inf) <= cutoff).any(axis=1)
+    return filename, {
+        "chain": table["chain"][res[keep]],
+        "resseq": table["resseq"][res[keep]],
+        "resname": table["resname"][res[keep]],
+        "ligand_atom": np.tile(labels, n_res)[keep],
+        "distances": dist[keep],
+    }
+
+
+def _distance_table(args):
+    return distance_table(*args)
+
+
+def find_structures(paths):
+    """PDB files given directly or found recursively under directories."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, "**", "*.pdb"), recursive=True)))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def batch_mode(paths, ligands, output, cutoff=None, jobs=None):
+    filenames = find_structures(paths)
+    if not filenames:
+        print("No PDB files found")
+        sys.exit(1)
+
+    common = os.path.commonpath([os.path.abspath(f) for f in filenames])
+    if os.path.isfile(common):
+        common = os.path.dirname(common)
+
+    n_rows = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool, open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["structure", "chain", "resseq", "resname", "ligand_atom"] +
+                        [f"d_{point}" for point in RESIDUE_POINTS])
+        tasks = [(name, tuple(ligands), cutoff) for name in filenames]
+        for filename, columns in pool.map(_distance_table, tasks):
+            name = os.path.relpath(os.path.abspath(filename), common)
+            if not len(columns["resseq"]):
+                print(f"{name}: no {'/'.join(ligands)} atoms within range, skipped")
+                continue
+            distances = np.char.mod("%.3f", columns["distances"])
+            distances[np.isnan(columns["distances"])] = ""
+            writer.writerows(zip([name] * len(columns["resseq"]), columns["chain"],
+                                 columns["resseq"].tolist(), columns["resname"],
+                                 columns["ligand_atom"], *distances.T))
+            n_rows += len(columns["resseq"])
+
+    print(f"{len(filenames)} structures, {n_rows} rows written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Residue - ligand distances")
+    parser.add_argument("--pdb", default=input_pdb, help="structure for single mode")
+    parser.add_argument("--batch", nargs="+", metavar="PATH",
+                        help="PDB files or directories for batch mode")
+    parser.add_argument("--ligand", action="append",
+                        help="ligand residue name(s) for batch mode (default: IMI)")
+    parser.add_argument("--cutoff", type=float,
+                        help="batch mode: keep rows with any distance <= cutoff (Å)")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default="residue_ligand_distances.csv")
+    args = parser.parse_args()
+
+    if args.batch:
+        batch_mode(args.batch, args.ligand or ["IMI"], args.output, args.cutoff, args.jobs)
+    else:
+        single_mode(args.pdb)
 
-# Print to terminal
-print("Distances from MPO N1:")
-for res, dist in distances:
-    print(f"{res} -> {dist} Å")
 
-print(f"\nSaved to: {output_file}")
+if __name__ == "__main__":
+    main()
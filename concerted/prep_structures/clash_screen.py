@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+KD-tree clash and contact screening for generated mutants.
+
+For every structure one cKDTree is built over the heavy atoms and all atom
+pairs closer than the largest possible clash distance are pulled out in a
+single query. The van der Waals overlap of each pair is
+
+    overlap = r_i + r_j - d_ij   (- 0.4 Å for N/O pairs that can H-bond)
+
+and pairs with overlap >= 0.6 Å are clashes, >= -0.4 Å contacts (the usual
+Chimera criteria). Pairs inside one residue are skipped, and so are pairs
+across a peptide link that are at most three bonds apart (1-2, 1-3 and 1-4,
+e.g. C-N, CA-N, CB-N or C-CD of proline). Bond counts come from the
+residue library connectivity (--lib, default qoplsaa.lib and LMRR.lib):
+bonds to the residue's tail atom, the link, and bonds from the next
+residue's head atom.
+
+Mutated residues are found by comparing residue names with the WT
+structure, so the report lists the worst overlaps of each mutated side
+chain and whether they involve the substrate complex (IMI/IND/HO2/PAF/PRD,
+or the HETATMs of --complex, e.g. LmrR_paf_substrates_concerted.pdb, for
+structures that carry no substrate themselves).
+
+Usage:
+    python clash_screen.py [pdb_or_dir ...] [--wt ../structures/LMRR_WT2.pdb]
+                           [--complex ligand.pdb] [--csv clashes.csv] [--reject 1.0]
+                           [--lib qoplsaa.lib --lib LMRR.lib]
+"""
+
+import argparse
+import csv
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+sys.path.insert(0, os.path.join(HERE, "..", "parameters"))
+from pdb_arrays import heavy_mask, list_pdb_files, read_pdb, residue_index, residue_table, select
+from qlib import read_lib_files
+from validate_structures import DEFAULT_LIBS
+
+DEFAULT_WT = os.path.join(HERE, "..", "structures", "LMRR_WT2.pdb")
+
+# Bondi van der Waals radii (Å)
+VDW_RADII = {'C': 1.70, 'N': 1.55, 'O': 1.52, 'S': 1.80, 'P': 1.80, 'F': 1.47,
+             'CL': 1.75, 'BR': 1.85, 'I': 1.98}
+DEFAULT_RADIUS = 1.70
+
+CLASH_OVERLAP = 0.6      # Å
+CONTACT_OVERLAP = -0.4   # Å
+HBOND_ALLOWANCE = 0.4    # Å, subtracted for N/O donor-acceptor pairs
+LINK_EXCLUSION = 3       # bonds; pairs up to 1-4 across a peptide link are skipped
+
+SUBSTRATE_RESIDUES = ("IMI", "IND", "HO2", "PAF", "PRD", "UNL")
+WATER_RESIDUES = ("HOH", "WAT")
+HISTIDINES = ("HIS", "HID", "HIE", "HIP")
+
+_wt_residues = None
+_complex = None
+_links = None
+
+
+def vdw_radii(elements):
+    radii = np.full(len(elements), DEFAULT_RADIUS)
+    for element, radius in VDW_RADII.items():
+        radii[np.char.upper(elements) == element] = radius
+    return radii
+
+
+def _bond_counts(bonds, start):
+    """{atom: number of bonds from start} within one residue (breadth-first)."""
+    neighbours = {}
+    for a, b in bonds:
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+    counts = {start: 0}
+    queue = deque([start])
+    while queue:
+        atom = queue.popleft()
+        for other in neighbours.get(atom, ()):
+            if other not in counts:
+                counts[other] = counts[atom] + 1
+                queue.append(other)
+    return counts
+
+
+def link_distances(residues):
+    """
+    {resname: (bonds to head atom, bonds to tail atom)} for every polymer
+    residue of a read_lib_files() dictionary; each is {atom name: count}.
+    """
+    links = {}
+    for resname, entry in residues.items():
+        connections = entry["connections"]
+        if "head" in connections and "tail" in connections:
+            links[resname] = (_bond_counts(entry["bonds"], connections["head"]),
+                              _bond_counts(entry["bonds"], connections["tail"]))
+    # PDB files may use the generic histidine name
+    if "HID" in links:
+        for name in HISTIDINES:
+            links.setdefault(name, links["HID"])
+    return links
+
+
+def residue_list(atoms):
+    """[(chain, resseq, resname)] in file order, one entry per residue."""
+    table = residue_table(atoms)
+    return list(zip(table["chain"].tolist(), table["resseq"].tolist(),
+                    table["resname"].tolist()))
+
+
+def find_mutations(atoms, wt_residues):
+    """
+    Residues whose name differs from WT: [(chain, resseq, wt_name, mut_name)].
+    Residues are matched by position when both files have the same number of
+    residues (Q renumbers chains consecutively, PyMOL output restarts them),
+    otherwise by (chain, resseq).
+    """
+    residues = residue_list(atoms)
+    if len(residues) == len(wt_residues):
+        pairs = zip(residues, (name for _, _, name in wt_residues))
+    else:
+        wt_by_key = {(c, r): name for c, r, name in wt_residues}
+        pairs = ((res, wt_by_key.get(res[:2])) for res in residues)
+
+    mutations = []
+    for (chain, resseq, name), wt_name in pairs:
+        if wt_name is None or wt_name == name:
+            continue
+        if wt_name in HISTIDINES and name in HISTIDINES:
+            continue
+        mutations.append((chain, resseq, wt_name, name))
+    return mutations
+
+
+def merge_complex(atoms, complex_atoms):
+    """
+    Append the substrate HETATMs of a complex file to a structure that has
+    no substrate residues of its own (e.g. an apo mutant).
+    """
+    if complex_atoms is None or np.isin(atoms["resname"], SUBSTRATE_RESIDUES).any():
+        return atoms
+    keep = (~np.isin(complex_atoms["resname"], WATER_RESIDUES) &
+            (complex_atoms["record"] == "HETATM"))
+    if not keep.any():
+        return atoms
+    extra = select(complex_atoms, keep)
+    # New residue numbers after the structure's last residue
+    extra["resseq"] = extra["resseq"] - extra["resseq"].min() + atoms["resseq"].max() + 1
+    return {key: np.concatenate([atoms[key], extra[key]])
+            for key in extra if key in atoms}
+
+
+def _link_bonds(atoms, first, second, links):
+    """
+    Bonds between atoms first[k] and second[k] (second in the residue after
+    first's) through the peptide link; a large number when either residue
+    has no library entry or the atom is not in it.
+    """
+    far = LINK_EXCLUSION + 1
+    bonds = np.full(len(first), far)
+    for k, (a, b) in enumerate(zip(first, second)):
+        lower, upper = links.get(atoms["resname"][a]), links.get(atoms["resname"][b])
+        if lower and upper:
+            bonds[k] = (lower[1].get(atoms["name"][a], far) + 1 +
+                        upper[0].get(atoms["name"][b], far))
+    return bonds
+
+
+def overlapping_pairs(atoms, links):
+    """
+    All non-bonded heavy-atom pairs with overlap >= CONTACT_OVERLAP; links
+    is link_distances() of the residue library. Returns (i, j, distance,
+    overlap) arrays into atoms.
+    """
+    radii = vdw_radii(atoms["element"])
+    cutoff = 2 * radii.max() - CONTACT_OVERLAP
+    tree = cKDTree(atoms["xyz"])
+    pairs = tree.query_pairs(cutoff, output_type='ndarray')
+    if len(pairs) == 0:
+        empty = np.zeros(0)
+        return empty.astype(int), empty.astype(int), empty, empty
+    i, j = pairs[:, 0], pairs[:, 1]
+
+    res = residue_index(atoms)
+    bonded = res[i] == res[j]
+    # Sequence neighbours: count the bonds through the peptide link
+    adjacent = np.flatnonzero((np.abs(res[i] - res[j]) == 1) &
+                              (atoms["chain"][i] == atoms["chain"][j]))
+    first = np.where(res[i] < res[j], i, j)[adjacent]
+    second = np.where(res[i] < res[j], j, i)[adjacent]
+    bonded[adjacent] = _link_bonds(atoms, first, second, links) <= LINK_EXCLUSION
+    i, j = i[~bonded], j[~bonded]
+
+    d = np.linalg.norm(atoms["xyz"][i] - atoms["xyz"][j], axis=1)
+    polar = np.isin(atoms["element"], ('N', 'O'))
+    overlap = radii[i] + radii[j] - d - np.where(polar[i] & polar[j], HBOND_ALLOWANCE, 0.0)
+    keep = overlap >= CONTACT_OVERLAP
+    return i[keep], j[keep], d[keep], overlap[keep]
+
+
+def _atom_label(atoms, k):
+    return f"{atoms['resname'][k]}{atoms['resseq'][k]}.{atoms['name'][k]}"
+
+
+def screen_structure(filename, wt_residues, links, complex_atoms=None, top=5, residues=None):
+    """Screen one structure; returns a summary dict with per-mutation details."""
+    atoms = read_pdb(filename)
+    mutations = find_mutations(atoms, wt_residues) if residues is None else [
+        (c, r, "", atoms["resname"][(atoms["resseq"] == r) & (atoms["chain"] == c)][0])
+        for c, r in residues]
+    atoms = merge_complex(atoms, complex_atoms)
+    atoms = select(atoms, heavy_mask(atoms) & ~np.isin(atoms["resname"], WATER_RESIDUES))
+
+    i, j, d, overlap = overlapping_pairs(atoms, links)
+    clash = overlap >= CLASH_OVERLAP
+    substrate = np.isin(atoms["resname"], SUBSTRATE_RESIDUES)
+
+    summary = {
+        "file": filename,
+        "n_clashes": int(clash.sum()),
+        "worst_overlap": float(overlap.max()) if len(overlap) else float("nan"),
+        "substrate_clashes": int((clash & (substrate[i] | substrate[j])).sum()),
+        "mutations": [],
+    }
+
+    for chain, resseq, wt_name, mut_name in mutations:
+        in_res = (atoms["resseq"] == resseq) & (atoms["chain"] == chain)
+        involved = in_res[i] | in_res[j]
+        order = np.flatnonzero(involved)[np.argsort(-overlap[involved])]
+        worst = []
+        for k in order[:top]:
+            own, other = (i[k], j[k]) if in_res[i[k]] else (j[k], i[k])
+            worst.append({"atom": _atom_label(atoms, own), "partner": _atom_label(atoms, other),
+                          "distance": float(d[k]), "overlap": float(overlap[k]),
+                          "substrate": bool(substrate[other])})
+        summary["mutations"].append({
+            "residue": f"{wt_name}{resseq}{mut_name}" if wt_name else f"{mut_name}{resseq}",
+            "chain": chain,
+            "n_clashes": int((involved & clash).sum()),
+            "n_contacts": int(involved.sum()),
+            "worst": worst,
+        })
+    return summary
+
+
+def _init_worker(wt_residues, links, complex_atoms):
+    global _wt_residues, _links, _complex
+    _wt_residues, _links, _complex = wt_residues, links, complex_atoms
+
+
+def _screen(filename):
+    return screen_structure(filename, _wt_residues, _links, _complex)
+
+
+def screen_library(filenames, wt_pdb=DEFAULT_WT, complex_pdb=None, jobs=None,
+                   lib_files=DEFAULT_LIBS):
+    """Screen a list of structures in parallel worker processes."""
+    wt_residues = residue_list(read_pdb(wt_pdb))
+    links = link_distances(read_lib_files(lib_files))
+    complex_atoms = read_pdb(complex_pdb) if complex_pdb else None
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(wt_residues, links, complex_atoms)) as pool:
+        return list(pool.map(_screen, filenames))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clash/contact screening of mutant structures")
+    parser.add_argument("paths", nargs="*", default=[os.path.join(HERE, "mutations")],
+                        help="PDB files or directories (default: mutations/)")
+    parser.add_argument("--wt", default=DEFAULT_WT, help="WT structure used to find mutations")
+    parser.add_argument("--complex", help="PDB with substrate HETATMs to add (e.g. "
+                                          "LmrR_paf_substrates_concerted.pdb)")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--csv", help="write per-mutation worst overlaps to CSV")
+    parser.add_argument("--reject", type=float, default=1.0,
+                        help="reject structures whose mutated residues overlap by more (Å)")
+    parser.add_argument("--lib", action="append", help="library file for the bond counts "
+                                                       "(repeatable)")
+    args = parser.parse_args()
+
+    filenames = [f for path in args.paths for f in list_pdb_files(path)]
+    results = screen_library(filenames, args.wt, args.complex, args.jobs,
+                             args.lib or DEFAULT_LIBS)
+
+    rejected = []
+    for result in results:
+        name = os.path.basename(result["file"])
+        print(f"{name:40s} clashes {result['n_clashes']:4d}  "
+              f"(substrate {result['substrate_clashes']:3d})  worst {result['worst_overlap']:5.2f} Å")
+        for mutation in result["mutations"]:
+            worst = mutation["worst"][0] if mutation["worst"] else None
+            print(f"    {mutation['residue']:10s} {mutation['n_clashes']:3d} clashes "
+                  f"{mutation['n_contacts']:4d} contacts", end="")
+            if worst:
+                print(f"   worst {worst['atom']} - {worst['partner']} "
+                      f"d={worst['distance']:.2f} overlap={worst['overlap']:.2f}"
+                      f"{' [substrate]' if worst['substrate'] else ''}")
+                if worst["overlap"] > args.reject:
+                    rejected.append(name)
+            else:
+                print()
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "mutation", "chain", "rank", "atom", "partner",
+                             "distance", "overlap", "substrate"])
+            for result in results:
+                for mutation in result["mutations"]:
+                    for rank, w in enumerate(mutation["worst"], 1):
+                        writer.writerow([result["file"], mutation["residue"], mutation["chain"],
+                                         rank, w["atom"], w["partner"], f"{w['distance']:.3f}",
+                                         f"{w['overlap']:.3f}", int(w["substrate"])])
+        print(f"\nWorst overlaps written to {args.csv}")
+
+    rejected = sorted(set(rejected))
+    print(f"\n{len(rejected)} structure(s) rejected (mutated residue overlap > {args.reject} Å)")
+    for name in rejected:
+        print(f"  {name}")
+    sys.exit(1 if rejected else 0)
+
+
+if __name__ == "__main__":
+    main()
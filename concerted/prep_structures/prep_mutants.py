@@ -9,6 +9,9 @@ import os
 import sys
 from pathlib import Path
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prep_scripts"))
+import artifact_cache
+
 def read_pdb_file(filename):
     """Read PDB file and return clean lines."""
     try:
@@ -161,26 +164,37 @@ def create_mutation_files(input_pdb, mutation_dict):
     print("-" * 50)
     
     # Create mutation for each residue
+    cached = 0
     for residue_num, target_aa in sorted(mutation_dict.items()):
         # Get original residue name
         original_res = get_residue_name(original_lines, residue_num)
         
-        # Create mutation
-        mutated_lines = mutate_residue(original_lines, residue_num, target_aa)
-        
         # Generate output filename
         base_name = os.path.splitext(os.path.basename(input_pdb))[0]
         aa_code = {'ALA': 'A', 'LEU': 'L', 'GLU': 'E'}[target_aa]
         output_filename = f"{output_dir}/{base_name}_{original_res}{residue_num}{aa_code}.pdb"
         
+        # Mutants are keyed on (WT hash, mutation spec, this script)
+        key = artifact_cache.mutant_key(input_pdb, f"{residue_num}:{target_aa}",
+                                        extra_files=[os.path.abspath(__file__)])
+        if artifact_cache.fetch(key, [output_filename]):
+            print(f"Cached:  {output_filename} ({original_res}{residue_num} → {target_aa})")
+            cached += 1
+            continue
+        
+        # Create mutation
+        mutated_lines = mutate_residue(original_lines, residue_num, target_aa)
+        
         # Write mutated PDB
         write_pdb_file(mutated_lines, output_filename)
+        artifact_cache.put(key, [output_filename])
         
         atom_count = len([l for l in mutated_lines if l.startswith('ATOM')])
         print(f"Created: {output_filename} ({original_res}{residue_num} → {target_aa}, {atom_count} atoms)")
     
     print("-" * 50)
-    print(f"Successfully created {len(mutation_dict)} mutation files in {output_dir}/")
+    print(f"Successfully created {len(mutation_dict)} mutation files in {output_dir}/ "
+          f"({cached} reused from cache)")
     print("\nNote: All HIS residues converted to HID (delta-protonated) for OPLS")
 
 def main():
@@ -0,0 +1,47 @@
+"""Regression tests for validate_structures.validate_atoms (run with pytest)."""
+
+import os
+
+from validate_structures import DEFAULT_LIBS, LibraryIndex, validate_atoms
+from pdb_arrays import format_atom_line, parse_pdb_lines
+from qlib import read_lib_files
+
+# ALA atoms along x; C of residue i is 1.33 Å from N of residue i+1
+ALA = (("N", 0.0), ("HN", 0.2), ("CA", 1.0), ("HA", 1.1), ("CB", 1.2), ("HB1", 1.3),
+       ("HB2", 1.4), ("HB3", 1.5), ("C", 2.47), ("O", 2.6))
+RISE = 3.8
+
+
+def _residue(resseq, chain="A"):
+    return [format_atom_line(0, name, "ALA", chain, resseq, (resseq - 1) * RISE + x, 0.0, 0.0)
+            for name, x in ALA]
+
+
+def _issues(lines):
+    lib = LibraryIndex(read_lib_files([os.path.abspath(f) for f in DEFAULT_LIBS]))
+    issues, _ = validate_atoms(parse_pdb_lines(lines), lib)
+    return issues
+
+
+def test_clean_chain():
+    assert _issues(_residue(1) + _residue(2) + _residue(3)) == []
+
+
+def test_non_adjacent_duplicate_residue():
+    # A second copy of residue 1 after residue 3: every atom is a duplicate,
+    # and the jump 3 -> 1 is not a peptide bond
+    issues = _issues(_residue(1) + _residue(2) + _residue(3) + _residue(1))
+    duplicates = [i for i in issues if i["kind"] == "duplicate_atom"]
+    assert len(duplicates) == len(ALA)
+    assert {i["residue"] for i in duplicates} == {"ALA1"}
+    assert not [i for i in issues if i["kind"] == "chain_break"]
+
+
+def test_same_number_other_chain_is_not_duplicate():
+    assert not _issues(_residue(1) + ["TER\n"] + _residue(1, chain="B"))
+
+
+def test_chain_break():
+    lines = _residue(1) + [line[:30] + f"{float(line[30:38]) + 2.0:8.3f}" + line[38:]
+                           for line in _residue(2)]
+    assert [i["kind"] for i in _issues(lines)] == ["chain_break"]
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+One-pass structural validator for a whole library of (mutant) PDB files.
+
+Every file is checked against the Q residue definitions in the .lib files
+before it is handed to qprep5:
+
+  - git conflict markers (<<<<<<< ======= >>>>>>>) left in the file
+  - duplicate atoms (same chain, residue number, insertion code and atom
+    name, also when the copies are far apart in the file)
+  - residues that are not defined in any .lib file
+  - atoms that are not part of their residue's library entry
+  - missing backbone / side-chain heavy atoms and missing hydrogens
+  - chain breaks (C(i)-N(i+1) > 2.0 Å between sequence neighbours with no
+    TER or chain change between)
+  - residues whose charge is not an integer once qprep5 has rebuilt the
+    missing hydrogens (i.e. incomplete heavy-atom side chains)
+
+Missing hydrogens and chain breaks are reported as warnings; everything
+else fails the structure.
+
+The checks run on whole-file arrays (see structures/pdb_arrays.py) and the
+files are spread over a process pool, so a directory of mutants is
+validated in a few seconds.
+
+Usage:
+    python validate_structures.py [pdb_or_dir ...] [--lib file.lib ...] [--csv report.csv]
+    python validate_structures.py mutations/ --list-failed     # for prep.sh
+"""
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "structures"))
+sys.path.insert(0, os.path.join(HERE, "..", "parameters"))
+from pdb_arrays import BACKBONE, read_pdb, residue_index, residue_table, list_pdb_files
+from qlib import read_lib_files
+
+DEFAULT_LIBS = [os.path.join(HERE, "..", "parameters", "qoplsaa.lib"),
+                os.path.join(HERE, "..", "parameters", "LMRR.lib")]
+
+PEPTIDE_BOND_MAX = 2.0   # Å, longer C-N distances are reported as chain breaks
+CHARGE_TOLERANCE = 1e-3  # e, deviation from an integer residue charge
+
+# Issue kinds that make a structure unusable for qprep5
+ERROR_KINDS = {"conflict_marker", "duplicate_atom", "unknown_residue",
+               "unknown_atom", "missing_backbone", "missing_sidechain",
+               "noninteger_charge", "empty", "unreadable"}
+
+_lib_index = None
+
+
+class LibraryIndex:
+    """Flat, array-based view of the residue library for vectorized lookups."""
+
+    def __init__(self, residues):
+        self.resnames = np.array(sorted(residues))
+        names, charges, offsets, counts = [], [], [], []
+        self.polymer = np.zeros(len(self.resnames), dtype=bool)
+        for i, resname in enumerate(self.resnames):
+            entry = residues[resname]
+            offsets.append(len(names))
+            counts.append(len(entry["atoms"]))
+            names.extend(name for name, _, _ in entry["atoms"])
+            charges.extend(charge for _, _, charge in entry["atoms"])
+            self.polymer[i] = "head" in entry["connections"] and "tail" in entry["connections"]
+        self.names = np.array(names)
+        self.charges = np.array(charges)
+        self.offsets = np.array(offsets)
+        self.counts = np.array(counts)
+        # "RES NAME" keys sorted for searchsorted lookups
+        keys = np.char.add(np.char.add(np.repeat(self.resnames, self.counts), ' '), self.names)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.key_charges = self.charges[order]
+
+    def residue_ids(self, resnames):
+        """Index into self.resnames for every name (-1 if undefined)."""
+        pos = np.searchsorted(self.resnames, resnames)
+        pos = np.clip(pos, 0, len(self.resnames) - 1)
+        return np.where(self.resnames[pos] == resnames, pos, -1)
+
+    def lookup(self, resnames, names):
+        """(found mask, charge) for every (resname, atom name) pair."""
+        keys = np.char.add(np.char.add(resnames, ' '), names)
+        pos = np.clip(np.searchsorted(self.keys, keys), 0, len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        return found, np.where(found, self.key_charges[pos], 0.0)
+
+
+def _init_worker(lib_index):
+    global _lib_index
+    _lib_index = lib_index
+
+
+def _issue(kind, residue="", detail=""):
+    return {"kind": kind, "residue": residue, "detail": detail}
+
+
+def _is_hydrogen(names):
+    return np.char.startswith(np.char.lstrip(names, '0123456789'), 'H')
+
+
+def _residue_ids(chain, resseq, icode):
+    """'chain resseq icode ' keys identifying a residue anywhere in the file."""
+    return np.char.add(np.char.add(np.char.add(np.char.add(chain, ' '), resseq.astype(str)),
+                                   ' '), np.char.add(icode, ' '))
+
+
+def validate_atoms(atoms, lib):
+    """
+    Run all checks on one parsed structure. Returns (issues, net charge),
+    the charge including the hydrogens qprep5 will rebuild.
+    """
+    issues = []
+
+    if len(atoms["conflict_lines"]):
+        issues.append(_issue("conflict_marker",
+                             detail=f"lines {atoms['conflict_lines'].tolist()}"))
+
+    n = len(atoms["name"])
+    if n == 0:
+        issues.append(_issue("empty", detail="no ATOM/HETATM records"))
+        return issues, 0.0
+
+    res = residue_index(atoms)
+    table = residue_table(atoms)
+    labels = np.char.add(table["resname"], table["resseq"].astype(str))
+
+    # Duplicate atoms: same chain, residue number, insertion code and atom
+    # name, wherever the copies are in the file
+    res_ids = _residue_ids(atoms["chain"], atoms["resseq"], atoms["icode"])
+    atom_keys = np.char.add(res_ids, atoms["name"])
+    _, inverse, counts = np.unique(atom_keys, return_inverse=True, return_counts=True)
+    for k in np.flatnonzero(counts > 1):
+        first = np.flatnonzero(inverse == k)[0]
+        issues.append(_issue("duplicate_atom", labels[res[first]],
+                             f"{atoms['name'][first]} x{counts[k]}"))
+
+    # Residues missing from the library
+    lib_res = lib.residue_ids(table["resname"])
+    for r in np.flatnonzero(lib_res < 0):
+        issues.append(_issue("unknown_residue", labels[r]))
+
+    # Atoms not in their residue's library entry
+    found, charges = lib.lookup(atoms["resname"], atoms["name"])
+    known_res = lib_res[res] >= 0
+    for i in np.flatnonzero(known_res & ~found):
+        issues.append(_issue("unknown_atom", labels[res[i]], atoms["name"][i]))
+
+    # Missing atoms: expand every known residue into its expected atom list
+    n_res = len(table["first_atom"])
+    known = np.flatnonzero(lib_res >= 0)
+    counts = lib.counts[lib_res[known]]
+    exp_res = np.repeat(known, counts)
+    starts = np.cumsum(counts) - counts
+    within = np.arange(counts.sum()) - np.repeat(starts, counts)
+    exp_atoms = np.repeat(lib.offsets[lib_res[known]], counts) + within
+    exp_names = lib.names[exp_atoms]
+    table_ids = res_ids[table["first_atom"]]
+    exp_keys = np.char.add(table_ids[exp_res], exp_names)
+    missing = ~np.isin(exp_keys, atom_keys)
+    rebuilt = missing & _is_hydrogen(exp_names)
+    rebuilt_charge = np.bincount(exp_res[rebuilt], weights=lib.charges[exp_atoms[rebuilt]],
+                                 minlength=n_res)
+    if missing.any():
+        miss_res, miss_names = exp_res[missing], exp_names[missing]
+        hydrogen = _is_hydrogen(miss_names)
+        backbone = np.isin(miss_names, BACKBONE)
+        for r in np.unique(miss_res):
+            sel = miss_res == r
+            for kind, mask in (("missing_backbone", backbone),
+                               ("missing_sidechain", ~backbone & ~hydrogen),
+                               ("missing_hydrogen", hydrogen)):
+                names = miss_names[sel & mask]
+                if len(names):
+                    issues.append(_issue(kind, labels[r], " ".join(names)))
+
+    # Chain breaks between consecutive polymer residues
+    c_idx = np.full(n_res, -1)
+    n_idx = np.full(n_res, -1)
+    c_idx[res[atoms["name"] == "C"]] = np.flatnonzero(atoms["name"] == "C")
+    n_idx[res[atoms["name"] == "N"]] = np.flatnonzero(atoms["name"] == "N")
+    polymer = np.zeros(n_res, dtype=bool)
+    polymer[known] = lib.polymer[lib_res[known]]
+    ter_res = np.zeros(n_res, dtype=bool)
+    ter_res[res[atoms["ter_after"]]] = True
+    # Only sequence neighbours (n, n+1 or an insertion code of n) are bonded;
+    # a jump in numbering is a gap, not a peptide bond to check
+    seq_step = table["resseq"][1:] - table["resseq"][:-1]
+    neighbours = (seq_step == 1) | ((seq_step == 0) & (table_ids[1:] != table_ids[:-1]))
+    pair = (polymer[:-1] & polymer[1:] & ~ter_res[:-1] & neighbours &
+            (table["chain"][:-1] == table["chain"][1:]) &
+            (c_idx[:-1] >= 0) & (n_idx[1:] >= 0))
+    i = np.flatnonzero(pair)
+    dist = np.linalg.norm(atoms["xyz"][c_idx[i]] - atoms["xyz"][n_idx[i + 1]], axis=1)
+    for r, d in zip(i[dist > PEPTIDE_BOND_MAX], dist[dist > PEPTIDE_BOND_MAX]):
+        issues.append(_issue("chain_break", f"{labels[r]}-{labels[r + 1]}",
+                             f"C-N {d:.2f} Å (no TER)"))
+
+    # Residue charges from the atoms present plus the hydrogens qprep5 adds
+    res_charge = np.bincount(res, weights=charges, minlength=n_res) + rebuilt_charge
+    drift = np.abs(res_charge - np.round(res_charge))
+    for r in np.flatnonzero((drift > CHARGE_TOLERANCE) & (lib_res >= 0)):
+        issues.append(_issue("noninteger_charge", labels[r], f"{res_charge[r]:+.4f} e"))
+
+    return issues, float(res_charge.sum())
+
+
+def validate_file(filename):
+    """Worker entry point: parse and check one PDB file."""
+    try:
+        atoms = read_pdb(filename)
+    except (OSError, ValueError) as e:
+        return filename, 0, 0.0, [_issue("unreadable", detail=str(e))]
+
+    issues, charge = validate_atoms(atoms, _lib_index)
+    return filename, len(atoms["name"]), charge, issues
+
+
+def validate_files(filenames, lib_files=DEFAULT_LIBS, jobs=None):
+    """Validate many files in parallel; returns [(file, n_atoms, charge, issues)]."""
+    lib = LibraryIndex(read_lib_files(lib_files))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(lib,)) as pool:
+        return list(pool.map(validate_file, filenames, chunksize=4))
+
+
+def has_errors(issues):
+    return any(issue["kind"] in ERROR_KINDS for issue in issues)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate PDB files against Q libraries")
+    parser.add_argument("paths", nargs="*", default=[os.path.join(HERE, "mutations")],
+                        help="PDB files or directories (default: mutations/)")
+    parser.add_argument("--lib", action="append", help="library file (repeatable)")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes")
+    parser.add_argument("--csv", help="write all issues to this CSV file")
+    parser.add_argument("--hydrogens", action="store_true",
+                        help="list missing hydrogens (qprep5 can rebuild them)")
+    parser.add_argument("--list-failed", action="store_true",
+                        help="only print the paths of files with errors")
+    args = parser.parse_args()
+
+    filenames = [f for path in args.paths for f in list_pdb_files(path)]
+    if not filenames:
+        print("No PDB files found")
+        sys.exit(1)
+
+    results = validate_files(filenames, args.lib or DEFAULT_LIBS, args.jobs)
+    failed = [filename for filename, _, _, issues in results if has_errors(issues)]
+
+    if args.list_failed:
+        for filename in failed:
+            print(filename)
+        sys.exit(0)
+
+    for filename, n_atoms, charge, issues in results:
+        shown = [i for i in issues if args.hydrogens or i["kind"] != "missing_hydrogen"]
+        status = "FAIL" if has_errors(issues) else ("WARN" if shown else "ok")
+        print(f"{status:4s}  {os.path.basename(filename):40s} {n_atoms:7d} atoms  "
+              f"charge {charge:+8.3f}  {len(shown)} issue(s)")
+        for issue in shown:
+            print(f"        {issue['kind']:18s} {issue['residue']:16s} {issue['detail']}")
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "kind", "residue", "detail"])
+            for filename, _, _, issues in results:
+                for issue in issues:
+                    writer.writerow([filename, issue["kind"], issue["residue"], issue["detail"]])
+        print(f"\nIssues written to {args.csv}")
+
+    print(f"\n{len(results) - len(failed)}/{len(results)} structures passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
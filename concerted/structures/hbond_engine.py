@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Geometric hydrogen-bond engine.
+
+Standalone replacement for the PyMOL loops in calculate_h_bond.py. Donors,
+acceptors and polar hydrogens come from the Q .lib files rather than from
+element guesses:
+
+    polar hydrogen   H bonded to N or O in the residue's [bonds]
+    donor            the N/O such a hydrogen is bonded to
+    acceptor         every O, and N with fewer than three bonded partners
+                     (counting the head/tail peptide connections)
+
+An H-bond D-H...A needs H...A <= 2.5 Å, D...A <= 3.5 Å and a D-H...A angle
+>= 120°. All H...A candidate pairs come from one cKDTree sparse distance
+query, so a 100k-atom solvated sphere is done in a fraction of a second.
+Missing backbone amide hydrogens (e.g. in PyMOL-built heavy-atom mutants)
+are placed on the C(i-1)-N-CA bisector; other donors whose hydrogens are
+missing are matched on the D...A distance only.
+
+Bonds are classified with array membership against a residue set:
+internal (both residues in the set), external (one of them) or other.
+
+Usage:
+    python hbond_engine.py structure.pdb [--residues 7 9 10 ...] [--csv hbonds.csv] [--all]
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "parameters"))
+from pdb_arrays import BACKBONE, read_pdb, residue_index, residue_table
+from qlib import read_lib_files
+
+DEFAULT_LIBS = [os.path.join(HERE, "..", "parameters", "qoplsaa.lib"),
+                os.path.join(HERE, "..", "parameters", "LMRR.lib")]
+
+# Residues analysed in calculate_h_bond.py
+DEFAULT_RESIDUES = (7, 9, 10, 11, 14, 16, 17, 18, 21, 87, 88, 91, 92, 94, 95, 96, 98, 99,
+                    100, 103)
+
+MAX_DA = 3.5          # Å, donor - acceptor
+MAX_HA = 2.5          # Å, hydrogen - acceptor
+MIN_ANGLE = 120.0     # degrees, D-H...A
+
+DONOR, ACCEPTOR, POLAR_H = 1, 2, 4
+
+BOND_FIELDS = ("donor", "hydrogen", "acceptor", "d_da", "d_ha", "angle")
+
+
+def _element(name):
+    return name.lstrip('0123456789')[:1].upper()
+
+
+class HBondLibrary:
+    """Donor/acceptor roles of every library atom, as sorted "RES NAME" keys."""
+
+    def __init__(self, residues):
+        keys, roles, partners = [], [], []
+        for resname, entry in residues.items():
+            names = [name for name, _, _ in entry["atoms"]]
+            neighbours = {name: set() for name in names}
+            for a, b in entry["bonds"]:
+                if a in neighbours and b in neighbours:
+                    neighbours[a].add(b)
+                    neighbours[b].add(a)
+            links = {name: 0 for name in names}
+            for atom in entry["connections"].values():
+                if atom in links:
+                    links[atom] += 1
+
+            for name in names:
+                role, partner = 0, ""
+                element = _element(name)
+                polar_h = [n for n in neighbours[name] if _element(n) == 'H']
+                if element == 'H':
+                    heavy = [n for n in neighbours[name] if _element(n) in ('N', 'O')]
+                    if heavy:
+                        role, partner = POLAR_H, heavy[0]
+                elif element in ('N', 'O'):
+                    if polar_h:
+                        role |= DONOR
+                    if element == 'O' or len(neighbours[name]) + links[name] < 3:
+                        role |= ACCEPTOR
+                keys.append(f"{resname} {name}")
+                roles.append(role)
+                partners.append(partner)
+
+        order = np.argsort(keys)
+        self.keys = np.array(keys)[order]
+        self.roles = np.array(roles)[order]
+        self.partners = np.array(partners)[order]
+
+    def lookup(self, resnames, names):
+        """(found, role, bonded donor name) for every atom."""
+        keys = np.char.add(np.char.add(resnames, ' '), names)
+        pos = np.clip(np.searchsorted(self.keys, keys), 0, len(self.keys) - 1)
+        found = self.keys[pos] == keys
+        return (found, np.where(found, self.roles[pos], 0),
+                np.where(found, self.partners[pos], ""))
+
+
+def load_library(lib_files=DEFAULT_LIBS):
+    return HBondLibrary(read_lib_files(lib_files))
+
+
+def atom_roles(atoms, lib):
+    """
+    (role, donor index of polar hydrogens (-1 otherwise), residue index).
+    Atoms of residues missing from the library fall back to the element:
+    O and N are both donor and acceptor candidates.
+    """
+    res = residue_index(atoms)
+    found, role, partner = lib.lookup(atoms["resname"], atoms["name"])
+    unknown = ~found & np.isin(np.char.upper(atoms["element"]), ('N', 'O'))
+    role = np.where(unknown, DONOR | ACCEPTOR, role)
+
+    # Map each polar hydrogen to the atom index of its donor
+    donor = np.full(len(res), -1)
+    h = np.flatnonzero(role == POLAR_H)
+    donor[h] = _atom_lookup(atoms, res, res[h], partner[h])
+    return role, donor, res
+
+
+def _atom_lookup(atoms, res, wanted_res, wanted_names):
+    """Atom index of (residue index, name) pairs, -1 where absent."""
+    atom_keys = np.char.add(np.char.add(res.astype(str), ' '), atoms["name"])
+    order = np.argsort(atom_keys)
+    sorted_keys = atom_keys[order]
+    wanted = np.char.add(np.char.add(np.asarray(wanted_res).astype(str), ' '), wanted_names)
+    if not len(wanted):
+        return np.zeros(0, dtype=np.int64)
+    pos = np.clip(np.searchsorted(sorted_keys, wanted), 0, len(sorted_keys) - 1)
+    return np.where(sorted_keys[pos] == wanted, order[pos], -1)
+
+
+def amide_hydrogens(atoms, res, donors):
+    """
+    Ideal positions of missing backbone amide hydrogens: 1.01 Å from N along
+    the bisector of C(i-1)->N and CA->N. Returns (donor indices, xyz) for the
+    backbone N atoms in donors that have both neighbours.
+    """
+    n = donors[(atoms["name"][donors] == "N") & (atoms["resname"][donors] != "PRO")]
+    ca = _atom_lookup(atoms, res, res[n], np.full(len(n), "CA"))
+    c_prev = _atom_lookup(atoms, res, res[n] - 1, np.full(len(n), "C"))
+    ok = (ca >= 0) & (c_prev >= 0)
+    n, ca, c_prev = n[ok], ca[ok], c_prev[ok]
+    xyz = atoms["xyz"]
+    u = xyz[n] - xyz[c_prev]
+    v = xyz[n] - xyz[ca]
+    bisector = u / np.linalg.norm(u, axis=1)[:, None] + v / np.linalg.norm(v, axis=1)[:, None]
+    # A real peptide bond is ~1.33 Å; skip chain breaks
+    ok = np.linalg.norm(u, axis=1) < 2.0
+    h_xyz = xyz[n] + 1.01 * bisector / np.linalg.norm(bisector, axis=1)[:, None]
+    return n[ok], h_xyz[ok]
+
+
+def find_hbonds(atoms, lib, xyz=None, max_da=MAX_DA, max_ha=MAX_HA, min_angle=MIN_ANGLE):
+    """
+    All H-bonds of a structure as a dict of arrays (BOND_FIELDS). hydrogen
+    is -1 for placed amide hydrogens and for distance-only bonds (whose
+    angle is NaN). xyz overrides the coordinates (e.g. a trajectory frame
+    with the same atom order).
+    """
+    xyz = atoms["xyz"] if xyz is None else xyz
+    role, donor_of, res = atom_roles(atoms, lib)
+    acceptors = np.flatnonzero(role & ACCEPTOR)
+    hydrogens = np.flatnonzero(donor_of >= 0)
+    acc_tree = cKDTree(xyz[acceptors])
+
+    # Missing backbone amide H are placed geometrically (hydrogen index -1)
+    bare = np.setdiff1d(np.flatnonzero(role & DONOR), donor_of[hydrogens])
+    amide_n, amide_xyz = amide_hydrogens({**atoms, "xyz": xyz}, res, bare)
+    h_index = np.r_[hydrogens, np.full(len(amide_n), -1)]
+    h_donor = np.r_[donor_of[hydrogens], amide_n].astype(np.int64)
+    h_xyz = np.concatenate([xyz[hydrogens], amide_xyz])
+
+    # D-H...A with the angle criterion
+    pairs = cKDTree(h_xyz).sparse_distance_matrix(acc_tree, max_ha, output_type='ndarray')
+    k, a, d_ha = pairs['i'], acceptors[pairs['j']], pairs['v']
+    h, d = h_index[k], h_donor[k]
+    d_da = np.linalg.norm(xyz[d] - xyz[a], axis=1)
+    to_d, to_a = xyz[d] - h_xyz[k], xyz[a] - h_xyz[k]
+    cos = np.einsum('ij,ij->i', to_d, to_a) / (
+        np.linalg.norm(to_d, axis=1) * np.linalg.norm(to_a, axis=1))
+    angle = np.degrees(np.arccos(np.clip(cos, -1.0, 1.0)))
+    keep = (d_da <= max_da) & (angle >= min_angle) & (res[d] != res[a]) & (d != a)
+    bonds = [d[keep], h[keep], a[keep], d_da[keep], d_ha[keep], angle[keep]]
+
+    # Other donors without hydrogens in the file (heavy-atom models): D...A only
+    bare = np.setdiff1d(bare, amide_n)
+    pairs = cKDTree(xyz[bare]).sparse_distance_matrix(acc_tree, max_da, output_type='ndarray')
+    d, a, d_da = bare[pairs['i']], acceptors[pairs['j']], pairs['v']
+    # Without the angle N(i+1)...O(i) across the peptide bond would count
+    backbone = np.isin(atoms["name"], BACKBONE)
+    adjacent = (np.abs(res[d] - res[a]) == 1) & backbone[d] & backbone[a]
+    keep = (res[d] != res[a]) & ~adjacent
+    n = int(keep.sum())
+    for k, extra in enumerate((d[keep], np.full(n, -1), a[keep], d_da[keep],
+                               np.full(n, np.nan), np.full(n, np.nan))):
+        bonds[k] = np.concatenate([bonds[k], extra])
+
+    # Several hydrogens of one donor (water, Lys NZ) -> keep the shortest H...A
+    d, h, a, d_da, d_ha, angle = bonds
+    order = np.lexsort((d_ha, a, d))
+    bonds = [x[order] for x in bonds]
+    d, a = bonds[0], bonds[2]
+    first = np.r_[True, (d[1:] != d[:-1]) | (a[1:] != a[:-1])][:len(d)]
+    return dict(zip(BOND_FIELDS, (x[first] for x in bonds)))
+
+
+def classify(atoms, bonds, residues):
+    """'internal', 'external' or 'other' for every bond relative to a residue set."""
+    table = residue_table(atoms)
+    res = residue_index(atoms)
+    # Q numbering: residue n is the n-th residue of the structure
+    selected = np.isin(np.arange(len(table["resseq"])) + 1, list(residues))
+    d_in = selected[res[bonds["donor"]]]
+    a_in = selected[res[bonds["acceptor"]]]
+    return np.where(d_in & a_in, "internal", np.where(d_in | a_in, "external", "other"))
+
+
+def bond_rows(atoms, bonds, classes=None):
+    """Printable rows: donor/acceptor labels, geometry and class."""
+    res = residue_index(atoms)
+
+    def label(i):
+        return (f"{atoms['chain'][i] or '-'}:{atoms['resname'][i]}{res[i] + 1}."
+                f"{atoms['name'][i]}")
+
+    rows = []
+    for k in range(len(bonds["donor"])):
+        h = bonds["hydrogen"][k]
+        geometry = np.isfinite(bonds["angle"][k])
+        hydrogen = atoms["name"][h] if h >= 0 else ("(HN)" if geometry else "")
+        rows.append([label(bonds["donor"][k]), hydrogen,
+                     label(bonds["acceptor"][k]), f"{bonds['d_da'][k]:.2f}",
+                     f"{bonds['d_ha'][k]:.2f}" if geometry else "",
+                     f"{bonds['angle'][k]:.1f}" if geometry else "",
+                     classes[k] if classes is not None else ""])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Geometric H-bond analysis")
+    parser.add_argument("pdb", help="structure (Q-written PDB with hydrogens preferred)")
+    parser.add_argument("--residues", type=int, nargs="+", default=list(DEFAULT_RESIDUES),
+                        help="residue numbers for the internal/external classification")
+    parser.add_argument("--lib", action="append", help="library file (repeatable)")
+    parser.add_argument("--all", action="store_true", help="also list bonds not involving "
+                                                          "the selected residues")
+    parser.add_argument("--csv", help="write the bonds to CSV")
+    args = parser.parse_args()
+
+    atoms = read_pdb(args.pdb)
+    lib = load_library(args.lib or DEFAULT_LIBS)
+    bonds = find_hbonds(atoms, lib)
+    classes = classify(atoms, bonds, args.residues)
+    if not args.all:
+        keep = classes != "other"
+        bonds = {key: value[keep] for key, value in bonds.items()}
+        classes = classes[keep]
+
+    rows = bond_rows(atoms, bonds, classes)
+    for kind in ("internal", "external", "other"):
+        selected = [row for row in rows if row[-1] == kind]
+        if not selected:
+            continue
+        print(f"\n{kind.upper()} H-BONDS ({len(selected)})")
+        print(f"{'Donor':22s} {'H':5s} {'Acceptor':22s} {'D...A':>6s} {'H...A':>6s} {'angle':>6s}")
+        for row in sorted(selected, key=lambda r: float(r[3])):
+            print(f"{row[0]:22s} {row[1]:5s} {row[2]:22s} {row[3]:>6s} {row[4]:>6s} {row[5]:>6s}")
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["donor", "hydrogen", "acceptor", "d_da", "d_ha", "angle", "class"])
+            writer.writerows(rows)
+        print(f"\nH-bonds written to {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
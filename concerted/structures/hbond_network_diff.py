@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+WT-vs-mutant H-bond and salt-bridge network differences for a whole library.
+
+Every structure's network is computed with hbond_engine.py plus a salt-bridge
+check (Asp/Glu carboxylate O - Lys/Arg/Hip N <= 4.0 Å, one entry per residue
+pair). Interactions are keyed on (residue number, atom name) of both
+partners, residue numbers in Q order, so WT and mutant networks line up even
+when chain IDs or residue names differ; a lost Ser96 OG bond in S96A simply
+has no partner on the mutant side.
+
+With --dcd the network is averaged over trajectory frames instead: the value
+of an interaction is its occupancy (fraction of frames) rather than its
+distance. The DCD glob may use {name} for the structure's file stem.
+
+Output is a sparse CSV with only the differences:
+
+    mutant, type, partner1, partner2, status, wt, mutant_value
+
+status is gained / lost / changed (distance shift >= 0.3 Å, or occupancy
+shift >= 0.25; occupancies below 0.1 count as absent). Structures are
+processed in parallel.
+
+Usage:
+    python hbond_network_diff.py [pdb_or_dir ...] [--wt LMRR_WT2.pdb] [-o network_diff.csv]
+                                 [--dcd "results/{name}/replica*/fep_000_*.dcd" --stride 10]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "analysis"))
+from hbond_engine import DEFAULT_LIBS, find_hbonds, load_library
+from pdb_arrays import list_pdb_files, read_pdb, residue_index
+
+DEFAULT_WT = os.path.join(HERE, "LMRR_WT2.pdb")
+DEFAULT_MUTANTS = os.path.join(HERE, "..", "prep_structures", "mutations")
+
+SALT_BRIDGE_MAX = 4.0     # Å
+ACIDIC = {"ASP": ("OD1", "OD2"), "GLU": ("OE1", "OE2")}
+BASIC = {"LYS": ("NZ",), "ARG": ("NE", "NH1", "NH2"), "HIP": ("ND1", "NE2")}
+
+DISTANCE_CHANGE = 0.3     # Å
+OCCUPANCY_CHANGE = 0.25
+MIN_OCCUPANCY = 0.1       # rarer interactions count as absent
+
+_lib = None
+
+
+def _charged_atoms(atoms, groups):
+    mask = np.zeros(len(atoms["name"]), dtype=bool)
+    for resname, names in groups.items():
+        mask |= (atoms["resname"] == resname) & np.isin(atoms["name"], names)
+    return np.flatnonzero(mask)
+
+
+def atom_keys(atoms):
+    """'resnum:NAME' key of every atom (Q residue numbering)."""
+    res = residue_index(atoms)
+    return np.char.add(np.char.add((res + 1).astype(str), ':'), atoms["name"])
+
+
+def residue_keys(atoms):
+    """'resnum:RESNAME' label of every atom."""
+    res = residue_index(atoms)
+    return np.char.add(np.char.add((res + 1).astype(str), ':'), atoms["resname"])
+
+
+def salt_bridges(atoms, xyz=None):
+    """{(acid residue, base residue): shortest O...N distance}."""
+    xyz = atoms["xyz"] if xyz is None else xyz
+    acid, base = _charged_atoms(atoms, ACIDIC), _charged_atoms(atoms, BASIC)
+    if not len(acid) or not len(base):
+        return {}
+    pairs = cKDTree(xyz[acid]).sparse_distance_matrix(cKDTree(xyz[base]), SALT_BRIDGE_MAX,
+                                                      output_type='ndarray')
+    labels = residue_keys(atoms)
+    bridges = {}
+    for i, j, dist in zip(acid[pairs['i']], base[pairs['j']], pairs['v']):
+        key = (labels[i], labels[j])
+        bridges[key] = min(dist, bridges.get(key, np.inf))
+    return bridges
+
+
+def network(atoms, lib, xyz=None):
+    """{(type, partner1, partner2): distance} for one set of coordinates."""
+    keys = atom_keys(atoms)
+    bonds = find_hbonds(atoms, lib, xyz=xyz)
+    interactions = {("hbond", keys[d], keys[a]): float(dist)
+                    for d, a, dist in zip(bonds["donor"], bonds["acceptor"], bonds["d_da"])}
+    for (acid, base), dist in salt_bridges(atoms, xyz).items():
+        interactions[("salt_bridge", acid, base)] = float(dist)
+    return interactions
+
+
+def trajectory_network(atoms, lib, dcd_files, stride=10):
+    """{interaction: occupancy} over the frames of one or more DCD files."""
+    from dcd_reader import DCDFile
+
+    counts, n_frames = {}, 0
+    for dcd in dcd_files:
+        traj = DCDFile(dcd)
+        if traj.n_atoms != len(atoms["name"]):
+            raise ValueError(f"{dcd}: {traj.n_atoms} atoms, structure has {len(atoms['name'])}")
+        for _, xyz in traj.iter_chunks(100, step=stride):
+            for frame in xyz.astype(np.float64):
+                for key in network(atoms, lib, frame):
+                    counts[key] = counts.get(key, 0) + 1
+                n_frames += 1
+    return {key: count / max(n_frames, 1) for key, count in counts.items()}
+
+
+def structure_network(filename, dcd_pattern=None, stride=10):
+    """(filename, network, occupancy mode) for one structure (worker entry point)."""
+    atoms = read_pdb(filename)
+    if dcd_pattern:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        dcds = sorted(glob.glob(dcd_pattern.format(name=name)))
+        if dcds:
+            return filename, trajectory_network(atoms, _lib, dcds, stride), True
+    return filename, network(atoms, _lib), False
+
+
+def _init_worker(lib):
+    global _lib
+    _lib = lib
+
+
+def _structure_network(args):
+    return structure_network(*args)
+
+
+def diff_networks(wt, mutant, occupancy=False):
+    """Rows (type, partner1, partner2, status, wt value, mutant value)."""
+    threshold = OCCUPANCY_CHANGE if occupancy else DISTANCE_CHANGE
+    if occupancy:
+        wt = {key: value for key, value in wt.items() if value >= MIN_OCCUPANCY}
+        mutant = {key: value for key, value in mutant.items() if value >= MIN_OCCUPANCY}
+    rows = []
+    for key in sorted(set(wt) | set(mutant)):
+        if key not in mutant:
+            rows.append((*key, "lost", wt[key], None))
+        elif key not in wt:
+            rows.append((*key, "gained", None, mutant[key]))
+        elif abs(mutant[key] - wt[key]) >= threshold:
+            rows.append((*key, "changed", wt[key], mutant[key]))
+    return rows
+
+
+def compare_library(wt_pdb, filenames, lib_files=DEFAULT_LIBS, dcd_pattern=None, stride=10,
+                    jobs=None):
+    """Networks of WT and all mutants in parallel; returns {mutant file: diff rows}."""
+    lib = load_library(lib_files)
+    tasks = [(f, dcd_pattern, stride) for f in [wt_pdb] + list(filenames)]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(lib,)) as pool:
+        results = list(pool.map(_structure_network, tasks))
+
+    _, wt_network, wt_occupancy = results[0]
+    diffs = {}
+    for filename, mut_network, occupancy in results[1:]:
+        if occupancy != wt_occupancy:
+            print(f"{os.path.basename(filename)}: static and trajectory networks cannot be "
+                  f"compared, skipped")
+            continue
+        diffs[filename] = diff_networks(wt_network, mut_network, occupancy)
+    return diffs, wt_occupancy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WT vs mutant H-bond / salt-bridge differences")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_MUTANTS],
+                        help="mutant PDB files or directories (default: prep_structures/mutations)")
+    parser.add_argument("--wt", default=DEFAULT_WT, help="reference structure")
+    parser.add_argument("--lib", action="append", help="library file (repeatable)")
+    parser.add_argument("--dcd", help="DCD glob per structure for occupancies ({name} = stem)")
+    parser.add_argument("--stride", type=int, default=10, help="use every n-th frame")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default="network_diff.csv")
+    args = parser.parse_args()
+
+    filenames = [f for path in args.paths for f in list_pdb_files(path)
+                 if os.path.abspath(f) != os.path.abspath(args.wt)]
+    diffs, occupancy = compare_library(args.wt, filenames, args.lib or DEFAULT_LIBS,
+                                       args.dcd, args.stride, args.jobs)
+    value = "occupancy" if occupancy else "distance"
+
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["mutant", "type", "partner1", "partner2", "status",
+                         f"wt_{value}", f"mutant_{value}"])
+        for filename, rows in diffs.items():
+            name = os.path.splitext(os.path.basename(filename))[0]
+            for kind, p1, p2, status, wt_value, mut_value in rows:
+                writer.writerow([name, kind, p1, p2, status,
+                                 "" if wt_value is None else f"{wt_value:.3f}",
+                                 "" if mut_value is None else f"{mut_value:.3f}"])
+
+    print(f"{'Mutant':32s} {'gained':>7s} {'lost':>6s} {'changed':>8s}")
+    for filename, rows in diffs.items():
+        status = [row[3] for row in rows]
+        print(f"{os.path.basename(filename):32s} {status.count('gained'):7d} "
+              f"{status.count('lost'):6d} {status.count('changed'):8d}")
+    print(f"\nDifferences ({value}) written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
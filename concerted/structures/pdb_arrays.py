@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Read PDB files straight into NumPy arrays.
+
+All ATOM/HETATM records are padded to 80 columns and sliced column-wise as
+one byte matrix, so a 100k-atom solvated system is parsed without a Python
+loop over fields. The result is a dict of equal-length arrays:
+
+    name, resname, chain, resseq, icode, serial, record, element  (one per atom)
+    xyz                                                          (N x 3 float)
+
+plus bookkeeping that the structure checks need:
+
+    conflict_lines   line numbers of git conflict markers (<<<<<<< ======= >>>>>>>)
+    ter_after        indices of atoms that are followed by a TER record
+
+Used by the validation, clash, distance, H-bond and SASA scripts.
+"""
+
+import glob
+import os
+import sys
+
+import numpy as np
+
+CONFLICT_MARKERS = ('<<<<<<<', '=======', '>>>>>>>')
+
+# Column ranges (0-based, end exclusive) of the fixed-width PDB fields
+PDB_COLUMNS = {
+    "record": (0, 6), "serial": (6, 11), "name": (12, 16), "altloc": (16, 17),
+    "resname": (17, 20), "chain": (21, 22), "resseq": (22, 26),
+    "icode": (26, 27), "x": (30, 38), "y": (38, 46), "z": (46, 54),
+    "element": (76, 78),
+}
+
+BACKBONE = ("N", "CA", "C", "O")
+
+
+def _column(block, start, end):
+    """Slice a column range out of an (N, 80) byte matrix as stripped str."""
+    field = np.ascontiguousarray(block[:, start:end]).view(f'S{end - start}').ravel()
+    return np.char.strip(np.char.decode(field, 'ascii'))
+
+
+def _numeric(block, start, end, dtype):
+    field = np.ascontiguousarray(block[:, start:end]).view(f'S{end - start}').ravel()
+    field = np.where(np.char.strip(field) == b'', b'0', field)
+    return field.astype(dtype)
+
+
+def parse_pdb_lines(lines):
+    """Parse a list of PDB lines into the array dict described above."""
+    atom_lines = []
+    conflict_lines = []
+    ter_after = []
+    for i, line in enumerate(lines, 1):
+        if line.startswith(('ATOM  ', 'HETATM')):
+            atom_lines.append(line.rstrip('\r\n').ljust(80)[:80])
+        elif line.startswith(CONFLICT_MARKERS):
+            conflict_lines.append(i)
+        elif line.startswith('TER') and atom_lines:
+            ter_after.append(len(atom_lines) - 1)
+
+    block = np.array(atom_lines, dtype='S80').view('S1').reshape(-1, 80)
+    atoms = {key: _column(block, *PDB_COLUMNS[key])
+             for key in ("record", "name", "altloc", "resname", "chain",
+                         "icode", "element")}
+    atoms["serial"] = _numeric(block, *PDB_COLUMNS["serial"], np.int64)
+    atoms["resseq"] = _numeric(block, *PDB_COLUMNS["resseq"], np.int64)
+    atoms["xyz"] = np.column_stack([
+        _numeric(block, *PDB_COLUMNS[axis], np.float64) for axis in "xyz"])
+
+    # Element column is blank in Q-written PDBs; fall back to the atom name
+    missing = atoms["element"] == ''
+    if missing.any():
+        guess = np.char.lstrip(atoms["name"][missing], '0123456789')
+        atoms["element"][missing] = np.char.upper(guess).astype('U1')
+
+    atoms["conflict_lines"] = np.array(conflict_lines, dtype=np.int64)
+    atoms["ter_after"] = np.array(ter_after, dtype=np.int64)
+    return atoms
+
+
+def read_pdb(filename):
+    """Read a PDB file into arrays."""
+    with open(filename, 'r') as f:
+        return parse_pdb_lines(f.readlines())
+
+
+def n_atoms(atoms):
+    return len(atoms["name"])
+
+
+def residue_index(atoms):
+    """
+    Consecutive residue number (0..n_res-1) for every atom. A new residue
+    starts whenever (chain, resseq, icode) changes from the previous atom.
+    """
+    n = n_atoms(atoms)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    changed = np.ones(n, dtype=bool)
+    changed[1:] = ((atoms["chain"][1:] != atoms["chain"][:-1]) |
+                   (atoms["resseq"][1:] != atoms["resseq"][:-1]) |
+                   (atoms["icode"][1:] != atoms["icode"][:-1]))
+    return np.cumsum(changed) - 1
+
+
+def residue_table(atoms):
+    """Per-residue arrays: first atom index, chain, resseq, resname."""
+    res = residue_index(atoms)
+    first = np.flatnonzero(np.r_[True, res[1:] != res[:-1]]) if len(res) else res
+    return {
+        "first_atom": first,
+        "chain": atoms["chain"][first],
+        "resseq": atoms["resseq"][first],
+        "resname": atoms["resname"][first],
+    }
+
+
+def heavy_mask(atoms):
+    return atoms["element"] != 'H'
+
+
+def select(atoms, mask):
+    """Return a new array dict restricted to mask (bookkeeping is dropped)."""
+    return {key: value[mask] for key, value in atoms.items()
+            if key not in ("conflict_lines", "ter_after")}
+
+
+def atom_labels(atoms):
+    """'resseq.name' labels, the PDB ID convention used in qmaps/FEP files."""
+    return np.char.add(np.char.add(atoms["resseq"].astype(str), '.'), atoms["name"])
+
+
+def find_atom(atoms, resname=None, name=None, resseq=None):
+    """Index of the first atom matching the given fields (None if absent)."""
+    mask = np.ones(n_atoms(atoms), dtype=bool)
+    if resname is not None:
+        mask &= atoms["resname"] == resname
+    if name is not None:
+        mask &= atoms["name"] == name
+    if resseq is not None:
+        mask &= atoms["resseq"] == resseq
+    hits = np.flatnonzero(mask)
+    return int(hits[0]) if len(hits) else None
+
+
+def format_atom_line(serial, name, resname, chain, resseq, x, y, z, element=''):
+    """One PDB ATOM record; 4-character names start in column 13."""
+    name_field = name if len(name) == 4 else f" {name:<3s}"
+    return (f"ATOM  {serial % 100000:5d} {name_field:4s} {resname:>3s} {chain:1s}"
+            f"{resseq % 10000:4d}    {x:8.3f}{y:8.3f}{z:8.3f}  0.00  0.00"
+            f"          {element:>2s}\n")
+
+
+def write_pdb(atoms, filename, xyz=None):
+    """Write atoms (optionally with replacement coordinates) as a PDB file."""
+    xyz = atoms["xyz"] if xyz is None else xyz
+    with open(filename, 'w') as f:
+        for i in range(n_atoms(atoms)):
+            f.write(format_atom_line(i + 1, atoms["name"][i], atoms["resname"][i],
+                                     atoms["chain"][i], int(atoms["resseq"][i]),
+                                     *xyz[i], element=atoms["element"][i]))
+        f.write("END\n")
+
+
+def list_pdb_files(path, pattern="*.pdb"):
+    """A single PDB file, or every PDB file in a directory (sorted)."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, pattern)))
+    return [path]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: pdb_arrays.py structure.pdb")
+        sys.exit(1)
+
+    atoms = read_pdb(sys.argv[1])
+    table = residue_table(atoms)
+    print(f"{sys.argv[1]}: {n_atoms(atoms)} atoms, {len(table['first_atom'])} residues")
+    if len(atoms["conflict_lines"]):
+        print(f"  git conflict markers on lines {atoms['conflict_lines'].tolist()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Classify residues into distance shells around reference atoms.
+
+Replaces the PyMOL `all within 15 of (resn IMI and name N2)` selection
+(distances_mutants.py -> nearby_atoms.csv) and the CSV filtering in
+sort_mutants.py. For every structure one cKDTree is built over all atoms
+and each reference atom gets a single ball query out to the largest shell
+radius; the closest atom of every residue then decides its shell.
+
+References are given as RESN:NAME (first matching atom), by default the
+IMI nucleophile N2, the IMI C10 and the reactive water oxygen HO2 O3.
+Shell edges default to 0, 10 and 15 Å, i.e. the "within 10" and "10-15"
+sets of sort_mutants.py.
+
+Output is one row per (structure, reference, residue):
+
+    structure, reference, chain, resseq, resname, min_distance, closest_atom, shell
+
+written as CSV, or as columnar NumPy arrays when the output ends in .npz.
+shell_membership() works on a bare coordinate array, so trajectory frames
+can be classified with the same code.
+
+Usage:
+    python radius_shells.py [pdb_or_dir ...] [--ref IMI:N2 --ref HO2:O3]
+                            [--shells 0 10 15] [--exclude 7 11 ...] [-o shells.csv]
+"""
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from pdb_arrays import find_atom, list_pdb_files, read_pdb, residue_index, residue_table
+
+DEFAULT_REFERENCES = ("IMI:N2", "IMI:C10", "HO2:O3")
+DEFAULT_SHELLS = (0.0, 10.0, 15.0)
+
+COLUMNS = ("structure", "reference", "chain", "resseq", "resname",
+           "min_distance", "closest_atom", "shell")
+
+
+def shell_labels(edges):
+    return [f"{lo:g}-{hi:g}" for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+def reference_indices(atoms, references):
+    """Atom index of every RESN:NAME reference (None where absent)."""
+    indices = []
+    for ref in references:
+        resname, name = ref.split(':')
+        indices.append(find_atom(atoms, resname=resname, name=name))
+    return indices
+
+
+def shell_membership(xyz, res, ref_indices, edges, tree=None):
+    """
+    Per-residue minimum distance to each reference atom.
+
+    xyz          (N, 3) coordinates
+    res          residue index of every atom (residue_index)
+    ref_indices  atom indices of the references (None entries are skipped)
+    edges        increasing shell edges; residues beyond edges[-1] are dropped
+
+    Returns a list (one per reference) of (residues, min_distance,
+    closest_atom, shell) arrays, shell being an index into the edges.
+    """
+    tree = tree if tree is not None else cKDTree(xyz)
+    cutoff = edges[-1]
+    results = []
+    for ref in ref_indices:
+        if ref is None:
+            results.append(None)
+            continue
+        near = np.array(tree.query_ball_point(xyz[ref], cutoff), dtype=np.int64)
+        near = near[(res[near] != res[ref])]
+        dist = np.linalg.norm(xyz[near] - xyz[ref], axis=1)
+
+        # Closest atom of each residue: sort by distance, keep first per residue
+        order = np.lexsort((dist, res[near]))
+        near, dist = near[order], dist[order]
+        first = np.r_[True, res[near][1:] != res[near][:-1]][:len(near)]
+        near, dist = near[first], dist[first]
+
+        shell = np.searchsorted(edges, dist, side='left') - 1
+        shell = np.clip(shell, 0, len(edges) - 2)
+        keep = dist >= edges[0]
+        results.append((res[near][keep], dist[keep], near[keep], shell[keep]))
+    return results
+
+
+def classify_structure(filename, references=DEFAULT_REFERENCES, edges=DEFAULT_SHELLS,
+                       exclude=()):
+    """Rows (dict of columns) for one structure."""
+    atoms = read_pdb(filename)
+    res = residue_index(atoms)
+    table = residue_table(atoms)
+    refs = reference_indices(atoms, references)
+    labels = shell_labels(edges)
+    name = os.path.basename(filename)
+
+    columns = {key: [] for key in COLUMNS}
+    for ref, found in zip(references, shell_membership(atoms["xyz"], res, refs, edges)):
+        if found is None:
+            continue
+        residues, dist, closest, shell = found
+        keep = ~np.isin(table["resseq"][residues], list(exclude))
+        residues, dist, closest, shell = residues[keep], dist[keep], closest[keep], shell[keep]
+        order = np.argsort(dist)
+        columns["structure"].extend([name] * len(order))
+        columns["reference"].extend([ref] * len(order))
+        columns["chain"].extend(table["chain"][residues[order]].tolist())
+        columns["resseq"].extend(table["resseq"][residues[order]].tolist())
+        columns["resname"].extend(table["resname"][residues[order]].tolist())
+        columns["min_distance"].extend(np.round(dist[order], 3).tolist())
+        columns["closest_atom"].extend(atoms["name"][closest[order]].tolist())
+        columns["shell"].extend(labels[s] for s in shell[order])
+    return columns
+
+
+def _classify(args):
+    return classify_structure(*args)
+
+
+def classify_files(filenames, references=DEFAULT_REFERENCES, edges=DEFAULT_SHELLS,
+                   exclude=(), jobs=None):
+    """Classify many structures in parallel; returns one merged dict of columns."""
+    tasks = [(f, tuple(references), tuple(edges), tuple(exclude)) for f in filenames]
+    merged = {key: [] for key in COLUMNS}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for columns in pool.map(_classify, tasks):
+            for key in COLUMNS:
+                merged[key].extend(columns[key])
+    return merged
+
+
+def write_columns(columns, output):
+    if output.endswith(".npz"):
+        np.savez_compressed(output, **{key: np.array(values) for key, values in columns.items()})
+        return
+    with open(output, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(zip(*(columns[key] for key in COLUMNS)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Residue shells around reference atoms")
+    parser.add_argument("paths", nargs="*", default=[os.path.join(HERE, "LMRR_WT2.pdb")],
+                        help="PDB files or directories (default: LMRR_WT2.pdb)")
+    parser.add_argument("--ref", action="append",
+                        help=f"reference atom RESN:NAME (default: {' '.join(DEFAULT_REFERENCES)})")
+    parser.add_argument("--shells", type=float, nargs="+", default=list(DEFAULT_SHELLS),
+                        help="shell edges in Å (default: 0 10 15)")
+    parser.add_argument("--exclude", type=int, nargs="*", default=[],
+                        help="residue numbers to leave out (e.g. the mutated positions)")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default="residue_shells.csv",
+                        help="CSV, or .npz for columnar arrays")
+    args = parser.parse_args()
+
+    edges = sorted(args.shells)
+    filenames = [f for path in args.paths for f in list_pdb_files(path)]
+    columns = classify_files(filenames, args.ref or DEFAULT_REFERENCES, edges,
+                             args.exclude, args.jobs)
+    write_columns(columns, args.output)
+
+    structures = np.array(columns["structure"])
+    references = np.array(columns["reference"])
+    shells = np.array(columns["shell"])
+    labels = shell_labels(edges)
+    print(f"{'Structure':40s} {'Reference':10s} " + " ".join(f"{l:>8s}" for l in labels))
+    for name in dict.fromkeys(columns["structure"]):
+        for ref in dict.fromkeys(references[structures == name].tolist()):
+            sel = (structures == name) & (references == ref)
+            counts = [int((shells[sel] == l).sum()) for l in labels]
+            print(f"{name:40s} {ref:10s} " + " ".join(f"{c:8d}" for c in counts))
+    print(f"\n{len(structures)} residue rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
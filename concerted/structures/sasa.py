@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Shrake-Rupley solvent accessible surface area of the scanned active-site
+residues and the substrate complex, for many mutants and trajectory frames.
+
+hydrophobicity.py only plots the Kyte-Doolittle scale; this gives the
+exposure that goes with it. Every target atom gets a fixed set of points on
+its probe-expanded sphere (golden-spiral, default 200 points). Neighbour
+lists come from one cKDTree query of the target atoms against all solute
+atoms, and a point is buried when it lies inside any neighbour's expanded
+sphere. All (target, neighbour, point) tests of a block of neighbour pairs
+are done in one broadcast and reduced per target with
+np.logical_or.reduceat, so there is no Python loop over atoms or points.
+
+Targets are the 20 scanned positions (Q numbering, as in
+analysis/distance_profiles.py) and all atoms of the substrate / PAF
+residues. Every other solute atom only occludes; water is ignored.
+
+Output is two CSV files:
+
+    <output>_residues.csv  structure, resnum, resname, n_frames,
+                           sasa, sasa_std, apolar, apolar_std, relative
+    <output>_atoms.csv     structure, resnum, resname, atom, element,
+                           n_frames, sasa, sasa_std
+
+in Å². apolar is the carbon + sulphur part of the residue SASA (hydrophobic
+exposure) and relative is sasa divided by the maximum ASA of the residue
+type (Tien et al. 2013), empty for non-standard residues. With --dcd the
+values are means and standard deviations over the frames; one task per
+(structure, DCD file) runs in a process pool.
+
+Usage:
+    python sasa.py [pdb_or_dir ...] [--residues 7 9 ...] [--points 200]
+                   [--dcd "results/{name}/replica*/fep_000_*.dcd" --stride 10] [-o sasa]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "analysis"))
+from pdb_arrays import list_pdb_files, read_pdb, residue_index
+
+DEFAULT_MUTANTS = os.path.join(HERE, "..", "prep_structures", "mutations")
+
+# The 20 alanine-scan / mutant positions (Q numbering)
+SCANNED_RESIDUES = (7, 9, 10, 11, 14, 15, 17, 18, 21, 87, 88, 91, 92, 94, 95, 96, 98, 99,
+                    100, 103)
+SUBSTRATE_RESIDUES = ("IMI", "IND", "HO2", "PAF", "PRD", "UNL")
+SKIP_RESIDUES = ("HOH", "WAT")
+
+PROBE_RADIUS = 1.4        # Å
+N_POINTS = 200
+# Bondi van der Waals radii (Å)
+VDW_RADII = {"H": 1.10, "C": 1.70, "N": 1.55, "O": 1.52, "S": 1.80, "P": 1.80}
+DEFAULT_RADIUS = 1.80
+APOLAR_ELEMENTS = ("C", "S")
+
+# Theoretical maximum ASA (Tien et al. 2013), Å²
+MAX_ASA = {
+    "ALA": 129.0, "ARG": 274.0, "ASN": 195.0, "ASP": 193.0, "CYS": 167.0,
+    "GLN": 225.0, "GLU": 223.0, "GLY": 104.0, "HIS": 224.0, "HID": 224.0,
+    "HIE": 224.0, "HIP": 224.0, "ILE": 197.0, "LEU": 201.0, "LYS": 236.0,
+    "MET": 224.0, "PHE": 240.0, "PRO": 159.0, "SER": 155.0, "THR": 172.0,
+    "TRP": 285.0, "TYR": 263.0, "VAL": 174.0,
+}
+
+PAIR_BLOCK = 20000        # neighbour pairs tested per broadcast
+
+
+def sphere_points(n=N_POINTS):
+    """n roughly uniform unit vectors on a golden-angle spiral."""
+    k = np.arange(n) + 0.5
+    z = 1.0 - 2.0 * k / n
+    r = np.sqrt(1.0 - z * z)
+    phi = np.pi * (3.0 - np.sqrt(5.0)) * k
+    return np.column_stack([r * np.cos(phi), r * np.sin(phi), z])
+
+
+def atom_radii(atoms):
+    return np.array([VDW_RADII.get(e, DEFAULT_RADIUS) for e in atoms["element"]])
+
+
+def select_targets(atoms, residues=SCANNED_RESIDUES, substrates=SUBSTRATE_RESIDUES):
+    """(solute atom indices, target positions within them)."""
+    res = residue_index(atoms)
+    solute = np.flatnonzero(~np.isin(atoms["resname"], SKIP_RESIDUES))
+    wanted = np.isin(res[solute], np.array(residues) - 1) | \
+        np.isin(atoms["resname"][solute], substrates)
+    return solute, np.flatnonzero(wanted)
+
+
+def atom_sasa(xyz, radii, targets, points, probe=PROBE_RADIUS):
+    """
+    Shrake-Rupley SASA of the target atoms (indices into xyz) with every atom
+    in xyz as occluder. Returns one value per target in Å².
+    """
+    expanded = radii + probe
+    tree = cKDTree(xyz)
+    target_tree = cKDTree(xyz[targets])
+    pairs = target_tree.sparse_distance_matrix(tree, expanded[targets].max() + expanded.max(),
+                                               output_type='ndarray')
+    t, j = pairs['i'], pairs['j']
+    # Keep real overlaps and drop the atom itself
+    keep = (pairs['v'] < expanded[targets][t] + expanded[j]) & (targets[t] != j)
+    order = np.argsort(t[keep], kind='stable')
+    t, j = t[keep][order], j[keep][order]
+
+    buried = np.zeros((len(targets), len(points)), dtype=bool)
+    for start in range(0, len(t), PAIR_BLOCK):
+        tb, jb = t[start:start + PAIR_BLOCK], j[start:start + PAIR_BLOCK]
+        surface = xyz[targets[tb], None, :] + expanded[targets[tb], None, None] * points[None]
+        inside = ((surface - xyz[jb, None, :]) ** 2).sum(axis=-1) < expanded[jb, None] ** 2
+        starts = np.flatnonzero(np.r_[True, tb[1:] != tb[:-1]])
+        buried[tb[starts]] |= np.logical_or.reduceat(inside, starts, axis=0)
+
+    exposed = 1.0 - buried.mean(axis=1)
+    return 4.0 * np.pi * expanded[targets] ** 2 * exposed
+
+
+def target_groups(atoms, index):
+    """(residue numbers, residue group of each target atom, apolar mask)."""
+    residue_ids, group = np.unique(residue_index(atoms)[index], return_inverse=True)
+    return residue_ids, group, np.isin(atoms["element"][index], APOLAR_ELEMENTS)
+
+
+def frame_values(sasa, group, apolar, n_res):
+    """Atom SASA followed by residue SASA and residue apolar SASA."""
+    return np.concatenate([sasa, np.bincount(group, sasa, n_res),
+                           np.bincount(group, sasa * apolar, n_res)])
+
+
+def structure_sasa(filename, dcd=None, stride=10, residues=SCANNED_RESIDUES,
+                   n_points=N_POINTS, probe=PROBE_RADIUS):
+    """
+    (filename, n_frames, sum, sum of squares) of frame_values() for the PDB
+    coordinates or for every stride-th frame of one DCD file.
+    """
+    atoms = read_pdb(filename)
+    solute, targets = select_targets(atoms, residues)
+    radii = atom_radii(atoms)[solute]
+    points = sphere_points(n_points)
+    residue_ids, group, apolar = target_groups(atoms, solute[targets])
+
+    if dcd is None:
+        sasa = atom_sasa(atoms["xyz"][solute], radii, targets, points, probe)
+        values = frame_values(sasa, group, apolar, len(residue_ids))
+        return filename, 1, values, values ** 2
+
+    from dcd_reader import DCDFile
+    traj = DCDFile(dcd)
+    if traj.n_atoms != len(atoms["name"]):
+        raise ValueError(f"{dcd}: {traj.n_atoms} atoms, {filename} has {len(atoms['name'])}")
+    n_values = len(targets) + 2 * len(residue_ids)
+    total, total_sq, n_frames = np.zeros(n_values), np.zeros(n_values), 0
+    for _, xyz in traj.iter_chunks(100, atoms=solute, step=stride):
+        for frame in xyz.astype(np.float64):
+            sasa = atom_sasa(frame, radii, targets, points, probe)
+            values = frame_values(sasa, group, apolar, len(residue_ids))
+            total += values
+            total_sq += values ** 2
+            n_frames += 1
+    return filename, n_frames, total, total_sq
+
+
+def _structure_sasa(args):
+    return structure_sasa(*args)
+
+
+def find_tasks(filenames, dcd_pattern=None, stride=10, residues=SCANNED_RESIDUES,
+               n_points=N_POINTS, probe=PROBE_RADIUS):
+    """One task per structure, or per (structure, DCD file) when DCDs match."""
+    tasks = []
+    for filename in filenames:
+        dcds = []
+        if dcd_pattern:
+            name = os.path.splitext(os.path.basename(filename))[0]
+            dcds = sorted(glob.glob(dcd_pattern.format(name=name)))
+        for dcd in dcds or [None]:
+            tasks.append((filename, dcd, stride, tuple(residues), n_points, probe))
+    return tasks
+
+
+def summarize(filename, n_frames, total, total_sq, residues=SCANNED_RESIDUES):
+    """Per-atom and per-residue rows (dicts) for one structure."""
+    atoms = read_pdb(filename)
+    solute, targets = select_targets(atoms, residues)
+    index = solute[targets]
+    residue_ids, group, _ = target_groups(atoms, index)
+    n = max(n_frames, 1)
+    mean = total / n
+    std = np.sqrt(np.maximum(total_sq / n - mean ** 2, 0.0))
+    n_atoms, n_res = len(index), len(residue_ids)
+    name = os.path.splitext(os.path.basename(filename))[0]
+
+    atom_rows = [{"structure": name, "resnum": int(residue_ids[g]) + 1,
+                  "resname": atoms["resname"][i], "atom": atoms["name"][i],
+                  "element": atoms["element"][i], "n_frames": n_frames,
+                  "sasa": mean[k], "sasa_std": std[k]}
+                 for k, (i, g) in enumerate(zip(index, group))]
+
+    first = index[np.unique(group, return_index=True)[1]]
+    residue_rows = []
+    for k, r in enumerate(residue_ids):
+        resname = atoms["resname"][first[k]]
+        sasa, apolar = mean[n_atoms + k], mean[n_atoms + n_res + k]
+        max_asa = MAX_ASA.get(resname)
+        residue_rows.append({
+            "structure": name, "resnum": int(r) + 1, "resname": resname,
+            "n_frames": n_frames, "sasa": sasa, "sasa_std": std[n_atoms + k],
+            "apolar": apolar, "apolar_std": std[n_atoms + n_res + k],
+            "relative": None if max_asa is None else sasa / max_asa})
+    return atom_rows, residue_rows
+
+
+def write_rows(rows, fields, filename):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(["" if row[key] is None else
+                             f"{row[key]:.3f}" if isinstance(row[key], float) else row[key]
+                             for key in fields])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrake-Rupley SASA of the active site")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_MUTANTS],
+                        help="PDB files or directories (default: prep_structures/mutations)")
+    parser.add_argument("--residues", type=int, nargs="+", default=list(SCANNED_RESIDUES),
+                        help="residue numbers (Q numbering) to report")
+    parser.add_argument("--points", type=int, default=N_POINTS, help="sphere points per atom")
+    parser.add_argument("--probe", type=float, default=PROBE_RADIUS)
+    parser.add_argument("--dcd", help="DCD glob per structure for frame averages ({name} = stem)")
+    parser.add_argument("--stride", type=int, default=10, help="use every n-th frame")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("-o", "--output", default="sasa",
+                        help="prefix for <prefix>_residues.csv and <prefix>_atoms.csv")
+    args = parser.parse_args()
+
+    filenames = [f for path in args.paths for f in list_pdb_files(path)]
+    tasks = find_tasks(filenames, args.dcd, args.stride, args.residues, args.points, args.probe)
+    totals = {}
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        for filename, n_frames, total, total_sq in pool.map(_structure_sasa, tasks):
+            if filename in totals:
+                previous = totals[filename]
+                n_frames, total, total_sq = (n_frames + previous[0], total + previous[1],
+                                             total_sq + previous[2])
+            totals[filename] = (n_frames, total, total_sq)
+
+    atom_rows, residue_rows = [], []
+    for filename in filenames:
+        atoms_out, residues_out = summarize(filename, *totals[filename], args.residues)
+        atom_rows.extend(atoms_out)
+        residue_rows.extend(residues_out)
+        substrate = sum(row["sasa"] for row in residues_out
+                        if row["resname"] in SUBSTRATE_RESIDUES)
+        print(f"{os.path.basename(filename):40s} {totals[filename][0]:6d} frame(s) "
+              f"substrate {substrate:8.1f} Å²")
+
+    write_rows(residue_rows, ("structure", "resnum", "resname", "n_frames", "sasa", "sasa_std",
+                              "apolar", "apolar_std", "relative"),
+               f"{args.output}_residues.csv")
+    write_rows(atom_rows, ("structure", "resnum", "resname", "atom", "element", "n_frames",
+                           "sasa", "sasa_std"), f"{args.output}_atoms.csv")
+    print(f"\n{len(residue_rows)} residue rows written to {args.output}_residues.csv, "
+          f"{len(atom_rows)} atom rows to {args.output}_atoms.csv")
+
+
+if __name__ == "__main__":
+    main()